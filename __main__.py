@@ -48,3 +48,5 @@ if __name__ == "__main__":
     w = App(path, chrs, db)
     w.plotChroms(chrs)
     app.exec_()
+    # write peaks still queued by scan windows
+    w.peakQueue.close()
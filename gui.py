@@ -14,6 +14,7 @@ import numpy as np
 
 from . import ms_utils
 from .worker import worker
+from .worker.write_queue import PeakWriteQueue
 
 # app = QtGui.QApplication([])
 
@@ -25,10 +26,22 @@ from .worker import worker
 class ScanWindow(QtGui.QMainWindow):
     """ScanWindow opens on click"""
 
-    def __init__(self, peak_num, mz_arr, int_arr, ret_time, logger, db):
+    def __init__(self,
+                 peak_num,
+                 mz_arr,
+                 int_arr,
+                 ret_time,
+                 logger,
+                 db,
+                 path=None,
+                 picked=(),
+                 peak_queue=None):
         super().__init__()
         self.title = "Scan @" + str(ret_time)
         self.selectedPeaks = []
+        self.path = path  # source file of the spectrum stored in db
+        # [(mz, charge),...] saved in a previous session
+        self.restoredPeaks = [(float(i[0]), int(i[1])) for i in picked]
         self.clicked = 0
         self.xDataPos1 = 0
         self.xDataPos2 = 0
@@ -45,13 +58,26 @@ class ScanWindow(QtGui.QMainWindow):
         self.mz_max = int(mz_arr[-1])
         self.logger = logger
         self.db = db
+        # App's PeakWriteQueue - closing never waits for disk,
+        # without one (or once the App closed it) peaks are written to db directly
+        self.peakQueue = peak_queue
         self.top = 100
         self.left = 100
         self.width = 900
         self.height = 500
         self.initScanUI()
+        self._showRestoredPeaks()
         self.initScanWindow()
 
+    def _showRestoredPeaks(self):
+        for mz, charge in self.restoredPeaks:
+            rowPosition = self.table.rowCount()
+            self.table.insertRow(rowPosition)
+            self.table.setItem(rowPosition, 0,
+                               QtGui.QTableWidgetItem(str(round(mz, 4))))
+            self.table.setItem(rowPosition, 1,
+                               QtGui.QTableWidgetItem(str(charge)))
+
     def initScanWindow(self):
         self.setWindowTitle(self.title)
         self.setGeometry(self.top, self.left, self.width, self.height)
@@ -309,10 +335,18 @@ class ScanWindow(QtGui.QMainWindow):
             | QtGui.QMessageBox.No)
         if close == QtGui.QMessageBox.Yes:
             if self.selectedPeaks:
-                self.db.insert_many_masses_into_curr(self.selectedPeaks)
+                if self.peakQueue is None:
+                    self.db.insert_many_masses_into_curr(self.selectedPeaks)
+                else:
+                    self.peakQueue.insert(self.selectedPeaks)
                 self.logger.debug(
                     f"Saved {len(self.selectedPeaks)} results for peak: {self.peak_num}"
                 )
+            if self.path:
+                (self.peakQueue or self.db).store_picked_peaks(
+                    self.path, self.ret_time, self.peak_num,
+                    [(self.peak_num, *i) for i in self.restoredPeaks] +
+                    self.selectedPeaks)
             event.accept()
         elif close == QtGui.QMessageBox.No:
             self.logger.debug(
@@ -331,6 +365,7 @@ class App(QtGui.QMainWindow):
         self.width = 900
         self.height = 500
         self.scanWin = None
+        self.scanWins = []  # windows restored from previous session
         self.curPeak = 1
         self.click_count = 1
         self.customParams = None
@@ -339,6 +374,8 @@ class App(QtGui.QMainWindow):
         self.chrom_data = chrom_data
         self.worker = worker
         self.db = db
+        # shared by all ScanWindows, closed (flushed) with the app
+        self.peakQueue = PeakWriteQueue(db)
         self.logger = logging.getLogger("GUI")
         self.initUI()
         self.initWindow()
@@ -357,6 +394,7 @@ class App(QtGui.QMainWindow):
         self.refreshButton = QtGui.QPushButton("Refresh")
         self.clearButton = QtGui.QPushButton("Clear")
         self.runButton = QtGui.QPushButton("Run")
+        self.restoreButton = QtGui.QPushButton("Restore Session")
         self.table = QtGui.QTableWidget(0, 3)
         self.header_labels = ['Peak #', "mz", "Charge"]
         self.table.setHorizontalHeaderLabels(self.header_labels)
@@ -436,11 +474,13 @@ class App(QtGui.QMainWindow):
         layout.addWidget(self.refreshButton)
         layout.addWidget(self.runButton)
         layout.addWidget(self.clearButton)
+        layout.addWidget(self.restoreButton)
         self.paramsButton.clicked.connect(self.paramsButtonClicked)
         self.nextPeakButton.clicked.connect(self.nextPeakButtonClicked)
         self.refreshButton.clicked.connect(self.refreshButtonClicked)
         self.clearButton.clicked.connect(self.clearButtonClicked)
         self.runButton.clicked.connect(self.runButtonClicked)
+        self.restoreButton.clicked.connect(self.restoreButtonClicked)
 
         layout.setColumnStretch(0, 0)
         layout.setColumnStretch(1, 3)
@@ -496,8 +536,28 @@ class App(QtGui.QMainWindow):
         except Exception:
             self.logger.error(traceback.format_exc())
 
+    def restoreButtonClicked(self):
+        """Reopens scans stored for this file, without reading the file"""
+        try:
+            self.scanWins = [
+                ScanWindow(
+                    i.peak_num or self.curPeak,
+                    i.mz,
+                    i.intensity,
+                    i.ret_time,
+                    self.logger,
+                    self.db,
+                    path=self.path,
+                    picked=i.picked,
+                    peak_queue=self.peakQueue)
+                for i in self.db.iter_session(self.path)
+            ]
+            self.logger.debug(f"Restored {len(self.scanWins)} scans")
+        except Exception:
+            self.logger.error(traceback.format_exc())
+
     def clearButtonClicked(self):
-        self.db.clear_current_masses()
+        self.peakQueue.clear()
         self.table.clearContents()
         self.table.setRowCount(0)
 
@@ -559,10 +619,35 @@ class App(QtGui.QMainWindow):
         if modifiers == QtCore.Qt.ControlModifier:
             closest_spec = ms_utils.get_closest_point(
                 xpos, self.chrom_data["retention_times"])
-            mz_arr, int_arr, scan_type = ms_utils.get_spectrum(
-                closest_spec, self.path)
-            self.scanWin = ScanWindow(self.curPeak, mz_arr, int_arr,
-                                      closest_spec, self.logger, self.db)
+            stored = self.db.load_spectrum(self.path, closest_spec)
+            if stored is None:
+                mz_arr, int_arr, scan_type = ms_utils.get_spectrum(
+                    closest_spec, self.path)
+                # large BLOB write, kept off the GUI thread
+                self.peakQueue.store_spectrum(self.path, closest_spec, mz_arr,
+                                              int_arr, scan_type, self.curPeak)
+                picked = ()
+            else:
+                mz_arr, int_arr, picked = stored.mz, stored.intensity, stored.picked
+            self.scanWin = ScanWindow(
+                self.curPeak,
+                mz_arr,
+                int_arr,
+                closest_spec,
+                self.logger,
+                self.db,
+                path=self.path,
+                picked=picked,
+                peak_queue=self.peakQueue)
+
+    def closeEvent(self, event):
+        # ScanWindows have no parent - save their peaks before the queue closes
+        for scanWin in [self.scanWin, *self.scanWins]:
+            if scanWin is not None and scanWin.isVisible() and not scanWin.close():
+                event.ignore()
+                return
+        self.peakQueue.close()
+        event.accept()
 
     def mouseMoved(self, event):
         pos = event[0]
@@ -577,6 +662,8 @@ class App(QtGui.QMainWindow):
 
     def refreshTable(self):
         try:
+            # peaks saved by ScanWindows may still be queued
+            self.peakQueue.flush()
             data_tuples = self.db.read_current_masses()
             self._populateTableRows(data_tuples)
         except Exception:
@@ -0,0 +1,68 @@
+"""Benchmarks concurrent asyncio searches against sequential blocking runs.
+
+Uses a local fake Glycomod server (tests/gm_stub.py) with injected latency.
+Run from repository root:
+    python -m scripts.bench_async --searches 20 --latency 0.3
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+
+from worker import aio
+from worker.client import GlycomodClient
+from worker.worker import GlycomodWorker
+from tests.gm_stub import GlycomodStub
+
+MASSES = [(1, 911.30, 1), (2, 1057.33, 1), (3, 1454.0, 1), (4, 1276.47, 1),
+          (5, 1739.61, 1)]
+
+
+def load_cfg():
+    with open(
+            os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                "worker", "config.json"), "r") as cc:
+        return json.load(cc)
+
+
+def run_blocking(cfg, url, searches, chunk_size):
+    client = GlycomodClient(cfg, chunk_size=chunk_size, url=url)
+    for _ in range(searches):
+        gw = GlycomodWorker(cfg=cfg, db=None, client=client)
+        gw.masses_from_db = MASSES
+        gw.masses_from_db_single = gw._get_masses_from_db_single()
+        gw._fetch_gmod_data()
+        gw._create_glycan_objects()
+
+
+async def run_async(cfg, url, searches, chunk_size, rate):
+    client = aio.AsyncGlycomodClient(
+        cfg, rate=rate, burst=rate, chunk_size=chunk_size, url=url)
+    results = await asyncio.gather(
+        *[aio.search(cfg, MASSES, client) for _ in range(searches)])
+    assert all(len(i) == len(MASSES) for i in results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--searches", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--chunk-size", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=50.0)
+    args = parser.parse_args()
+    cfg = load_cfg()
+    with GlycomodStub(latency=args.latency) as stub:
+        start = time.perf_counter()
+        run_blocking(cfg, stub.url, args.searches, args.chunk_size)
+        blocking = time.perf_counter() - start
+        start = time.perf_counter()
+        asyncio.run(
+            run_async(cfg, stub.url, args.searches, args.chunk_size,
+                      args.rate))
+        concurrent = time.perf_counter() - start
+    print(f"{args.searches} searches x {len(MASSES)} masses, "
+          f"latency {args.latency}s, chunk size {args.chunk_size}")
+    print(f"blocking run():      {blocking:.2f}s")
+    print(f"asyncio search():    {concurrent:.2f}s  ({blocking / concurrent:.1f}x)")
@@ -0,0 +1,107 @@
+"""Benchmarks dbutil.DB run inserts and result queries as results table grows.
+
+Results table is filled with runs of --run-size rows up to --rows rows,
+at every checkpoint one more run is inserted through DB.insert_run and
+typical lookups, a keyset page (DB.read_result) and R*Tree searches
+(DB.find_results - mass window, composition in the last day) are timed.
+With indexes (schema migrations) the timings stay flat,
+--no-index drops the indexes to show the full table scans.
+Run from repository root:
+    python -m scripts.bench_db --rows 1000000
+    python -m scripts.bench_db --rows 1000000 --no-index
+"""
+import os
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+
+from worker import dbutil
+
+# (comp_l, comp_s, theorMH, theorMHTag)
+COMPS = [("(Hex)5 (HexNAc)4 (Deoxyhexose)1", "H5N4F1", 1809.666, 1809.666),
+         ("(Hex)3 (HexNAc)2", "H3N2", 911.33, 911.33),
+         ("(Hex)5 (HexNAc)2", "H5N2", 1235.436, 1235.436),
+         ("NOT FOUND", "NOT FOUND", 0.0, 0.0)]
+
+
+def result_rows(n, rnd):
+    """Yields n rows as in GlycomodWorker._prepare_results"""
+    for peak in range(n):
+        measured = round(rnd.uniform(800.0, 4000.0), 2)
+        comp_l, comp_s, theor_mh, theor_mh_tag = COMPS[peak % len(COMPS)]
+        yield (peak, measured, theor_mh, theor_mh_tag, comp_l, comp_s, "", 0.0)
+
+
+def fill(db, runs, run_size, rnd):
+    """Bulk fills history and results with runs of run_size rows"""
+    db.insert_runs(({}, {}, result_rows(run_size, rnd)) for _ in range(runs))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def checkpoint(db, run_size, rnd):
+    """Returns ms timings of insert_run and lookups"""
+    insert, run_id = timed(db.insert_run, {}, {},
+                           list(result_rows(run_size, rnd)))
+    query = db.conn.execute
+    by_run, rows = timed(lambda: query(
+        "SELECT * FROM results WHERE run_id = ?", (run_id, )).fetchall())
+    assert len(rows) == run_size
+    by_peak, _ = timed(lambda: query(
+        "SELECT * FROM results WHERE peak = ? LIMIT 100", (7, )).fetchall())
+    by_mass, _ = timed(lambda: query(
+        "SELECT * FROM results WHERE measured BETWEEN ? AND ? LIMIT 100",
+        (1438.3, 1438.7)).fetchall())
+    since = (datetime.datetime.now() - datetime.timedelta(hours=1)).isoformat()
+    by_date, _ = timed(lambda: query(
+        "SELECT id FROM history WHERE date >= ? ORDER BY date LIMIT 10",
+        (since, )).fetchall())
+    # used to number runs before run_id came from history.id
+    last_run, _ = timed(db._get_last_result_id)
+    # keyset page from the middle of the table
+    middle = db.conn.execute("SELECT MAX(rowid) FROM results").fetchone()[0] // 2
+    page, rows = timed(
+        lambda: db.read_result(middle, 100, composition="H5N4F1"))
+    assert len(rows) == 100
+    rtree_mass, _ = timed(lambda: db.find_results(1438.3, 1438.7, limit=100))
+    rtree_comp, _ = timed(lambda: db.find_results(
+        min_mass=1438.3, max_mass=1438.7, composition="H5N4F1", start=since))
+    return (insert, by_run, by_peak, by_mass, by_date, last_run, page,
+            rtree_mass, rtree_comp)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--run-size", type=int, default=1000)
+    parser.add_argument("--checkpoints", type=int, default=5)
+    parser.add_argument("--no-index", action="store_true")
+    args = parser.parse_args()
+    rnd = random.Random(0)
+    path = tempfile.mkdtemp()
+    db = dbutil.DB(os.path.join(path, "bench.db"))
+    if args.no_index:
+        for name in ("results_run_id", "results_peak", "results_measured",
+                     "history_date", "results_comp_id", "compositions_comp_s"):
+            db.conn.execute(f"DROP INDEX {name}")
+    try:
+        runs = args.rows // args.run_size // args.checkpoints
+        print(f"{'rows':>9} {'insert_run':>11} {'run_id':>8} {'peak':>8} "
+              f"{'measured':>9} {'date':>8} {'MAX(run_id)':>12} {'page':>8} "
+              f"{'rtree':>8} {'rtree+H5N4F1':>13}  (ms)")
+        for _ in range(args.checkpoints):
+            fill(db, runs, args.run_size, rnd)
+            size = db.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            print(f"{size:>9} " + " ".join(
+                f"{t:>{w}.2f}" for t, w in zip(
+                    checkpoint(db, args.run_size, rnd), (11, 8, 8, 9, 8, 12, 8, 8, 13))))
+    finally:
+        db.close()
+        shutil.rmtree(path)
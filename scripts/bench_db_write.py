@@ -0,0 +1,69 @@
+"""Benchmarks dbutil.DB write throughput (result rows per second).
+
+For every batch size results are written into a fresh on-disk database
+in default mode (WAL) and in bulk mode (BULK_PRAGMAS: synchronous=NORMAL,
+64 MB cache), as one run (DB.insert_run) and as runs of --run-size rows
+committed one by one or loaded in a single transaction (DB.insert_runs).
+Rows are fed from generators, no intermediate lists are built.
+Run from repository root:
+    python -m scripts.bench_db_write --sizes 10000 100000 1000000
+"""
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from worker import dbutil
+from scripts.bench_db import result_rows
+
+
+def split_runs(size, run_size, rnd):
+    for start in range(0, size, run_size):
+        yield {}, {}, result_rows(min(run_size, size - start), rnd)
+
+
+def write_one_run(db, size, run_size, rnd):
+    db.insert_run({}, {}, result_rows(size, rnd))
+
+
+def write_run_by_run(db, size, run_size, rnd):
+    for data, params, results in split_runs(size, run_size, rnd):
+        db.insert_run(data, params, results)
+
+
+def write_runs(db, size, run_size, rnd):
+    db.insert_runs(split_runs(size, run_size, rnd))
+
+
+def rows_per_second(write, size, run_size, bulk):
+    path = tempfile.mkdtemp()
+    try:
+        db = dbutil.DB(os.path.join(path, "bench.db"), bulk=bulk)
+        start = time.perf_counter()
+        write(db, size, run_size, random.Random(0))
+        elapsed = time.perf_counter() - start
+        written = db.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        assert written == size
+        db.close()
+        return size / elapsed
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--run-size", type=int, default=1000)
+    args = parser.parse_args()
+    writes = (("insert_run, one run", write_one_run),
+              (f"insert_run per {args.run_size} rows", write_run_by_run),
+              (f"insert_runs, {args.run_size}-row runs", write_runs))
+    print(f"{'rows':>8} {'write':<28} {'default':>10} {'bulk':>10}  (rows/s)")
+    for size in args.sizes:
+        for name, write in writes:
+            default = rows_per_second(write, size, args.run_size, False)
+            bulk = rows_per_second(write, size, args.run_size, True)
+            print(f"{size:>8} {name:<28} {default:>10,.0f} {bulk:>10,.0f}")
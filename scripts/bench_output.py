@@ -0,0 +1,94 @@
+"""Benchmarks GlycomodWorker.output_csv/output_text exports against
+the pandas DataFrame path and the report built as one string.
+
+Fills a result store from a generated Glycomod page with --masses masses
+(tests/test_html fixture sections, see bench_parser) and writes it as csv
+through ResultStore.to_frame().to_csv (the previous pandas path), streamed
+by ResultStore.write_csv and, if pyarrow is installed, as Parquet.
+Text reports are written from ResultStore.to_text (one string)
+and streamed line by line by ResultStore.write_text.
+Peak memory of every export is traced with tracemalloc in a second run.
+Run from repository root:
+    python -m scripts.bench_output --masses 50000
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+
+from worker.parser import parse_gm_stream
+from worker.worker import GlycomodWorker
+from scripts.bench_parser import generate_page, load_cfg
+
+
+def filled_worker(cfg, n_masses):
+    worker = GlycomodWorker(cfg=cfg, db=None)
+    worker.records = parse_gm_stream(generate_page(n_masses), worker.registry)
+    worker.masses_from_db = [(n + 1, i.user_mass)
+                             for n, i in enumerate(worker.records)]
+    worker._create_glycan_objects()
+    return worker
+
+
+def pandas_csv(store, col_names, path):
+    store.to_frame(col_names).to_csv(path, index=False)
+
+
+def streamed_csv(store, col_names, path):
+    with open(path, "w", newline="") as f:
+        store.write_csv(f, col_names)
+
+
+def parquet(store, col_names, path):
+    store.write_parquet(path, col_names)
+
+
+def text_string(store, col_names, path):
+    with open(path, "w") as f:
+        f.write(store.to_text())
+
+
+def streamed_text(store, col_names, path):
+    with open(path, "w") as f:
+        store.write_text(f)
+
+
+def measured(export, store, col_names, path):
+    """Returns (seconds, peak MB, file MB) of export,
+    timed without tracing - tracemalloc slows allocations down"""
+    start = time.perf_counter()
+    export(store, col_names, path)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    export(store, col_names, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6, os.path.getsize(path) / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--masses", type=int, default=50000)
+    args = parser.parse_args()
+    cfg = load_cfg()
+    store = filled_worker(cfg, args.masses).compositions
+    exports = [("pandas to_csv", pandas_csv, ".csv"),
+               ("ResultStore.write_csv", streamed_csv, ".csv"),
+               ("ResultStore.to_text", text_string, ".txt"),
+               ("ResultStore.write_text", streamed_text, ".txt")]
+    if importlib.util.find_spec("pyarrow"):
+        exports.append(("ResultStore.write_parquet", parquet, ".parquet"))
+    path = tempfile.mkdtemp()
+    try:
+        print(f"{args.masses} masses, {len(store.column('delta'))} rows")
+        print(f"{'export':<26} {'time':>8} {'peak MB':>8} {'file MB':>8}")
+        for name, export, extension in exports:
+            elapsed, peak, size = measured(
+                export, store, cfg["col_names"],
+                os.path.join(path, "results" + extension))
+            print(f"{name:<26} {elapsed:>7.3f}s {peak:>8.1f} {size:>8.1f}")
+    finally:
+        shutil.rmtree(path)
@@ -0,0 +1,58 @@
+"""Benchmarks the streaming parser against the BeautifulSoup/html5lib parser.
+
+Generates a Glycomod results page with --masses masses from tests/test_html
+fixture sections (tests/gm_stub.py) and times both parsers on it.
+Run from repository root:
+    python -m scripts.bench_parser --masses 5000
+"""
+import os
+import json
+import time
+import argparse
+
+from worker.parser import parse_gm_html, parse_gm_stream, iter_gm_records
+from worker.utils import CompositionRegistry
+from tests.gm_stub import load_sections, load_template, render_page
+
+
+def generate_page(n_masses):
+    sections = load_sections()
+    masses = [f"{mass:.2f}" for mass in sections]
+    # masses without fixture section are rendered as "0 structures found."
+    masses += ["1500.00", "2500.00"]
+    return render_page([masses[i % len(masses)] for i in range(n_masses)],
+                       sections, load_template()).encode("utf-8")
+
+
+def load_cfg():
+    with open(
+            os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                "worker", "config.json"), "r") as cc:
+        return json.load(cc)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--masses", type=int, default=5000)
+    parser.add_argument("--skip-soup", action="store_true")
+    args = parser.parse_args()
+    registry = CompositionRegistry(load_cfg())
+    page = generate_page(args.masses)
+    print(f"{args.masses} masses, {len(page) / 1e6:.1f} MB page")
+    chunks = [page[i:i + 65536] for i in range(0, len(page), 65536)]
+    stream, parsed = timed(parse_gm_stream, page, registry)
+    chunked, _ = timed(lambda: list(iter_gm_records(chunks, registry)))
+    assert len(parsed) == args.masses
+    print(f"parse_gm_stream:          {stream:.3f}s")
+    print(f"iter_gm_records (64 kB):  {chunked:.3f}s")
+    if not args.skip_soup:
+        soup, parsed_soup = timed(parse_gm_html, page)
+        assert len(parsed_soup) == args.masses
+        print(f"parse_gm_html (html5lib): {soup:.3f}s  ({soup / stream:.0f}x)")
@@ -0,0 +1,103 @@
+"""Benchmarks the full GlycomodWorker.run pipeline offline from recorded responses.
+
+Responses are recorded once (worker.replay.RecordingAdapter) and replayed
+(worker.replay.ReplayAdapter) with --latency seconds of simulated network time,
+so repeated runs are deterministic and need no network.
+With --chunk-size masses are searched through GlycomodWorker.iter_run
+with --prefetch chunks in flight, time to the first saved chunk and
+tracemalloc peak of one run are reported.
+By default responses are recorded from the local fake Glycomod server
+(tests/gm_stub.py), --live records from config.json/"gmod_post_link" instead.
+Run from repository root:
+    python -m scripts.bench_worker --masses 2000 --runs 5 --latency 0.5
+    python -m scripts.bench_worker --masses 20000 --chunk-size 500
+    python -m scripts.bench_worker --record-dir recorded --live
+"""
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import requests
+
+from worker import dbutil
+from worker.replay import recording_session, replay_session
+from worker.worker import GlycomodWorker
+from scripts.bench_parser import load_cfg
+from tests.gm_stub import GlycomodStub, load_sections
+
+
+def peak_masses(n_masses):
+    masses = [f"{mass:.2f}" for mass in load_sections()]
+    masses += ["1500.00", "2500.00"]  # NOT FOUND
+    return [(str(i + 1), masses[i % len(masses)]) for i in range(n_masses)]
+
+
+def run_worker(cfg, peaks, session, chunk_size=None, prefetch=4):
+    """Runs GlycomodWorker.iter_run into in-memory db,
+    returns (number of result rows, seconds to the first chunk)"""
+    db = dbutil.DB(":memory:")
+    dbutil.setup_db_tables(db.conn)
+    gw = GlycomodWorker(cfg=cfg, db=db, session=session)
+    gw.masses_from_db = list(peaks)
+    start = time.perf_counter()
+    first = None
+    for _ in gw.iter_run(chunk_size, prefetch=prefetch):
+        first = first or time.perf_counter() - start
+    rows = db.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    db.close()
+    return rows, first
+
+
+def record(cfg, peaks, path, live, chunk_size=None):
+    if live:
+        return run_worker(cfg, peaks, recording_session(path), chunk_size)
+    with GlycomodStub() as stub:
+        return run_worker(
+            dict(cfg, gmod_post_link=stub.url), peaks,
+            recording_session(path), chunk_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--masses", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument(
+        "--record-dir",
+        help="keep recordings here and reuse them in later runs")
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--chunk-size", type=int)
+    parser.add_argument("--prefetch", type=int, default=4)
+    args = parser.parse_args()
+    cfg = load_cfg()
+    peaks = peak_masses(args.masses)
+    path = args.record_dir or tempfile.mkdtemp()
+    try:
+        session = replay_session(path, latency=args.latency)
+        try:
+            run_worker(cfg, peaks, session, args.chunk_size)
+        except requests.ConnectionError:  # not recorded yet
+            start = time.perf_counter()
+            record(cfg, peaks, path, args.live, args.chunk_size)
+            print(f"recorded in {time.perf_counter() - start:.2f}s")
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            rows, first = run_worker(cfg, peaks, session, args.chunk_size,
+                                     args.prefetch)
+            timings.append(time.perf_counter() - start)
+        print(f"{args.masses} masses, {rows} result rows, "
+              f"latency {args.latency}s, {args.runs} runs, "
+              f"chunk size {args.chunk_size or 'all'}, prefetch {args.prefetch}")
+        print(f"GlycomodWorker.run:  best {min(timings):.3f}s, "
+              f"mean {sum(timings) / len(timings):.3f}s, "
+              f"first chunk {first:.3f}s")
+        tracemalloc.start()
+        run_worker(cfg, peaks, session, args.chunk_size, args.prefetch)
+        print(f"peak memory {tracemalloc.get_traced_memory()[1] / 1e6:.1f} MB")
+        tracemalloc.stop()
+    finally:
+        if args.record_dir is None:
+            shutil.rmtree(path)
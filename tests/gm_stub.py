@@ -0,0 +1,127 @@
+import os
+import re
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests_toolbelt.multipart.decoder import MultipartDecoder
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+HTML_DIR = os.path.join(THIS_DIR, 'test_html')
+SECTION_START = '<table class="glycomod2" width="100%" border="3">\n</table><hr>'
+SECTION_END = '<br><!-- sib_body -->'
+NOT_FOUND = """<h3>User mass: {mass}
+<br>Adduct ([M+H]<sup>+</sup>): 1.00727<br>
+Derivative mass (Free reducing end): 18.0105546<br>
+</h3>
+<table class="glycomod2"></table><p>
+0 structures found.
+"""
+
+
+def load_sections():
+    """Returns {user mass: html section} for every mass in test_html fixtures"""
+    sections = {}
+    for file_name in sorted(os.listdir(HTML_DIR)):
+        if not file_name.endswith(".html"):
+            continue
+        with open(os.path.join(HTML_DIR, file_name), "r") as f:
+            html = f.read()
+        body = html[html.index(SECTION_START):html.index(SECTION_END)]
+        for section in body.split(SECTION_START)[1:]:
+            mass = re.search(r"User mass: ([\d.]+)", section).group(1)
+            sections.setdefault(float(mass), section)
+    return sections
+
+
+def load_template():
+    with open(os.path.join(HTML_DIR, "minimal_test.html"), "r") as f:
+        html = f.read()
+    return html[:html.index(SECTION_START)], html[html.index(SECTION_END):]
+
+
+def render_page(masses, sections, template):
+    """Renders Glycomod results page for masses from fixture sections"""
+    head, tail = template
+    body = "".join(
+        SECTION_START + sections.get(float(i), NOT_FOUND.format(mass=i))
+        for i in masses)
+    return head + body + tail
+
+
+class GlycomodStub:
+    """Local HTTP server answering Glycomod searches from tests/test_html fixtures
+    param::latency seconds added to every response
+    param::fail_first number of initial requests answered with 503
+    param::redirect_first number of initial requests redirected (307)
+        back to url
+    max_in_flight is the largest number of requests handled at once"""
+
+    def __init__(self, latency=0.0, fail_first=0, redirect_first=0):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.redirect_first = redirect_first
+        self.requests = []  # list of submitted mass lists
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.sections = load_sections()
+        self.template = load_template()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/glycomod.pl"
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                masses = []
+                for part in MultipartDecoder(
+                        body, self.headers["Content-Type"]).parts:
+                    disposition = part.headers[b"Content-Disposition"].decode()
+                    if 'name="Masses"' in disposition:
+                        masses = part.text.split()
+                with stub.lock:
+                    stub.requests.append(masses)
+                    failing = len(stub.requests) <= stub.fail_first
+                    redirecting = len(stub.requests) <= stub.redirect_first
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight,
+                                             stub.in_flight)
+                time.sleep(stub.latency)
+                with stub.lock:
+                    stub.in_flight -= 1
+                if redirecting:
+                    self.send_response(307)
+                    self.send_header("Location", self.path)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if failing:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                page = render_page(masses, stub.sections,
+                                   stub.template).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=UTF-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
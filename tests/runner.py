@@ -1,6 +1,16 @@
 import unittest
 from . import test_utils
 from . import test_worker
+from . import test_isotopes
+from . import test_cache
+from . import test_client
+from . import test_aio
+from . import test_parser
+from . import test_results
+from . import test_replay
+from . import test_dbutil
+from . import test_write_queue
+from . import test_gui
 
 # initialize the test suite
 loader = unittest.TestLoader()
@@ -9,6 +19,16 @@ suite = unittest.TestSuite()
 # add tests to the test suite
 suite.addTests(loader.loadTestsFromModule(test_utils))
 suite.addTests(loader.loadTestsFromModule(test_worker))
+suite.addTests(loader.loadTestsFromModule(test_isotopes))
+suite.addTests(loader.loadTestsFromModule(test_cache))
+suite.addTests(loader.loadTestsFromModule(test_client))
+suite.addTests(loader.loadTestsFromModule(test_aio))
+suite.addTests(loader.loadTestsFromModule(test_parser))
+suite.addTests(loader.loadTestsFromModule(test_results))
+suite.addTests(loader.loadTestsFromModule(test_replay))
+suite.addTests(loader.loadTestsFromModule(test_dbutil))
+suite.addTests(loader.loadTestsFromModule(test_write_queue))
+suite.addTests(loader.loadTestsFromModule(test_gui))
 
 # initialize a runner, pass it your suite and run it
 runner = unittest.TextTestRunner(verbosity=3)
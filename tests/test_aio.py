@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import asyncio
+import unittest
+
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+from worker import aio
+from worker.cache import GlycomodCache
+from worker.dbutil import DB
+from tests.gm_stub import GlycomodStub
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestAio(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestAio, cls).setUpClass()
+        cls.cfg = prepare_cfg()
+
+    def test_dechunk(self):
+        self.assertEqual(
+            aio._dechunk(b"4\r\nWiki\r\n6;ext\r\npedia \r\n0\r\n\r\n"),
+            b"Wikipedia ")
+
+    def test_rate_limiter(self):
+        async def acquire_many(limiter, n):
+            for _ in range(n):
+                await limiter.acquire()
+
+        limiter_rate = 20.0
+        start = time.perf_counter()
+        asyncio.run(acquire_many(aio.RateLimiter(limiter_rate, burst=1), 5))
+        # first token is available immediately, the rest at 1/rate intervals
+        self.assertGreaterEqual(time.perf_counter() - start, 4 / limiter_rate * 0.9)
+
+    def test_concurrent_searches(self):
+        masses = [(1, 911.30, 1), (2, 1057.33, 1), (3, 1452.01, 1)]
+
+        async def run_searches(url):
+            client = aio.AsyncGlycomodClient(
+                TestAio.cfg, rate=100, burst=100, chunk_size=2, url=url)
+            return await asyncio.gather(*[
+                aio.search(TestAio.cfg, masses, client) for _ in range(4)
+            ])
+
+        with GlycomodStub(latency=0.2) as stub:
+            results = asyncio.run(run_searches(stub.url))
+        self.assertEqual(len(stub.requests), 8)
+        # requests of all searches ran concurrently
+        self.assertGreater(stub.max_in_flight, 1)
+        for compositions in results:
+            self.assertEqual([i.peak_number for i in compositions], [1, 2, 3])
+            self.assertEqual(
+                compositions[2].glycomod_structures[0].long_notation,
+                "NOT FOUND")
+
+    def test_retry(self):
+        async def run_search(url):
+            client = aio.AsyncGlycomodClient(
+                TestAio.cfg, rate=100, burst=100, backoff=0.0, url=url)
+            return await aio.search(TestAio.cfg, [(1, 911.30, 1)], client)
+
+        with GlycomodStub(fail_first=1) as stub:
+            compositions = asyncio.run(run_search(stub.url))
+        self.assertEqual(len(stub.requests), 2)
+        self.assertEqual(compositions[0].glycomod_structures[0].short_notation,
+                         "H3N2")
+
+    def test_redirect(self):
+        async def run_search(url):
+            client = aio.AsyncGlycomodClient(
+                TestAio.cfg, rate=100, burst=100, url=url)
+            return await aio.search(TestAio.cfg, [(1, 911.30, 1)], client)
+
+        with GlycomodStub(redirect_first=1) as stub:
+            compositions = asyncio.run(run_search(stub.url))
+        # redirected POST is repeated with its form
+        self.assertEqual(stub.requests, [["911.3"], ["911.3"]])
+        self.assertEqual(compositions[0].glycomod_structures[0].short_notation,
+                         "H3N2")
+        form = MultipartEncoder(fields={"Masses": "911.3"})
+        with GlycomodStub(redirect_first=10) as stub:
+            with self.assertRaises(aio.GlycomodHTTPError):
+                asyncio.run(aio.http_post(
+                    stub.url, form.to_string(),
+                    {"Content-Type": form.content_type}, 10, max_redirects=2))
+        self.assertEqual(len(stub.requests), 3)
+
+    def test_timeout(self):
+        async def run_search(url):
+            client = aio.AsyncGlycomodClient(
+                TestAio.cfg, rate=100, burst=100, timeout=0.3, retries=0,
+                url=url)
+            return await aio.search(TestAio.cfg, [(1, 911.30, 1)], client)
+
+        # every response is fast enough, the redirected exchange is not
+        with GlycomodStub(latency=0.2, redirect_first=1) as stub:
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(run_search(stub.url))
+
+    def test_client_reused_by_loops(self):
+        client = aio.AsyncGlycomodClient(TestAio.cfg, rate=100, burst=100)
+        with GlycomodStub() as stub:
+            client.url = stub.url
+            for _ in range(2):
+                compositions = asyncio.run(
+                    aio.search(TestAio.cfg, [(1, 911.30, 1)], client))
+        self.assertEqual(len(stub.requests), 2)
+        self.assertEqual(len(compositions), 1)
+
+    def test_cache(self):
+        async def run_search(url, cache):
+            client = aio.AsyncGlycomodClient(
+                TestAio.cfg, rate=100, burst=100, url=url)
+            await aio.search(TestAio.cfg, [(1, 911.30, 1)], client, cache=cache)
+            return await aio.search(TestAio.cfg,
+                                    [(1, 911.30, 1), (2, 1057.33, 1)],
+                                    client, cache=cache)
+
+        cache = GlycomodCache(":memory:")
+        with GlycomodStub() as stub:
+            compositions = asyncio.run(run_search(stub.url, cache))
+        self.assertEqual(stub.requests, [["911.3"], ["1057.33"]])
+        self.assertEqual([i.peak_number for i in compositions], [1, 2])
+
+    def test_save_and_reuse_results(self):
+        masses = [(1, 911.30, 1), (2, 1057.33, 1)]
+
+        async def run_search(url, db):
+            client = aio.AsyncGlycomodClient(
+                TestAio.cfg, rate=100, burst=100, url=url)
+            first = await aio.search(TestAio.cfg, masses, client, save=True,
+                                     db=db, reuse_results=True)
+            second = await aio.search(TestAio.cfg, masses, client,
+                                      db=db, reuse_results=True)
+            return first, second
+
+        db = DB(":memory:")
+        with GlycomodStub() as stub:
+            first, second = asyncio.run(run_search(stub.url, db))
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(list(second), list(first))
+        self.assertEqual(
+            db.conn.execute("SELECT COUNT(*) FROM history").fetchone(), (1, ))
+
+
+def prepare_cfg():
+    with open(os.path.join(THIS_DIR, "test_cfg.json"), "r") as f:
+        cfg = json.load(f)
+    return cfg
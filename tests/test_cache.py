@@ -0,0 +1,109 @@
+import os
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from worker.cache import GlycomodCache
+from worker.parser import parse_gm_stream
+from worker.utils import CompositionRegistry
+from worker.worker import GlycomodWorker as GW
+from tests.gm_stub import GlycomodStub
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestGlycomodCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestGlycomodCache, cls).setUpClass()
+        cls.cfg = prepare_cfg()
+
+    def prepare_worker(self, cache):
+        worker = GW(cfg=TestGlycomodCache.cfg, db=None, cache=cache)
+        worker._build_gm_form("")
+        return worker
+
+    def test_exact_mass_hit(self):
+        cache = GlycomodCache(":memory:")
+        worker = self.prepare_worker(cache)
+        records = prepare_records("minimal_test_w_multi_matched.html")
+        cache.store(worker.form_fields, records)
+        served = cache.lookup(worker.form_fields, [1057.4, 1454.0])
+        self.assertEqual(served[0], records[1])
+        self.assertEqual(served[1], records[0])
+        self.assertEqual(len(served[1].hits), 3)
+        self.assertEqual(cache.hit_rate, 1.0)
+
+    def test_tolerance_aware_hit(self):
+        cache = GlycomodCache(":memory:", slack=0.1)
+        worker = self.prepare_worker(cache)
+        records = prepare_records("minimal_test_w_multi_matched.html")
+        cache.store(worker.form_fields, records)
+        served = cache.lookup(worker.form_fields, [1454.05, 1454.2])
+        self.assertEqual(list(served.keys()), [0])
+        # delta 0.48 shifted out of tolerance, the rest shifted by 0.05
+        self.assertEqual(served[0].user_mass, 1454.05)
+        self.assertEqual([i[:3] for i in served[0].hits], [
+            (1435.32, -0.287, '(Hex)1 (HexNAc)3 (Deoxyhexose)2 (Pent)1 (Sulph)3'),
+            (1435.362, -0.329, '(Hex)4 (HexNAc)1 (Deoxyhexose)2 (Pent)1 (Sulph)2')
+        ])
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_different_params_miss(self):
+        cache = GlycomodCache(":memory:")
+        worker = self.prepare_worker(cache)
+        records = prepare_records("minimal_test_w_multi_matched.html")
+        cache.store(worker.form_fields, records)
+        other_params = dict(worker.form_fields, NeuGcpres="yes")
+        self.assertEqual(cache.lookup(other_params, [1454.0]), {})
+
+    def test_eviction(self):
+        cache = GlycomodCache(":memory:", max_entries=1)
+        worker = self.prepare_worker(cache)
+        records = prepare_records("minimal_test_w_multi_matched.html")
+        cache.store(worker.form_fields, records)
+        count = cache.conn.execute("SELECT COUNT(*) FROM gm_cache").fetchone()
+        self.assertEqual(count[0], 1)
+
+    def test_threads_share_cache(self):
+        cache = GlycomodCache(":memory:")
+        worker = self.prepare_worker(cache)
+        records = prepare_records("minimal_test_w_multi_matched.html")
+
+        def store_and_lookup(record):
+            cache.store(worker.form_fields, [record])
+            return cache.lookup(worker.form_fields, [record.user_mass])
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            served = list(executor.map(store_and_lookup, records * 4))
+        self.assertEqual([len(i) for i in served], [1] * len(records) * 4)
+        self.assertEqual((cache.hits, cache.misses), (len(records) * 4, 0))
+
+    def test_worker_fetches_only_uncached(self):
+        cache = GlycomodCache(":memory:")
+        records = prepare_records("minimal_test_w_multi_matched.html")
+        with GlycomodStub() as stub:
+            worker = GW(cfg=dict(TestGlycomodCache.cfg, gmod_post_link=stub.url),
+                        db=None, cache=cache)
+            worker._build_gm_form("")
+            cache.store(worker.form_fields, records[:1])
+            worker.masses_from_db = [("1", "911.30"), ("2", "1454.0"), ("3", "1057.33")]
+            worker._fetch_gmod_data()
+        self.assertEqual(stub.requests, [["911.30", "1057.33"]])
+        self.assertEqual([i.user_mass for i in worker.records],
+                         [911.30, 1454.0, 1057.33])
+        worker._create_glycan_objects()
+        self.assertEqual([i.peak_number for i in worker.compositions], [1, 2, 3])
+        self.assertEqual(len(worker.compositions[1].glycomod_structures), 3)
+
+
+def prepare_records(file_name):
+    with open(os.path.join(THIS_DIR, 'test_html', file_name), "r") as f:
+        return parse_gm_stream(f.read(), CompositionRegistry(prepare_cfg()))
+
+
+def prepare_cfg():
+    with open(os.path.join(THIS_DIR, "test_cfg.json"), "r") as f:
+        cfg = json.load(f)
+    return cfg
@@ -0,0 +1,80 @@
+import os
+import json
+import unittest
+
+import requests
+
+from worker.client import GlycomodClient, chunk_masses
+from worker.worker import GlycomodWorker as GW
+from tests.gm_stub import GlycomodStub
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+MASSES = ["1276.47", "911.30", "1454.0", "1452.01", "1057.33", "1739.61"]
+
+
+class TestGlycomodClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestGlycomodClient, cls).setUpClass()
+        cls.cfg = prepare_cfg()
+        cls.form_fields = prepare_form_fields(cls.cfg)
+
+    def test_chunk_masses(self):
+        self.assertEqual(
+            chunk_masses(MASSES, 4), [MASSES[:4], MASSES[4:]])
+        self.assertEqual(chunk_masses([], 4), [])
+
+    def test_search_in_peak_order(self):
+        with GlycomodStub(latency=0.05) as stub:
+            client = GlycomodClient(
+                TestGlycomodClient.cfg, chunk_size=2, max_workers=3, url=stub.url)
+            records = client.search(TestGlycomodClient.form_fields, MASSES)
+        self.assertEqual(sorted(stub.requests), sorted(chunk_masses(MASSES, 2)))
+        self.assertEqual([i.user_mass for i in records],
+                         [float(i) for i in MASSES])
+        self.assertEqual(records[1].hits[0][:3],
+                         (892.317, -0.034, '(Hex)3 (HexNAc)2'))
+        self.assertEqual(records[3].hits, ())
+        self.assertEqual(len(records[2].hits), 3)
+
+    def test_retry(self):
+        with GlycomodStub(fail_first=2) as stub:
+            client = GlycomodClient(
+                TestGlycomodClient.cfg, chunk_size=10, retries=2, backoff=0.0,
+                url=stub.url)
+            records = client.search(TestGlycomodClient.form_fields, MASSES[:2])
+        self.assertEqual(len(stub.requests), 3)
+        self.assertEqual(len(records), 2)
+
+    def test_retries_exhausted(self):
+        with GlycomodStub(fail_first=5) as stub:
+            client = GlycomodClient(
+                TestGlycomodClient.cfg, retries=1, backoff=0.0, url=stub.url)
+            with self.assertRaises(requests.HTTPError):
+                client.search(TestGlycomodClient.form_fields, MASSES[:2])
+
+    def test_worker_with_client(self):
+        with GlycomodStub() as stub:
+            client = GlycomodClient(
+                TestGlycomodClient.cfg, chunk_size=1, url=stub.url)
+            worker = GW(cfg=TestGlycomodClient.cfg, db=None, client=client)
+            worker.masses_from_db = [("1", "911.30"), ("2", "1057.33")]
+            worker._fetch_gmod_data()
+        worker._create_glycan_objects()
+        self.assertEqual(len(stub.requests), 2)
+        self.assertEqual([i.peak_number for i in worker.compositions], [1, 2])
+        self.assertEqual(
+            worker.compositions[1].glycomod_structures[0].short_notation,
+            "H3N2F1")
+
+
+def prepare_form_fields(cfg):
+    worker = GW(cfg=cfg, db=None)
+    worker._build_gm_form("")
+    return worker.form_fields
+
+
+def prepare_cfg():
+    with open(os.path.join(THIS_DIR, "test_cfg.json"), "r") as f:
+        cfg = json.load(f)
+    return cfg
@@ -0,0 +1,545 @@
+import io
+import os
+import csv
+import json
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+import subprocess
+
+import numpy as np
+
+from worker import dbutil
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RESULT = (1, 911.3, 892.317, 893.324, "(Hex)3 (HexNAc)2", "H3N2", "", 0.0)
+
+
+def prepare_results(n_runs, n_peaks):
+    """Returns DB with n_runs runs, peaks 1..n_peaks each, H3N2 on odd peaks"""
+    db = dbutil.DB(":memory:")
+    db.insert_runs(({}, {}, [(peak, 900.0 + peak + run / 100, 0.0, 0.0,
+                              *(("(Hex)3 (HexNAc)2", "H3N2") if peak % 2 else
+                                ("(Hex)5 (HexNAc)2", "H5N2")), "", 0.0)
+                             for peak in range(1, n_peaks + 1)])
+                   for run in range(n_runs))
+    return db
+
+
+class TestDB(unittest.TestCase):
+    def test_migrate_fresh_db(self):
+        db = dbutil.DB(":memory:")
+        self.assertEqual(dbutil.schema_version(db.conn), dbutil.SCHEMA_VERSION)
+        indexes = {
+            i[0]
+            for i in db.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'")
+        }
+        self.assertTrue({
+            "results_run_id", "results_peak", "results_measured",
+            "history_date"
+        } <= indexes)
+        plan = db.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM results WHERE measured BETWEEN 1 AND 2"
+        ).fetchall()
+        self.assertIn("results_measured", plan[0][-1])
+
+    def test_migrate_unversioned_db(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("""CREATE TABLE history (id INTEGER PRIMARY KEY,
+            date TEXT, data TEXT, params TEXT, finished INTEGER)""")
+        conn.execute("""CREATE TABLE results (date TEXT, run_id INTEGER,
+            peak INTEGER, measured REAL, theorMH REAL, theorMHTag REAL,
+            comp_l TEXT, comp_s TEXT, tag TEXT, tag_mass REAL)""")
+        params = {"Tolerance": "0.5", "Masses": "911.3"}
+        conn.executemany("INSERT INTO history VALUES (?, ?, ?, ?, 1)",
+                         [(1, "2019-01-01", '{"1": [911.3]}',
+                           json.dumps(params)),
+                          (2, "2019-01-02", "{}",
+                           json.dumps(dict(params, Masses="1057.33")))])
+        conn.executemany(
+            "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [("2019-01-01", 1, *RESULT), ("2019-01-02", 2, *RESULT),
+             ("2019-01-02", 2, 2, 1057.33, 0.0, 0.0, "NOT FOUND",
+              "NOT FOUND", "", 0.0),
+             # results numbered independently of history
+             ("2019-01-03", 7, *RESULT)])
+        dbutil.setup_db_tables(conn)
+        self.assertEqual(dbutil.schema_version(conn), dbutil.SCHEMA_VERSION)
+        self.assertEqual(
+            conn.execute("SELECT * FROM result_rows ORDER BY id").fetchall(),
+            # adduct of results stored before migration 7 is unknown
+            [(1, "2019-01-01", 1, *RESULT, None, None),
+             (2, "2019-01-02", 2, *RESULT, None, None),
+             (3, "2019-01-02", 2, 2, 1057.33, 0.0, 0.0, "NOT FOUND",
+              "NOT FOUND", "", 0.0, None, None),
+             # no history row left for run 7
+             (4, "2019-01-03", 3, *RESULT, None, None)])
+        self.assertEqual(
+            conn.execute("SELECT COUNT(*) FROM compositions").fetchone(), (2, ))
+        self.assertEqual(
+            conn.execute("SELECT id, params FROM param_sets").fetchall(),
+            [(1, '{"Tolerance": "0.5"}')])
+        self.assertEqual(
+            conn.execute("SELECT id, params FROM history_rows").fetchall(),
+            [(1, '{"Tolerance": "0.5"}'), (2, '{"Tolerance": "0.5"}'),
+             (3, None)])
+        # results_rtree filled from migrated rows with dates of their runs
+        self.assertEqual(
+            conn.execute("SELECT COUNT(*) FROM results_rtree").fetchone(),
+            (4, ))
+        rows = conn.execute(
+            """SELECT id FROM results_rtree WHERE max_day >= julianday(?) - 2440587.5
+            AND min_day <= julianday(?) - 2440587.5 ORDER BY id""",
+            ("2019-01-02", "2019-01-02")).fetchall()
+        self.assertEqual(rows, [(2, ), (3, )])
+        db = dbutil.DB(":memory:")
+        self.assertIsNone(db._counts("NOT FOUND"))
+        # already migrated - no-op
+        dbutil.migrate(conn)
+        conn.execute(f"PRAGMA user_version = {dbutil.SCHEMA_VERSION + 1}")
+        with self.assertRaises(RuntimeError):
+            dbutil.migrate(conn)
+
+    def test_migrate_legacy_run_ids(self):
+        # v2 results numbered MAX(run_id) + 1, history also has runs
+        # whose results were never written
+        conn = sqlite3.connect(":memory:")
+        conn.execute("""CREATE TABLE history (id INTEGER PRIMARY KEY,
+            date TEXT, data TEXT, params TEXT, finished INTEGER)""")
+        conn.execute("""CREATE TABLE results (date TEXT, run_id INTEGER,
+            peak INTEGER, measured REAL, theorMH REAL, theorMHTag REAL,
+            comp_l TEXT, comp_s TEXT, tag TEXT, tag_mass REAL)""")
+        conn.executemany(
+            "INSERT INTO history VALUES (?, ?, '{}', '{}', 1)",
+            [(1, "2019-01-01T10:00:00"), (2, "2019-01-01T11:00:00"),
+             (3, "2019-01-01T12:00:00"), (4, "2019-01-02T09:00:00")])
+        conn.executemany(
+            "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [("2019-01-01T11:00:01", 1, *RESULT),
+             ("2019-01-02T09:00:01", 2, *RESULT),
+             ("2019-01-02T09:00:01", 2, 2, 1057.33, 0.0, 0.0, "NOT FOUND",
+              "NOT FOUND", "", 0.0),
+             # history row of this run is missing
+             ("2019-01-03T08:00:00", 3, *RESULT)])
+        conn.execute("PRAGMA user_version = 2")
+        dbutil.setup_db_tables(conn)
+        self.assertEqual(
+            conn.execute(
+                "SELECT run_id, peak, date FROM result_rows ORDER BY id"
+            ).fetchall(),
+            [(2, 1, "2019-01-01T11:00:00"), (4, 1, "2019-01-02T09:00:00"),
+             (4, 2, "2019-01-02T09:00:00"), (5, 1, "2019-01-03T08:00:00")])
+        self.assertEqual(
+            conn.execute("SELECT COUNT(*) FROM history").fetchone(), (5, ))
+
+    def test_insert_run(self):
+        db = dbutil.DB(":memory:")
+        db.insert_hist({}, {}, 0)  # run without results
+        run_id = db.insert_run({"1": [911.3]}, {"Tolerance": "0.5"},
+                               [RESULT, RESULT])
+        second_id = db.insert_run({}, {}, iter([RESULT]))
+        self.assertEqual((run_id, second_id), (2, 3))
+        runs = db.conn.execute(
+            "SELECT run_id, COUNT(*) FROM results GROUP BY run_id").fetchall()
+        self.assertEqual(runs, [(2, 2), (3, 1)])
+        self.assertEqual(
+            db.conn.execute("SELECT data FROM history WHERE id = ?",
+                            (run_id, )).fetchone(), ('{"1": [911.3]}', ))
+
+    def test_insert_run_rolls_back(self):
+        db = dbutil.DB(":memory:")
+        self.assertIsNone(db.insert_run({}, {}, [RESULT[:3]]))
+        self.assertEqual(
+            db.conn.execute("SELECT COUNT(*) FROM history").fetchone(), (0, ))
+
+    def test_insert_result_latest_run(self):
+        db = dbutil.DB(":memory:")
+        run_id = db.insert_hist({}, {}, 1)
+        db.insert_result([RESULT])
+        self.assertEqual(db._get_last_result_id(), run_id)
+
+    def test_insert_runs(self):
+        db = dbutil.DB(":memory:")
+        runs = ((i, {}, (RESULT for _ in range(i))) for i in range(1, 4))
+        self.assertEqual(db.insert_runs(runs), [1, 2, 3])
+        self.assertEqual(
+            db.conn.execute("SELECT COUNT(*) FROM results").fetchone(), (6, ))
+        self.assertEqual(db.insert_runs([({}, {}, [RESULT[:3]])]), [])
+        self.assertEqual(
+            db.conn.execute("SELECT COUNT(*) FROM history").fetchone(), (3, ))
+
+    def test_bulk_mode(self):
+        path = tempfile.mkdtemp()
+        try:
+            db = dbutil.DB(os.path.join(path, "bulk.db"), bulk=True)
+            pragma = lambda name: db.conn.execute(f"PRAGMA {name}").fetchone()[0]
+            self.assertEqual(pragma("journal_mode"), "wal")
+            self.assertEqual(pragma("synchronous"), 1)  # NORMAL
+            self.assertEqual(pragma("cache_size"), -65536)
+            db.insert_run({}, {}, [RESULT])
+            db.close()
+            reopened = dbutil.DB(os.path.join(path, "bulk.db"))
+            self.assertEqual(
+                reopened.conn.execute("SELECT COUNT(*) FROM results").fetchone(),
+                (1, ))
+            reopened.close()
+        finally:
+            shutil.rmtree(path)
+
+    def test_per_thread_connections(self):
+        db = dbutil.DB(":memory:")
+        conns = []
+
+        def insert():
+            conns.append(db.conn)
+            db.insert_run({}, {}, [RESULT])
+            db.close_thread()
+
+        thread = threading.Thread(target=insert)
+        thread.start()
+        thread.join()
+        self.assertIsNot(conns[0], db.conn)
+        # in-memory database is shared between threads
+        self.assertEqual(db.read_current_masses(), [])
+        self.assertEqual(db._get_last_result_id(), 1)
+        self.assertEqual(len(db._conns), 1)
+
+    def test_concurrent_read_while_writing(self):
+        path = tempfile.mkdtemp()
+        try:
+            db = dbutil.DB(os.path.join(path, "store.db"))
+            errors = []
+            done = threading.Event()
+
+            def write():
+                try:
+                    for _ in range(50):
+                        db.insert_run({}, {}, [RESULT] * 200)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    db.close_thread()
+                    done.set()
+
+            writer = threading.Thread(target=write)
+            writer.start()
+            counts = []
+            while not done.is_set():
+                counts.append(
+                    db.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0])
+            writer.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(counts, sorted(counts))
+            self.assertEqual(db._get_last_result_id(), 50)
+            self.assertEqual(
+                db.conn.execute("PRAGMA journal_mode").fetchone(), ("wal", ))
+            db.close()
+        finally:
+            shutil.rmtree(path)
+
+    def test_concurrent_new_param_set(self):
+        path = tempfile.mkdtemp()
+        try:
+            db = dbutil.DB(os.path.join(path, "store.db"))
+            start = threading.Barrier(8)
+            run_ids = []
+
+            def insert(n):
+                start.wait()
+                run_ids.append(db.insert_run(
+                    {}, {"Tolerance": "0.3", "Masses": str(n)}, [RESULT]))
+                db.close_thread()
+
+            threads = [threading.Thread(target=insert, args=(i, ))
+                       for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # no run is lost to the parameter set or composition
+            # inserted by another thread
+            self.assertEqual(sorted(run_ids), list(range(1, 9)))
+            self.assertEqual(db.conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT params_id) FROM history"
+            ).fetchone(), (8, 1))
+            self.assertEqual(db.conn.execute(
+                "SELECT COUNT(*) FROM compositions").fetchone(), (1, ))
+            db.close()
+        finally:
+            shutil.rmtree(path)
+
+    def test_read_result_pages(self):
+        db = prepare_results(3, 10)
+        page = db.read_result(limit=4)
+        self.assertEqual([i[0] for i in page], [1, 2, 3, 4])
+        self.assertEqual(len(page[0]), len(dbutil.RESULT_COLUMNS))
+        page = db.read_result(after=page[-1][0], limit=4, run_id=2)
+        self.assertEqual([(i[2], i[3]) for i in page], [(2, 1), (2, 2),
+                                                        (2, 3), (2, 4)])
+        self.assertEqual(db.read_result(after=30), [])
+
+    def test_result_filters(self):
+        db = prepare_results(3, 10)
+        rows = list(db.iter_results(batch_size=2, peak=3))
+        self.assertEqual([i[2] for i in rows], [1, 2, 3])
+        self.assertEqual(len(list(db.iter_results(batch_size=4,
+                                                  composition="H3N2"))), 15)
+        rows = list(db.iter_results(composition="(Hex)5 (HexNAc)2", run_id=1))
+        self.assertEqual([i[3] for i in rows], [2, 4, 6, 8, 10])
+        rows = list(db.iter_results(batch_size=1, min_mass=904.5,
+                                    max_mass=905.015))
+        self.assertEqual([(i[2], i[3]) for i in rows], [(1, 5), (2, 5)])
+        date = db.read_history()[1][1]
+        self.assertEqual(
+            sum(1 for _ in db.iter_results(start=date, end=date)), 30)
+        self.assertEqual(list(db.iter_results(start="2100-01-01")), [])
+
+    def test_find_results(self):
+        db = dbutil.DB(":memory:")
+        found = ("(Hex)5 (HexNAc)4 (Deoxyhexose)1", "H5N4F1", "", 0.0)
+        db.insert_run({}, {}, [(1, 1438.45, 1438.5, 1438.5, *found),
+                               (2, 1809.6, 1809.666, 1809.666, *found[:2],
+                                "", 0.0)])
+        db.insert_run({}, {}, [(1, 1438.62, 0.0, 0.0, "NOT FOUND",
+                                "NOT FOUND", "", 0.0), RESULT])
+        db.insert_result([(1, 1438.69, 1438.5, 1438.5, *found)])
+        self.assertEqual(db.conn.execute(
+            "SELECT COUNT(*) FROM results_rtree").fetchone(), (5, ))
+        rows = db.find_results(1438.3, 1438.7)
+        self.assertEqual([i[0] for i in rows], [1, 3, 5])
+        self.assertEqual(rows[0][2:],
+                         (1, 1, 1438.45, 1438.5, 1438.5, *found, None, None))
+        # 32-bit R*Tree boxes are rounded outwards, bounds are exact
+        self.assertEqual([i[0] for i in db.find_results(1438.45, 1438.45)],
+                         [1])
+        self.assertEqual(db.find_results(1438.4501, 1438.6199), [])
+        self.assertEqual(
+            [i[0] for i in db.find_results(min_theor=1438.0, max_theor=1439.0)],
+            [1, 5])
+        self.assertEqual(
+            [i[0] for i in db.find_results(composition="H5N4F1",
+                                           start=db.read_history()[0][1])],
+            [1, 2, 5])
+        self.assertEqual(db.find_results(composition="H5N4F1",
+                                         end="2000-01-01"), [])
+        self.assertEqual(
+            [i[0] for i in db.find_results(1438.3, 1438.7, after=1, limit=1)],
+            [3])
+
+    def test_runs_matching(self):
+        db = prepare_results(3, 10)
+        db.insert_run({}, {}, [(1, 1438.45, 1438.5, 1438.5,
+                                "(Hex)5 (HexNAc)4 (Deoxyhexose)1", "H5N4F1",
+                                "", 0.0),
+                               (2, 1438.6, 0.0, 0.0, "NOT FOUND", "NOT FOUND",
+                                "", 0.0)])
+        date = db.read_history()[-1][1]
+        self.assertEqual(db.runs_matching(1438.5, 0.2), [(4, date, 1)])
+        self.assertEqual(db.runs_matching(1438.5, 0.01, theoretical=True),
+                         [(4, date, 1)])
+        self.assertEqual(db.runs_matching(1438.5, 0.01), [])
+        self.assertEqual(db.runs_matching(1438.5, 0.2, start="2100-01-01"),
+                         [])
+
+    def test_read_history_pages(self):
+        db = prepare_results(5, 1)
+        page = db.read_history(limit=2)
+        self.assertEqual([i[0] for i in page], [1, 2])
+        self.assertEqual(len(page[0]), len(dbutil.HISTORY_COLUMNS))
+        self.assertEqual([i[0] for i in db.iter_history(batch_size=2)],
+                         [1, 2, 3, 4, 5])
+        self.assertEqual(db.read_history(end="2000-01-01"), [])
+
+    def test_iter_current_masses(self):
+        db = dbutil.DB(":memory:")
+        db.insert_many_masses_into_curr([(i, 900.0 + i, 1) for i in range(5)])
+        self.assertEqual(list(db.iter_current_masses(batch_size=2)),
+                         db.read_current_masses())
+
+    def test_lookup_records(self):
+        db = dbutil.DB(":memory:")
+        params = {"Tolerance": "0.5", "Masses": "911.3\n1500.0"}
+        header = ("Adduct ([M+H]+): 1.00727", )
+        not_found = (2, 1500.0, 0.0, 0.0, "NOT FOUND", "NOT FOUND", "", 0.0,
+                     1000.0)
+        self.assertEqual(db.lookup_records(params, [911.3]), {})
+        db.insert_run({}, params, [RESULT + (-0.034, ), not_found],
+                      header=header)
+        # legacy rows without delta are searched again
+        db.insert_run({}, dict(params, Masses="1057.33"),
+                      [(1, 1057.33, 1038.375, 1039.382, "(Hex)3 (HexNAc)2",
+                        "H3N2", "", 0.0)])
+        db.insert_run({}, dict(params, Tolerance="0.2"),
+                      [(1, 1454.0, 1434.5, 1435.5, "(Hex)3 (HexNAc)2",
+                        "H3N2", "", 0.0, 0.48)])
+        served = db.lookup_records(dict(params, Masses=""),
+                                   [1454.0, 911.3, 1057.33, 1500.0])
+        self.assertEqual(sorted(served), [1, 3])
+        self.assertEqual(served[1].user_mass, 911.3)
+        self.assertEqual(served[1].header, header)
+        self.assertEqual(served[1].hits[0][:3],
+                         (892.317, -0.034, "(Hex)3 (HexNAc)2"))
+        self.assertEqual(served[1].hits[0].counts[:2], (3, 2))
+        self.assertEqual(served[3].hits, ())
+
+    def test_write_current_masses(self):
+        db = dbutil.DB(":memory:")
+        db.insert_single_mass_into_curr(1, 911.3)
+        db.insert_single_mass_into_curr(2, 1057.33, 2)
+        self.assertEqual(db.read_current_masses(),
+                         [(1, 911.3, 1), (2, 1057.33, 2)])
+        # one of duplicate rows is deleted
+        self.assertTrue(db.write_current_masses(
+            inserts=[(1, 911.3, 1), (3, 1454.0, 1)], deletes=[(1, 911.3, 1)]))
+        self.assertEqual(sorted(db.read_current_masses()),
+                         [(1, 911.3, 1), (2, 1057.33, 2), (3, 1454.0, 1)])
+        self.assertTrue(db.write_current_masses([(4, 2000.0, 1)], clear=True))
+        self.assertEqual(db.read_current_masses(), [(4, 2000.0, 1)])
+        self.assertFalse(db.write_current_masses([(5, 2100.0)], clear=True))
+        self.assertEqual(db.read_current_masses(), [(4, 2000.0, 1)])
+
+    def test_output_csv(self):
+        db = prepare_results(3, 10)
+        out = io.StringIO()
+        self.assertEqual(db.output_csv("results", out, chunk_size=7), 30)
+        rows = list(csv.reader(io.StringIO(out.getvalue())))
+        self.assertEqual(tuple(rows[0]), dbutil.RESULT_COLUMNS[1:])
+        self.assertEqual(rows[1][1:5], ["1", "1", "901.0", "0.0"])
+        self.assertEqual(len(rows), 31)
+        out = io.StringIO()
+        self.assertEqual(db.output_csv("results", out, id=2, start=12, end=25),
+                         9)
+        rows = list(csv.reader(io.StringIO(out.getvalue())))[1:]
+        self.assertEqual([int(i[2]) for i in rows], list(range(2, 11)))
+        with self.assertRaises(ValueError):
+            db.output_csv("curr_ephem", io.StringIO())
+
+    def test_output_csv_to_file(self):
+        db = prepare_results(2, 2)
+        path = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(path, "history.csv")
+            self.assertEqual(db.output_csv("history", file_name, start=2), 1)
+            with open(file_name, "r", newline="") as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(tuple(rows[0]), dbutil.HISTORY_COLUMNS)
+            self.assertEqual(rows[1][0], "2")
+        finally:
+            shutil.rmtree(path)
+
+    def test_output_text(self):
+        db = prepare_results(2, 3)
+        out = io.StringIO()
+        self.assertEqual(db.output_text("results", out, id=2), 3)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            lines[0],
+            "Run 2, peak 1, mass 901.01: H3N2 [(Hex)3 (HexNAc)2], [MH]+: 0.0, [M+free+H]+: 0.0"
+        )
+        db.insert_run({}, {}, [RESULT + (-0.034, "Na+", 22.989768, 889.318)])
+        out = io.StringIO()
+        self.assertEqual(db.output_text("results", out, id=3), 1)
+        self.assertEqual(
+            out.getvalue(),
+            "Run 3, peak 1, mass 911.3 as Na+: H3N2 [(Hex)3 (HexNAc)2], [MH]+: 892.317, [M+free+H]+: 893.324\n"
+        )
+        # adduct_mass is the [M+H]+ equivalent submitted for the adduct
+        self.assertEqual(db.read_result(run_id=3)[0][-2:], ("Na+", 889.318))
+        db.insert_run({}, {}, [RESULT + (-0.034, "Na+", 22.989768, 889.318)])
+        self.assertEqual(
+            db.conn.execute("SELECT name, mass FROM adducts").fetchall(),
+            [("Na+", 22.989768)])
+        out = io.StringIO()
+        self.assertEqual(db.output_text("history", out), 4)
+        self.assertEqual(len(out.getvalue().splitlines()), 8)
+
+    def test_export_without_pandas(self):
+        code = ("import sys; from worker import dbutil; import io; "
+                "db = dbutil.DB(':memory:'); db.output_csv('results', io.StringIO()); "
+                "print('pandas' in sys.modules)")
+        out = subprocess.run([sys.executable, "-c", code],
+                             cwd=os.path.dirname(THIS_DIR),
+                             capture_output=True,
+                             text=True,
+                             check=True)
+        self.assertEqual(out.stdout.strip(), "False")
+
+    def test_normalized_rows(self):
+        db = dbutil.DB(":memory:")
+        params = {"Tolerance": "0.5", "Masses": "911.3"}
+        tagged = RESULT[:6] + ("ProA", 237.1477)
+        db.insert_run({}, params, [RESULT, tagged])
+        db.insert_run({}, dict(params, Masses="1057.33"), [RESULT, RESULT])
+        db.insert_run({}, dict(params, Tolerance="0.2"), [tagged])
+        self.assertEqual(
+            db.conn.execute(
+                "SELECT id, comp_s, counts, tag FROM compositions").fetchall(),
+            [(1, "H3N2", bytes([3, 2] + [0] * 11), ""),
+             (2, "H3N2", bytes([3, 2] + [0] * 11), "ProA")])
+        self.assertEqual(
+            db.conn.execute("SELECT run_id, comp_id FROM results").fetchall(),
+            [(1, 1), (1, 2), (2, 1), (2, 1), (3, 2)])
+        self.assertEqual(
+            db.conn.execute("SELECT params_id FROM history").fetchall(),
+            [(1, ), (1, ), (2, )])
+        self.assertEqual(db.read_result(limit=2)[1][2:],
+                         (1, ) + tagged + (None, None))
+        self.assertEqual(db.read_history(limit=1)[0][3],
+                         '{"Tolerance": "0.5"}')
+
+    def test_failed_run_forgets_compositions(self):
+        db = dbutil.DB(":memory:")
+        self.assertIsNone(db.insert_run({}, {}, [RESULT, RESULT[:3]]))
+        self.assertEqual(
+            db.conn.execute("SELECT COUNT(*) FROM compositions").fetchone(),
+            (0, ))
+        db.insert_run({}, {}, [RESULT])
+        self.assertEqual(db.read_result()[0][2:], (1, ) + RESULT + (None, None))
+
+    def test_pack_array(self):
+        arr = np.array([100.5, 200.25], dtype=">f4")
+        blob, dtype = dbutil.pack_array(arr)
+        self.assertEqual(dtype, "<f4")
+        self.assertEqual(blob, np.array([100.5, 200.25], dtype="<f4").tobytes())
+        self.assertEqual(dbutil.pack_array([1, 2])[1], "<f8")
+        unpacked = dbutil.unpack_array(blob, dtype)
+        np.testing.assert_array_equal(unpacked, arr)
+        self.assertFalse(unpacked.flags.writeable)  # view of the BLOB
+        with self.assertRaises(ValueError):
+            dbutil.unpack_array(blob, "<i4")
+
+    def test_store_spectrum(self):
+        db = dbutil.DB(":memory:")
+        mz = np.linspace(100.0, 2000.0, 5000)
+        intensity = np.random.RandomState(0).rand(5000).astype(np.float32)
+        self.assertIsNone(db.load_spectrum("a.mzML", 12.5))
+        db.store_spectrum("a.mzML", 12.5, mz, intensity, "CENTROID", 1)
+        db.store_spectrum("a.mzML", 10.0, mz[:10], intensity[:10], compress=True)
+        db.store_spectrum("b.mzML", 12.5, mz[:3], intensity[:3])
+        stored = db.load_spectrum("a.mzML", 12.5)
+        np.testing.assert_array_equal(stored.mz, mz)
+        np.testing.assert_array_equal(stored.intensity, intensity)
+        self.assertEqual(stored.intensity.dtype, np.float32)
+        self.assertEqual((stored.scan_type, stored.peak_num), ("CENTROID", 1))
+        self.assertEqual(stored.picked.shape, (0, 2))
+
+        db.store_picked_peaks("a.mzML", 12.5, 2, [(2, 911.3, 1), (2, 1057.33, 2)])
+        stored = db.load_spectrum("a.mzML", 12.5)
+        self.assertEqual(stored.peak_num, 2)
+        np.testing.assert_array_equal(stored.picked,
+                                      [[911.3, 1.0], [1057.33, 2.0]])
+        session = list(db.iter_session("a.mzML"))
+        self.assertEqual([i.ret_time for i in session], [12.5, 10.0])
+        np.testing.assert_array_equal(session[1].mz, mz[:10])
+        self.assertEqual([i[:2] for i in db.read_sessions()],
+                         [("b.mzML", 1), ("a.mzML", 2)])
+        # reopening replaces arrays, keeps picked peaks
+        db.store_spectrum("a.mzML", 12.5, mz[:2], intensity[:2], compress=True)
+        stored = db.load_spectrum("a.mzML", 12.5)
+        self.assertEqual(len(stored.mz), 2)
+        self.assertEqual(len(stored.picked), 2)
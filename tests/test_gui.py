@@ -0,0 +1,77 @@
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import importlib
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from worker import dbutil
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(THIS_DIR)
+HAS_QT = all(
+    importlib.util.find_spec(i) for i in ("PyQt5", "pyqtgraph", "pyteomics"))
+
+
+@unittest.skipUnless(HAS_QT, "needs PyQt5, pyqtgraph and pyteomics")
+class TestGui(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestGui, cls).setUpClass()
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        # gui.py uses package relative imports
+        sys.path.insert(0, os.path.dirname(ROOT_DIR))
+        cls.gui = importlib.import_module(
+            os.path.basename(ROOT_DIR) + ".gui")
+        cls.qapp = (cls.gui.QtGui.QApplication.instance()
+                    or cls.gui.QtGui.QApplication([]))
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = dbutil.DB(os.path.join(self.path, "peaks.db"))
+        chrom_data = {"retention_times": [1.0, 2.0], "TIC": [1, 2],
+                      "BPI": [1, 2]}
+        self.app = self.gui.App("a.mzML", chrom_data, self.db)
+        self.app.show()
+        self.mz = np.linspace(100.0, 2000.0, 10)
+        self.db.store_spectrum("a.mzML", 12.5, self.mz, self.mz)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.path)
+
+    def scan_window(self):
+        scanWin = self.gui.ScanWindow(
+            1, self.mz, self.mz, 12.5, logging.getLogger("GUI"), self.db,
+            path="a.mzML", peak_queue=self.app.peakQueue)
+        scanWin.selectedPeaks = [(1, 911.3, 1)]
+        scanWin.show()
+        return scanWin
+
+    def assertSaved(self):
+        self.assertEqual(self.db.read_current_masses(), [(1, 911.3, 1)])
+        np.testing.assert_array_equal(
+            self.db.load_spectrum("a.mzML", 12.5).picked, [[911.3, 1.0]])
+
+    def test_app_closes_scan_windows(self):
+        self.app.scanWin = self.scan_window()
+        with mock.patch.object(self.gui.QtGui.QMessageBox, "question",
+                               return_value=self.gui.QtGui.QMessageBox.Yes):
+            self.app.close()
+        self.assertFalse(self.app.scanWin.isVisible())
+        self.assertTrue(self.app.peakQueue.closed)
+        self.assertSaved()
+
+    def test_scan_window_closed_after_app(self):
+        # not tracked by the App, stays open after it
+        scanWin = self.scan_window()
+        self.app.close()
+        self.assertTrue(scanWin.isVisible())
+        with mock.patch.object(self.gui.QtGui.QMessageBox, "question",
+                               return_value=self.gui.QtGui.QMessageBox.Yes):
+            scanWin.close()
+        self.assertSaved()
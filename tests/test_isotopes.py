@@ -0,0 +1,105 @@
+import os
+import json
+import unittest
+
+import numpy as np
+
+from worker import utils
+from worker.isotopes import IsotopeCalculator, _element_peaks
+from worker.data_types import GlycomodComposition
+
+
+class TestIsotopes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestIsotopes, cls).setUpClass()
+        cls.cfg = prepare_cfg()
+
+    def test_distribution(self):
+        calc = IsotopeCalculator(TestIsotopes.cfg)
+        comp = {"(Hex)": 3, "(HexNAc)": 2}
+        masses, abundances = calc.distribution(comp)
+        self.assertAlmostEqual(
+            masses[0], utils.calc_theor_mono_mass(comp, TestIsotopes.cfg), places=3)
+        self.assertAlmostEqual(abundances.sum(), 1.0, places=6)
+        # C34H58N2O26: M+1 is ~39% of the monoisotopic peak
+        self.assertAlmostEqual(abundances[1] / abundances[0], 0.39, places=2)
+        # ProA labeled
+        masses, _ = calc.distribution(comp, reducing_end="ProA")
+        self.assertAlmostEqual(
+            masses[0],
+            utils.calc_theor_mono_mass(comp, TestIsotopes.cfg, reducing_end="ProA"),
+            places=2)
+
+    def test_distribution_memoized(self):
+        calc = IsotopeCalculator(TestIsotopes.cfg)
+        first = calc.distribution({"(Hex)": 5, "(HexNAc)": 4})
+        second = calc.distribution({"(HexNAc)": 4, "(Hex)": 5})
+        self.assertIs(first, second)
+        counts = utils.composition_counts("(Hex)5 (HexNAc)4", calc.model.residues)
+        self.assertIs(calc.distribution(counts), first)
+
+    def test_caches_bounded(self):
+        calc = IsotopeCalculator(TestIsotopes.cfg, maxsize=2)
+        for n in range(3, 8):
+            calc.distribution({"(Hex)": n, "(HexNAc)": 2})
+        self.assertEqual(calc._distribution.cache_info().currsize, 2)
+        self.assertLessEqual(calc._element_power.cache_info().currsize, 2)
+
+    def test_sulfur_isotopes(self):
+        # 32S, 33S, 34S and 36S at their nominal offsets, nothing at 35
+        abundance, _ = _element_peaks("S", 6)
+        self.assertEqual(abundance.tolist(),
+                         [0.9499, 0.0075, 0.0425, 0.0, 0.0001, 0.0])
+
+    def test_envelopes_charge(self):
+        calc = IsotopeCalculator(TestIsotopes.cfg)
+        comp = {"(Hex)": 3, "(HexNAc)": 2}
+        mz, _ = calc.envelopes([comp], adduct="2H2+")
+        adduct_ions = utils.calc_default_adducts_mono(comp, TestIsotopes.cfg, None)
+        self.assertAlmostEqual(mz[0, 0], adduct_ions["2H2+"], places=3)
+        self.assertAlmostEqual(mz[0, 1] - mz[0, 0], 0.5, places=2)
+
+    def test_rank_compositions(self):
+        calc = IsotopeCalculator(TestIsotopes.cfg)
+        observed = {"(Hex)": 3, "(HexNAc)": 2, "(Deoxyhexose)": 1}
+        decoy = {"(Hex)": 2, "(NeuAc)": 2, "(Pent)": 1}
+        mz, ab = calc.envelopes([observed])
+        candidates = [
+            mock_composition("(Hex)2 (NeuAc)2 (Pent)1", 0.043),
+            mock_composition("(Hex)3 (HexNAc)2 (Deoxyhexose)1", 0.007),
+            mock_composition("NOT FOUND", 1000.0),
+        ]
+        ranked = calc.rank_compositions(mz[0], ab[0] * 1e5, candidates)
+        self.assertEqual(ranked[0][1].long_notation,
+                         "(Hex)3 (HexNAc)2 (Deoxyhexose)1")
+        self.assertAlmostEqual(ranked[0][0], 1.0, places=6)
+        self.assertEqual(ranked[-1], (0.0, candidates[-1]))
+        # candidates are interned once as count vectors
+        calc.rank_compositions(mz[0], ab[0], candidates)
+        self.assertEqual((calc.registry.misses, calc.registry.hits), (2, 2))
+        # spectrum without signal at the candidate m/z
+        scores = calc.score(np.array([100.0]), np.array([1.0]), [decoy])
+        self.assertEqual(scores.tolist(), [0.0])
+
+
+def mock_composition(long_notation, delta):
+    return GlycomodComposition(
+        theoretical_MH=0.0,
+        delta=delta,
+        long_notation=long_notation,
+        short_notation="",
+        theoretical_MTagH=0.0,
+        theoretical_MTagNa=0.0,
+        theoretical_MTagK=0.0,
+        theoretical_MTagH2=0.0,
+        theoretical_MTagHNa=0.0,
+        theoretical_MTagHK=0.0,
+        theoretical_MTagNa2=0.0,
+        theoretical_MTagNH4=0.0)
+
+
+def prepare_cfg():
+    with open(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_cfg.json")), "r") as f:
+        cfg = json.load(f)
+    return cfg
@@ -0,0 +1,73 @@
+import os
+import json
+import unittest
+
+from bs4 import BeautifulSoup
+
+from worker.parser import parse_gm_soup, parse_gm_stream, iter_gm_records
+from worker.parser import records_from_lines
+from worker.data_types import GlycomodRecord
+from worker.utils import CompositionRegistry
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+HTML_DIR = os.path.join(THIS_DIR, 'test_html')
+FIXTURES = sorted(i for i in os.listdir(HTML_DIR) if i.endswith(".html"))
+
+
+class TestStreamingParser(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestStreamingParser, cls).setUpClass()
+        cls.cfg = prepare_cfg()
+        cls.residues = cls.cfg["residues"]
+
+    def test_same_records_as_soup(self):
+        registry = CompositionRegistry(TestStreamingParser.cfg)
+        for file_name in FIXTURES:
+            html = read_fixture(file_name)
+            with self.subTest(file_name=file_name):
+                self.assertEqual(
+                    parse_gm_stream(html, registry),
+                    records_from_lines(
+                        parse_gm_soup(BeautifulSoup(html, 'html5lib')),
+                        registry))
+
+    def test_chunked_input(self):
+        registry = CompositionRegistry(TestStreamingParser.cfg)
+        html = read_fixture("minimal_test_w_multi_matched.html").encode("utf-8")
+        # chunk boundaries fall inside tags, numbers and multibyte characters
+        chunks = [html[i:i + 7] for i in range(0, len(html), 7)]
+        self.assertEqual(
+            list(iter_gm_records(chunks, registry)),
+            parse_gm_stream(html, registry))
+
+    def test_records(self):
+        residues = TestStreamingParser.residues
+        registry = CompositionRegistry(TestStreamingParser.cfg)
+        records = parse_gm_stream(
+            read_fixture("minimal_test_w_not_found.html"), registry)
+        self.assertIsInstance(records[0], GlycomodRecord)
+        self.assertEqual([i.user_mass for i in records],
+                         [1292.92, 1479.52, 1276.47, 1739.61, 1454.5, 1452.01])
+        self.assertEqual([len(i.hits) for i in records], [1, 1, 1, 1, 1, 0])
+        hit = records[1].hits[0]
+        self.assertEqual(hit[:3], (1241.455, -0.309,
+                                   '(HexNAc)1 (Deoxyhexose)1  + (Man)3(GlcNAc)2'))
+        self.assertEqual({i: n for i, n in zip(residues, hit.counts) if n}, {
+            "(HexNAc)": 1, "(Deoxyhexose)": 1, "(Man)": 3, "(GlcNAc)": 2
+        })
+        self.assertEqual(records[5].header,
+                         ('Adduct ([M+H]+): 1.00727',
+                          'Derivative mass (ProA): 237.36764'))
+        self.assertEqual(parse_gm_stream("", registry), [])
+
+
+def read_fixture(file_name):
+    with open(os.path.join(HTML_DIR, file_name), "r") as f:
+        return f.read()
+
+
+def prepare_cfg():
+    with open(os.path.join(THIS_DIR, "test_cfg.json"), "r") as f:
+        cfg = json.load(f)
+    return cfg
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from worker.client import GlycomodClient
+from worker.replay import ReplayAdapter, recording_session, replay_session
+from worker.replay import request_key
+from worker.worker import GlycomodWorker as GW
+from tests.gm_stub import GlycomodStub
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+MASSES = [("1", "911.30"), ("2", "1057.33"), ("3", "1454.0")]
+
+
+class TestReplay(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestReplay, cls).setUpClass()
+        cls.cfg = prepare_cfg()
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _run_worker(self, session, cfg=None, **kwargs):
+        worker = GW(cfg=cfg or TestReplay.cfg, db=None, session=session,
+                    **kwargs)
+        worker.masses_from_db = list(MASSES)
+        worker._fetch_gmod_data()
+        worker._create_glycan_objects()
+        return worker
+
+    def test_request_key(self):
+        fields = {"Masses": "911.30\n1057.33", "Tolerance": " 0.5 "}
+        self.assertEqual(
+            request_key(fields),
+            request_key({"Tolerance": "0.5", "Masses": "911.30 1057.33\n"}))
+        self.assertNotEqual(
+            request_key(fields), request_key(dict(fields, Masses="911.30")))
+
+    def test_record_and_replay(self):
+        with GlycomodStub() as stub:
+            cfg = dict(TestReplay.cfg, gmod_post_link=stub.url)
+            recorded = self._run_worker(recording_session(self.path), cfg)
+        self.assertEqual(len(stub.requests), 1)
+        meta_files = [i for i in os.listdir(self.path) if i.endswith(".json")]
+        self.assertEqual(len(meta_files), 1)
+        with open(os.path.join(self.path, meta_files[0]), "r") as f:
+            meta = json.load(f)
+        self.assertEqual(meta["fields"]["Masses"].split(),
+                         [i[1] for i in MASSES])
+        self.assertEqual(meta["status"], 200)
+
+        # stub is down, replay needs no network
+        session = replay_session(self.path)
+        replayed = self._run_worker(session)
+        self.assertEqual(session.get_adapter(stub.url).replayed, 1)
+        self.assertEqual(replayed.records, recorded.records)
+        self.assertEqual(list(replayed.compositions),
+                         list(recorded.compositions))
+        self.assertEqual(
+            replayed.compositions[1].glycomod_structures[0].short_notation,
+            "H3N2F1")
+
+    def test_replay_latency(self):
+        with GlycomodStub() as stub:
+            cfg = dict(TestReplay.cfg, gmod_post_link=stub.url)
+            self._run_worker(recording_session(self.path), cfg)
+        start = time.perf_counter()
+        self._run_worker(replay_session(self.path, latency=0.2))
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+
+    def test_replay_unrecorded(self):
+        with self.assertRaises(requests.ConnectionError):
+            self._run_worker(replay_session(self.path))
+
+    def test_replay_with_client(self):
+        with GlycomodStub() as stub:
+            cfg = dict(TestReplay.cfg, gmod_post_link=stub.url)
+            client = GlycomodClient(
+                cfg, chunk_size=1, session=recording_session(self.path))
+            recorded = self._run_worker(None, cfg, client=client)
+        self.assertEqual(len(stub.requests), 3)
+        session = replay_session(self.path)
+        client = GlycomodClient(TestReplay.cfg, chunk_size=1, session=session)
+        self.assertIsInstance(
+            client.session.get_adapter(TestReplay.cfg["gmod_post_link"]),
+            ReplayAdapter)
+        replayed = self._run_worker(None, client=client)
+        self.assertEqual(replayed.records, recorded.records)
+
+
+def prepare_cfg():
+    with open(os.path.join(THIS_DIR, "test_cfg.json"), "r") as f:
+        cfg = json.load(f)
+    return cfg
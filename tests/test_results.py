@@ -0,0 +1,140 @@
+import io
+import os
+import json
+import importlib.util
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from toolz.itertoolz import concat
+
+from worker.data_types import SubmittedMass
+from worker.parser import parse_gm_stream
+from worker.results import ResultStore
+from worker.worker import GlycomodWorker as GW
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestResultStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestResultStore, cls).setUpClass()
+        cls.cfg = prepare_cfg()
+
+    def prepare_worker(self, file_name):
+        worker = GW(cfg=TestResultStore.cfg, db=None)
+        with open(os.path.join(THIS_DIR, 'test_html', file_name), "r") as f:
+            worker.records = parse_gm_stream(f.read(), worker.registry)
+        worker.masses_from_db = [(n + 1, i.user_mass)
+                                 for n, i in enumerate(worker.records)]
+        worker._create_glycan_objects()
+        return worker
+
+    def test_namedtuple_view(self):
+        store = self.prepare_worker("minimal_test_w_not_found.html").compositions
+        self.assertIsInstance(store, ResultStore)
+        self.assertEqual(len(store), 6)
+        self.assertIsInstance(store[0], SubmittedMass)
+        self.assertEqual(store[-1], store[5])
+        self.assertEqual([i.peak_number for i in store], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(store[5].glycomod_structures[0].long_notation,
+                         "NOT FOUND")
+        self.assertEqual(store[5].glycomod_structures[0].delta, 1000.0)
+        self.assertEqual(store[1].glycomod_structures[0].short_notation,
+                         "H3N3F1")
+        with self.assertRaises(IndexError):
+            store[6]
+
+    def test_outputs_match_namedtuples(self):
+        worker = self.prepare_worker("minimal_test_w_multi_matched.html")
+        store = worker.compositions
+        self.assertEqual(len(store.long_notations), 6)  # 5 distinct + NOT FOUND
+        df = store.to_frame(TestResultStore.cfg["col_names"])
+        self.assertEqual(list(df.columns), TestResultStore.cfg["col_names"])
+        self.assertEqual([tuple(i) for i in df.itertuples(index=False)],
+                         list(concat([i.prep_out() for i in store])))
+        self.assertEqual(list(store.db_rows()),
+                         list(concat([i.prep_db_out() for i in store])))
+
+    def test_write_csv_matches_pandas(self):
+        worker = self.prepare_worker("minimal_test_w_multi_matched.html")
+        store = worker.compositions
+        col_names = TestResultStore.cfg["col_names"]
+        self.assertEqual(list(store.iter_rows(chunk_size=2)),
+                         list(concat([i.prep_out() for i in store])))
+        streamed = io.StringIO()
+        self.assertEqual(store.write_csv(streamed, col_names, chunk_size=3),
+                         len(store.to_frame(col_names)))
+        expected = io.StringIO()
+        store.to_frame(col_names).to_csv(expected, index=False)
+        self.assertEqual(streamed.getvalue(), expected.getvalue())
+
+    def test_worker_output_csv(self):
+        worker = self.prepare_worker("minimal_test_w_not_found.html")
+        path = tempfile.mkdtemp()
+        try:
+            worker.filename = os.path.join(path, "results")
+            worker.output_csv()
+            with open(worker.filename + ".csv", "r") as f:
+                lines = f.read().splitlines()
+        finally:
+            shutil.rmtree(path)
+        self.assertEqual(lines[0].split(","), TestResultStore.cfg["col_names"])
+        self.assertEqual(len(lines), 1 + len(list(worker.compositions.iter_rows())))
+        self.assertIn("NOT FOUND", lines[-1])
+
+    def test_csv_without_pandas(self):
+        code = ("import sys, io; from worker.results import ResultStore; "
+                "ResultStore().write_csv(io.StringIO(), ['a']); "
+                "print('pandas' in sys.modules)")
+        out = subprocess.run([sys.executable, "-c", code],
+                             cwd=os.path.dirname(THIS_DIR),
+                             capture_output=True,
+                             text=True,
+                             check=True)
+        self.assertEqual(out.stdout.strip(), "False")
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "needs pyarrow")
+    def test_to_arrow(self):
+        store = self.prepare_worker("minimal_test_w_multi_matched.html").compositions
+        col_names = TestResultStore.cfg["col_names"]
+        table = store.to_arrow(col_names)
+        self.assertEqual(table.column_names, col_names)
+        self.assertEqual([tuple(i.values()) for i in table.to_pylist()],
+                         list(store.iter_rows()))
+
+    def test_text_report(self):
+        store = self.prepare_worker("minimal_test_w_not_found.html").compositions
+        header = next(i for i in store.headers if i)
+        lines = list(store.text_lines())
+        self.assertEqual(lines[:len(header) + 1],
+                         [f"User mass: {store[0].experimental_mass}", *header])
+        self.assertEqual(lines.count(""), 5)
+        f = io.StringIO()
+        store.write_text(f, chunk_size=3)
+        self.assertEqual(f.getvalue(), "\n".join(lines))
+        self.assertEqual(f.getvalue(), store.to_text())
+        self.assertTrue(f.getvalue().endswith("0 structures found."))
+        self.assertEqual(f.getvalue().count("\n\nUser mass: "), 5)
+
+    def test_empty(self):
+        store = ResultStore()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(list(store), [])
+        self.assertEqual(len(store.to_frame(TestResultStore.cfg["col_names"])), 0)
+        self.assertEqual(store.to_text(), "")
+        f = io.StringIO()
+        store.write_text(f)
+        self.assertEqual(f.getvalue(), "")
+        f = io.StringIO()
+        self.assertEqual(store.write_csv(f, ["a", "b"]), 0)
+        self.assertEqual(f.getvalue(), "a,b\n")
+
+
+def prepare_cfg():
+    with open(os.path.join(THIS_DIR, "test_cfg.json"), "r") as f:
+        cfg = json.load(f)
+    return cfg
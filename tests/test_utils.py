@@ -2,6 +2,8 @@ import os
 import json
 import unittest
 
+import numpy as np
+
 from worker import utils
 
 class TestUtils(unittest.TestCase):
@@ -62,6 +64,104 @@ class TestUtils(unittest.TestCase):
                 4028.708, places=2
         )
 
+    def test_calc_adduct_mh_masses(self):
+        comp = {"(GlcNAc)": 2, "(Man)": 3, "(Deoxyhexose)": 1}
+        expected_mh = utils.calc_theor_mono_mass(comp, TestUtils.cfg)
+        adduct_ions = utils.calc_default_adducts_mono(comp, TestUtils.cfg, None, prec=6)
+        names, mh_masses = utils.calc_adduct_mh_masses(
+            [adduct_ions[i] for i in TestUtils.cfg["adducts"]], TestUtils.cfg, prec=6)
+        self.assertEqual(names, list(TestUtils.cfg["adducts"].keys()))
+        self.assertEqual(mh_masses.shape, (len(names), len(names)))
+        # each observed m/z is explained by its own adduct as the same [MH]+
+        for i in range(len(names)):
+            self.assertAlmostEqual(mh_masses[i, i], expected_mh, places=4)
+
+    def test_composition_counts(self):
+        residues = TestUtils.cfg["residues"]
+        counts = utils.composition_counts("(Hex)10 (HexNAc)5 (NeuAc)5 + (Man)3(GlcNAc)2", residues)
+        self.assertEqual(len(counts), len(residues))
+        self.assertEqual(
+            utils.counts_to_dict(counts, residues),
+            {"(Hex)": 10, "(HexNAc)": 5, "(NeuAc)": 5, "(Man)": 3, "(GlcNAc)": 2}
+        )
+        with self.assertRaises(ValueError):
+            utils.composition_counts("(Hex)3 (Xyl)1", residues)
+
+    def test_count_vector_masses(self):
+        residues = TestUtils.cfg["residues"]
+        comps = [
+            {"(GlcNAc)": 2, "(Man)": 3},
+            {"(HexNAc)": 4, "(NeuAc)": 4, "(NeuGc)": 3, "(Sulph)": 1, "(Hex)": 5},
+        ]
+        matrix = utils.counts_matrix(comps, residues)
+        self.assertEqual(matrix.dtype, np.uint8)
+        self.assertEqual(matrix.shape, (2, len(residues)))
+        self.assertEqual(tuple(matrix[0]), utils.composition_counts("(Man)3(GlcNAc)2", residues))
+        for func in (utils.calc_theor_mono_mass, utils.calc_theor_avg_mass):
+            batch = func(matrix, TestUtils.cfg, reducing_end="ProA")
+            for row, comp in enumerate(comps):
+                single = func(tuple(matrix[row]), TestUtils.cfg, reducing_end="ProA")
+                self.assertIsInstance(single, float)
+                self.assertAlmostEqual(single, func(comp, TestUtils.cfg, reducing_end="ProA"), places=5)
+                self.assertAlmostEqual(batch[row], single, places=6)
+        adduct_ions = utils.calc_default_adducts_mono(matrix, TestUtils.cfg, None)
+        self.assertEqual(adduct_ions["Na+"].shape, (2,))
+        with self.assertRaises(ValueError):
+            utils.counts_matrix([{"(Hex)": 256}], residues)
+        # masses follow cfg changed in place, no stale vectors
+        cfg = json.loads(json.dumps(TestUtils.cfg))
+        before = utils.calc_theor_mono_mass(matrix, cfg)
+        cfg["mono_masses_underivatized"]["(Hex)"] += 1.0
+        self.assertTrue(np.allclose(utils.calc_theor_mono_mass(matrix, cfg),
+                                    before + matrix[:, residues.index("(Hex)")]))
+
+    def test_mass_model(self):
+        model = utils.MassModel(TestUtils.cfg)
+        comp = {"(HexNAc)": 4, "(NeuAc)": 4, "(NeuGc)": 3, "(Sulph)": 1, "(Hex)": 5}
+        counts = utils.composition_counts("(Hex)5 (HexNAc)4 (NeuAc)4 (NeuGc)3 (Sulph)1", model.residues)
+        for tag in (None, "ProA"):
+            self.assertAlmostEqual(
+                utils.calc_theor_mono_mass(counts, model, reducing_end=tag),
+                utils.calc_theor_mono_mass(comp, TestUtils.cfg, reducing_end=tag), places=5)
+            self.assertAlmostEqual(
+                utils.calc_theor_avg_mass(comp, model, reducing_end=tag),
+                utils.calc_theor_avg_mass(comp, TestUtils.cfg, reducing_end=tag), places=5)
+            self.assertEqual(
+                utils.calc_default_adducts_mono(counts, model, tag),
+                utils.calc_default_adducts_mono(counts, TestUtils.cfg, tag))
+        names, mh_masses = utils.calc_adduct_mh_masses([933.32, 456.17], model)
+        expected_names, expected = utils.calc_adduct_mh_masses([933.32, 456.17], TestUtils.cfg)
+        self.assertEqual(names, expected_names)
+        self.assertTrue(np.array_equal(mh_masses, expected))
+        self.assertEqual(model.charge("2Na2+"), 2)
+        with self.assertRaises(ValueError):
+            model.tag_mass("2-AA")
+        with self.assertRaises(ValueError):
+            model.mono_mass({"(Xyl)": 1})
+        with self.assertRaises(ValueError):
+            model.residue_mono[0] = 0.0
+
+    def test_composition_registry(self):
+        registry = utils.CompositionRegistry(TestUtils.cfg, reducing_end="ProA", maxsize=2)
+        long_notation = "(Hex)10 (HexNAc)5 (NeuAc)5 + (Man)3(GlcNAc)2"
+        comp = registry.get(long_notation)
+        self.assertIs(registry.get(long_notation), comp)
+        self.assertEqual((registry.hits, registry.misses), (1, 1))
+        self.assertEqual(comp.short_notation, utils.truncate_str(long_notation))
+        expected = utils.calc_default_adducts_mono(utils.string_to_dict(long_notation), TestUtils.cfg, "ProA")
+        for adduct, mass in comp.adduct_ions.items():
+            self.assertAlmostEqual(mass, expected[adduct], places=3)
+        with self.assertRaises(TypeError):
+            comp.adduct_ions["H+"] = 0.0
+        # least recently used composition is dropped
+        registry.get("(Hex)3 (HexNAc)2")
+        registry.get(long_notation)
+        registry.get("(Hex)4 (HexNAc)2")
+        self.assertEqual(len(registry), 2)
+        self.assertIs(registry.get(long_notation), comp)
+        self.assertIsNot(registry.get("(Hex)3 (HexNAc)2"), None)
+        self.assertEqual(registry.misses, 4)
+
     def test_validate_filename(self):
         self.assertEqual(utils.validate_filename("proper_file_name"), "proper_file_name")
         self.assertEqual(utils.validate_filename("pr0p3r_f1l3_n4m3"), "pr0p3r_f1l3_n4m3")
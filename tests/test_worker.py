@@ -1,3 +1,4 @@
+import io
 import os
 import logging
 import unittest
@@ -6,6 +7,10 @@ from bs4 import BeautifulSoup
 
 from worker.worker import GlycomodWorker as GW
 from worker.data_types import GlycomodComposition, SubmittedMass
+from worker.data_types import GlycomodHit, GlycomodRecord
+from worker.utils import composition_counts, CompositionRegistry
+from worker import dbutil
+from tests.gm_stub import GlycomodStub
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 TEST_CFG_PATH = os.path.join(THIS_DIR, 'test_cfg.json')
@@ -29,25 +34,13 @@ class TestGlycomodWorker(unittest.TestCase):
         # mocking html
         worker.soup = prepare_mock_html('minimal_test.html')
         worker._parse_gm_html()
-        self.assertEqual(
-            worker.parsed_data,
-            [[
-                'User mass: 911.30', 'Adduct ([M+H]+): 1.00727',
-                'Derivative mass (Free reducing end): 18.0105546',
-                '892.317-0.034(Hex)3 (HexNAc)2  ', '1 structure'
-            ],
-             [
-                 'User mass: 1057.33', 'Adduct ([M+H]+): 1.00727',
-                 'Derivative mass (Free reducing end): 18.0105546',
-                 '1038.375-0.062(Hex)3 (HexNAc)2 (Deoxyhexose)1  ',
-                 '1 structure found.'
-             ]])
+        self.assertEqual(worker.records, prepare_mock_records())
 
     def test_create_glycan_objects(self):
         worker = GW(
             cfg=TestGlycomodWorker.cfg,
             db=TestGlycomodWorker.mock_db_injection)
-        worker.parsed_data = prepare_mock_parsed_data()
+        worker.records = prepare_mock_records()
         # mocking masses from db
         worker.masses_from_db = [("1", "911.30"), ("2", "1057.33")]
         worker._create_glycan_objects()
@@ -58,6 +51,115 @@ class TestGlycomodWorker(unittest.TestCase):
             for i in [i._asdict() for i in worker.compositions]:
                 print(i, file=f)
 
+    def test_multi_adduct_expansion(self):
+        worker = GW(
+            cfg=TestGlycomodWorker.cfg,
+            db=TestGlycomodWorker.mock_db_injection,
+            multi_adduct=True)
+        # (peak, observed m/z, charge): [M+Na]+ and [M+2H]2+ of (Hex)3 (HexNAc)2
+        worker.masses_from_db = [(1, 933.3175, 1), (2, 456.1712, 2)]
+        worker.masses_from_db_single = worker._get_masses_from_db_single()
+        n_adducts = len(TestGlycomodWorker.cfg["adducts"])
+        self.assertEqual(len(worker.masses_from_db_single), 2 * n_adducts)
+        self.assertEqual(len(worker.submitted_adducts), 2 * n_adducts)
+        explained = {
+            i[0]: j[0]
+            for i, j in zip(worker.masses_from_db_single,
+                            worker.submitted_adducts)
+            if abs(i[1] - 911.3350) < 0.01
+        }
+        self.assertEqual(explained, {1: "Na+", 2: "2H2+"})
+
+    def test_multi_adduct_tags_compositions(self):
+        worker = GW(
+            cfg=TestGlycomodWorker.cfg,
+            db=TestGlycomodWorker.mock_db_injection,
+            multi_adduct=True)
+        worker.masses_from_db_single = [("1", "911.30"), ("2", "1057.33")]
+        worker.submitted_adducts = [("Na+", 22.989768, 933.28),
+                                    ("2H2+", 2.014552, 529.67)]
+        worker.records = prepare_mock_records()
+        worker._create_glycan_objects()
+        self.assertEqual([i.adduct for i in worker.compositions],
+                         ["Na+", "2H2+"])
+        self.assertEqual([i.peak_number for i in worker.compositions], [1, 2])
+        # observed m/z is reported, its [M+H]+ equivalent only stored
+        self.assertEqual([i.experimental_mass for i in worker.compositions],
+                         [933.28, 529.67])
+        self.assertEqual([i.submitted_mass for i in worker.compositions],
+                         [911.30, 1057.33])
+
+    def test_multi_adduct_run(self):
+        db = dbutil.DB(":memory:")
+        n_adducts = len(TestGlycomodWorker.cfg["adducts"])
+        with GlycomodStub() as stub:
+            cfg = dict(TestGlycomodWorker.cfg, gmod_post_link=stub.url)
+            worker = GW(cfg=cfg, db=db, multi_adduct=True)
+            # observed m/z set directly, expanded to every adduct
+            worker.masses_from_db = [(1, 933.3175), (2, 456.1712)]
+            worker.run()
+            # reused by submitted [M+H]+, not by the measured m/z
+            again = GW(cfg=cfg, db=db, multi_adduct=True, reuse_results=True)
+            again.masses_from_db = list(worker.masses_from_db)
+            again._fetch_gmod_data()
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(again.reused, len(worker.submitted_adducts))
+        self.assertEqual(len(stub.requests[0]), len(worker.submitted_adducts))
+        self.assertLessEqual(len(worker.compositions), 2 * n_adducts)
+        rows = db.conn.execute(
+            "SELECT peak, adduct, adduct_mass FROM result_rows").fetchall()
+        self.assertEqual(len(rows), len(worker.compositions))
+        self.assertEqual(
+            db.conn.execute(
+                "SELECT DISTINCT peak, measured FROM results").fetchall(),
+            [(1, 933.3175), (2, 456.1712)])
+        # every adduct is stored once
+        self.assertEqual(
+            db.conn.execute("SELECT COUNT(*) FROM adducts").fetchone(),
+            (len({i[1] for i in rows}), ))
+        # every stored row tells which adduct explains it
+        self.assertEqual(len(set(rows)), len(rows))
+        self.assertEqual({i[1] for i in rows if i[0] == 1},
+                         {i.adduct for i in worker.compositions
+                          if i.peak_number == 1})
+
+    def test_write_text(self):
+        worker = GW(
+            cfg=TestGlycomodWorker.cfg,
+            db=TestGlycomodWorker.mock_db_injection)
+        worker.records = prepare_mock_records()[:1] + [
+            GlycomodRecord(1500.0, ('Adduct ([M+H]+): 1.00727', ), ())
+        ]
+        worker.masses_from_db = [("1", "911.30"), ("2", "1500.0")]
+        worker._create_glycan_objects()
+        f = io.StringIO()
+        worker._write_text(f)
+        self.assertEqual(
+            f.getvalue(), "User mass: 911.3\n"
+            "Adduct ([M+H]+): 1.00727\n"
+            "Derivative mass (Free reducing end): 18.0105546\n"
+            "\t1. [MH]+:   892.317,  Error: -0.034, Comp: (Hex)3(HexNAc)2\n"
+            "1 structure found.\n\n"
+            "User mass: 1500.0\n"
+            "Adduct ([M+H]+): 1.00727\n"
+            "0 structures found.")
+
+    def test_shared_registry(self):
+        registry = CompositionRegistry(TestGlycomodWorker.cfg)
+        first = GW(cfg=TestGlycomodWorker.cfg, db=None, registry=registry)
+        second = GW(cfg=TestGlycomodWorker.cfg, db=None, registry=registry)
+        for worker in (first, second):
+            worker.records = prepare_mock_records()
+            worker.masses_from_db = [("1", "911.30"), ("2", "1057.33")]
+            worker._create_glycan_objects()
+        self.assertEqual((registry.misses, registry.hits), (2, 2))
+        self.assertEqual(list(first.compositions), list(second.compositions))
+        with self.assertRaises(ValueError):
+            GW(cfg=TestGlycomodWorker.cfg,
+               db=None,
+               registry=CompositionRegistry(
+                   TestGlycomodWorker.cfg, reducing_end="ProA"))
+
     def test_masses_to_text(self):
         worker = GW(
             cfg=TestGlycomodWorker.cfg,
@@ -66,6 +168,115 @@ class TestGlycomodWorker(unittest.TestCase):
         masses_as_text = worker._db_masses_to_text()
         self.assertEqual(masses_as_text, "911.30\n1057.33")
 
+    def test_reuse_results(self):
+        db = dbutil.DB(":memory:")
+        masses = [("1", "911.30"), ("2", "1057.33"), ("3", "1500.00")]
+        with GlycomodStub() as stub:
+            cfg = dict(TestGlycomodWorker.cfg, gmod_post_link=stub.url)
+            first = GW(cfg=cfg, db=db, reuse_results=True)
+            first.masses_from_db = list(masses)
+            first.run()
+            second = GW(cfg=cfg, db=db, reuse_results=True)
+            second.masses_from_db = masses + [("4", "1454.0")]
+            second.run()
+            self.assertEqual(stub.requests, [[i[1] for i in masses],
+                                             ["1454.0"]])
+            # other parameters - searched again
+            third = GW(cfg=cfg, db=db, reuse_results=True, adduct="Na+")
+            third.masses_from_db = list(masses)
+            third._fetch_gmod_data()
+            self.assertEqual(len(stub.requests), 3)
+        self.assertEqual((first.reused, second.reused, third.reused),
+                         (0, 3, 0))
+        self.assertEqual(second.records[:3], first.records)
+        self.assertEqual(list(second.compositions)[:3],
+                         list(first.compositions))
+        self.assertTrue(second.compositions.to_text().startswith(
+            first.compositions.to_text()))
+        # every run keeps all its masses
+        self.assertEqual(
+            db.conn.execute("SELECT COUNT(DISTINCT peak) FROM results "
+                            "WHERE run_id = 2").fetchone(), (4, ))
+
+    def test_iter_run(self):
+        db = dbutil.DB(":memory:")
+        masses = [("1", "911.30"), ("2", "1057.33"), ("3", "1500.00"),
+                  ("4", "1454.0")]
+        csv_file, text_file = io.StringIO(), io.StringIO()
+        with GlycomodStub() as stub:
+            cfg = dict(TestGlycomodWorker.cfg, gmod_post_link=stub.url)
+            worker = GW(cfg=cfg, db=db)
+            worker.masses_from_db = list(masses)
+            chunks = worker.iter_run(chunk_size=3, csv_file=csv_file,
+                                     text_file=text_file, prefetch=1)
+            first = next(chunks)
+            # first chunk is searched, saved and written before the rest
+            self.assertEqual(stub.requests, [[i[1] for i in masses[:3]]])
+            self.assertEqual(len(first), 3)
+            self.assertEqual(
+                db.conn.execute("SELECT finished FROM history").fetchall(),
+                [(0, )])
+            self.assertEqual(len(list(chunks)), 1)
+            self.assertEqual(len(stub.requests), 2)
+            whole = GW(cfg=cfg, db=db)
+            whole.masses_from_db = list(masses)
+            whole.run()
+        self.assertEqual(worker.compositions[0].experimental_mass, 1454.0)
+        self.assertEqual(
+            db.conn.execute("SELECT finished FROM history").fetchall(),
+            [(1, ), (1, )])
+        self.assertEqual(
+            db.conn.execute("SELECT COUNT(*) FROM results WHERE run_id = 1"
+                            ).fetchone(),
+            db.conn.execute("SELECT COUNT(*) FROM results WHERE run_id = 2"
+                            ).fetchone())
+        expected = io.StringIO()
+        whole.compositions.write_csv(expected, cfg["col_names"])
+        self.assertEqual(csv_file.getvalue(), expected.getvalue())
+        self.assertEqual(text_file.getvalue(), whole.compositions.to_text())
+
+    def test_iter_run_prefetch(self):
+        masses = [(str(i), "911.30") for i in range(1, 5)]
+        with GlycomodStub(latency=0.3) as stub:
+            cfg = dict(TestGlycomodWorker.cfg, gmod_post_link=stub.url)
+            worker = GW(cfg=cfg, db=None)
+            worker.masses_from_db = list(masses)
+            peaks = [i.peak_number for chunk in worker.iter_run(chunk_size=1)
+                     for i in chunk]
+        self.assertEqual(len(stub.requests), 4)
+        # chunks are searched at once and yielded in order
+        self.assertGreater(stub.max_in_flight, 1)
+        self.assertEqual(peaks, [1, 2, 3, 4])
+
+    def test_iter_run_aborts(self):
+        db = dbutil.DB(":memory:")
+        db.insert_hist = lambda *args: None
+        with GlycomodStub() as stub:
+            cfg = dict(TestGlycomodWorker.cfg, gmod_post_link=stub.url)
+            worker = GW(cfg=cfg, db=db)
+            worker.masses_from_db = [("1", "911.30"), ("2", "1057.33")]
+            with self.assertRaises(RuntimeError):
+                list(worker.iter_run(chunk_size=1, prefetch=1))
+        # nothing is attached to another run
+        self.assertEqual(
+            db.conn.execute("SELECT COUNT(*) FROM results").fetchone(), (0, ))
+        # only the last chunk is kept, not exported as if it were all results
+        with self.assertRaises(RuntimeError):
+            worker.output_csv()
+
+    def test_run_aborts(self):
+        db = dbutil.DB(":memory:")
+        db.insert_run = lambda *args, **kwargs: None
+        with GlycomodStub() as stub:
+            cfg = dict(TestGlycomodWorker.cfg, gmod_post_link=stub.url)
+            worker = GW(cfg=cfg, db=db)
+            worker.masses_from_db = [("1", "911.30"), ("2", "1057.33")]
+            with self.assertRaises(RuntimeError):
+                worker.run()
+        self.assertFalse(worker.chunked)
+        self.assertEqual(
+            db.conn.execute("SELECT COUNT(*) FROM history").fetchone(), (0, ))
+
 
 def prepare_mock_html(file_name):
     file_path = os.path.join(THIS_DIR, 'test_html', file_name)
@@ -75,18 +286,19 @@ def prepare_mock_html(file_name):
     return data
 
 
-def prepare_mock_parsed_data():
-    return [[
-        'User mass: 911.30', 'Adduct ([M+H]+): 1.00727',
-        'Derivative mass (Free reducing end): 18.0105546',
-        '892.317-0.034(Hex)3 (HexNAc)2  ', '1 structure'
-    ],
-            [
-                'User mass: 1057.33', 'Adduct ([M+H]+): 1.00727',
-                'Derivative mass (Free reducing end): 18.0105546',
-                '1038.375-0.062(Hex)3 (HexNAc)2 (Deoxyhexose)1  ',
-                '1 structure found.'
-            ]]
+def prepare_mock_records():
+    residues = prepare_cfg()["residues"]
+    header = ('Adduct ([M+H]+): 1.00727',
+              'Derivative mass (Free reducing end): 18.0105546')
+    return [
+        GlycomodRecord(911.30, header, (GlycomodHit(
+            892.317, -0.034, '(Hex)3 (HexNAc)2',
+            composition_counts('(Hex)3 (HexNAc)2', residues)), )),
+        GlycomodRecord(1057.33, header, (GlycomodHit(
+            1038.375, -0.062, '(Hex)3 (HexNAc)2 (Deoxyhexose)1',
+            composition_counts('(Hex)3 (HexNAc)2 (Deoxyhexose)1',
+                               residues)), ))
+    ]
 
 
 def prepare_cfg():
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from worker import dbutil
+from worker.write_queue import PeakBatch, PeakWriteQueue
+
+
+class TestPeakWriteQueue(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = dbutil.DB(os.path.join(self.path, "peaks.db"))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.path)
+
+    def test_batch_coalesces(self):
+        batch = PeakBatch()
+        batch.add("insert", [(1, 911.3, 1), (1, 1057.33, 1)])
+        batch.add("delete", [(1, 911.3, 1), (2, 1454.0, 1)])
+        self.assertEqual(batch.inserts, [(1, 1057.33, 1)])
+        self.assertEqual(batch.deletes, [(2, 1454.0, 1)])
+        batch.add("picked", ("a.mzML", 12.5, 1, [(1, 911.3, 1)]))
+        batch.add("picked", ("a.mzML", 12.5, 2, []))
+        self.assertEqual(batch.picked, {("a.mzML", 12.5): (2, [])})
+        batch.add("clear", None)
+        batch.add("insert", [(3, 2000.0, 2)])
+        self.assertEqual((batch.clear, batch.inserts, batch.deletes),
+                         (True, [(3, 2000.0, 2)], []))
+        with self.assertRaises(ValueError):
+            batch.add("update", [])
+
+    def test_windows_share_queue(self):
+        self.db.insert_many_masses_into_curr([(1, 800.0, 1)])
+        peaks = PeakWriteQueue(self.db, linger=0.2)
+
+        def window(peak):
+            peaks.insert([(peak, 900.0 + i, 1) for i in range(100)])
+            peaks.delete([(peak, 900.0, 1)])
+
+        windows = [threading.Thread(target=window, args=(i, ))
+                   for i in range(2, 6)]
+        for i in windows:
+            i.start()
+        for i in windows:
+            i.join()
+        peaks.delete([(1, 800.0, 1)])
+        self.assertTrue(peaks.flush(timeout=10))
+        rows = self.db.read_current_masses()
+        self.assertEqual(len(rows), 4 * 99)
+        self.assertNotIn((1, 800.0, 1), rows)
+        self.assertNotIn((2, 900.0, 1), rows)
+        # coalesced into a few transactions, not one per window or peak
+        self.assertLessEqual(peaks.transactions, 2)
+        peaks.close()
+
+    def test_close_flushes(self):
+        mz = np.linspace(100.0, 2000.0, 10)
+        self.db.store_spectrum("a.mzML", 12.5, mz, mz)
+        peaks = PeakWriteQueue(self.db, linger=5.0)
+        peaks.clear()
+        peaks.insert([(1, 911.3, 1)])
+        peaks.store_picked_peaks("a.mzML", 12.5, 1, [(1, 911.3, 1)])
+        peaks.close()
+        self.assertEqual(self.db.read_current_masses(), [(1, 911.3, 1)])
+        np.testing.assert_array_equal(
+            self.db.load_spectrum("a.mzML", 12.5).picked, [[911.3, 1.0]])
+        self.assertTrue(peaks.flush())
+
+    def test_write_after_close(self):
+        # a ScanWindow closed after the App writes straight to db
+        mz = np.linspace(100.0, 2000.0, 10)
+        self.db.store_spectrum("a.mzML", 12.5, mz, mz)
+        peaks = PeakWriteQueue(self.db)
+        peaks.close()
+        peaks.insert([(1, 911.3, 1)])
+        peaks.store_picked_peaks("a.mzML", 12.5, 1, [(1, 911.3, 1)])
+        self.assertTrue(peaks.closed)
+        self.assertEqual(self.db.read_current_masses(), [(1, 911.3, 1)])
+        np.testing.assert_array_equal(
+            self.db.load_spectrum("a.mzML", 12.5).picked, [[911.3, 1.0]])
+
+    def test_queued_spectrum(self):
+        mz = np.linspace(100.0, 2000.0, 10)
+        peaks = PeakWriteQueue(self.db, linger=5.0)
+        peaks.store_spectrum("a.mzML", 12.5, mz, mz * 2, "MS1", 1)
+        peaks.store_spectrum("a.mzML", 12.5, mz, mz * 3, "MS1", 2)
+        # picked peaks of the queued spectrum are stored after it
+        peaks.store_picked_peaks("a.mzML", 12.5, 2, [(2, 911.3, 1)])
+        self.assertIsNone(self.db.load_spectrum("a.mzML", 12.5))
+        peaks.close()
+        stored = self.db.load_spectrum("a.mzML", 12.5)
+        self.assertEqual(stored.peak_num, 2)
+        np.testing.assert_array_equal(stored.intensity, mz * 3)
+        np.testing.assert_array_equal(stored.picked, [[911.3, 1.0]])
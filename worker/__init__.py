@@ -1,2 +1,3 @@
 from . import utils
-from . import data_types
\ No newline at end of file
+from . import data_types
+from . import isotopes
\ No newline at end of file
@@ -0,0 +1,248 @@
+# -*- coding: UTF-8 -*-
+import ssl
+import time
+import asyncio
+import logging
+from urllib.parse import urljoin, urlsplit
+
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+from .client import RETRY_STATUS, chunk_masses
+from .parser import parse_gm_stream
+from .utils import CompositionRegistry
+from .worker import GlycomodWorker
+
+# followed like requests does: 307/308 repeat the POST, others continue with GET
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+
+class GlycomodHTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"Glycomod responded with {status}")
+        self.status = status
+
+
+class RateLimiter:
+    """Token bucket allowing rate acquisitions per second with bursts of up to burst"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = None  # created in the loop using the limiter
+
+    async def acquire(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _dechunk(data) -> bytes:
+    """Decodes body sent with Transfer-Encoding: chunked"""
+    out = bytearray()
+    pos = 0
+    while True:
+        end = data.index(b"\r\n", pos)
+        size = int(data[pos:end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(out)
+        start = end + 2
+        out += data[start:start + size]
+        pos = start + size + 2
+
+
+async def _http_request(method, url, body, headers):
+    """Sends one HTTP/1.1 request over asyncio streams,
+    returns (status, headers, content)"""
+    parts = urlsplit(url)
+    https = parts.scheme == "https"
+    port = parts.port or (443 if https else 80)
+    reader, writer = await asyncio.open_connection(
+        parts.hostname,
+        port,
+        ssl=ssl.create_default_context() if https else None)
+    try:
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        head = [
+            f"{method} {path} HTTP/1.1", f"Host: {parts.netloc}",
+            f"Content-Length: {len(body)}", "Connection: close"
+        ] + [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+        raw = await reader.read()
+    finally:
+        writer.close()
+    header_blob, _, content = raw.partition(b"\r\n\r\n")
+    lines = header_blob.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    resp_headers = {
+        k.strip().lower(): v.strip()
+        for k, v in (i.split(":", 1) for i in lines[1:] if ":" in i)
+    }
+    if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+        content = _dechunk(content)
+    return status, resp_headers, content
+
+
+async def _follow_redirects(url, body, headers, max_redirects):
+    method = "POST"
+    for _ in range(max_redirects + 1):
+        status, resp_headers, content = await _http_request(
+            method, url, body, headers)
+        if status not in REDIRECT_STATUS or "location" not in resp_headers:
+            return status, content
+        url = urljoin(url, resp_headers["location"])
+        if status not in (307, 308):
+            method, body = "GET", b""
+            headers = {
+                k: v
+                for k, v in headers.items() if k.lower() != "content-type"
+            }
+    # still redirected after max_redirects
+    raise GlycomodHTTPError(status)
+
+
+async def http_post(url, body, headers, timeout, max_redirects=5):
+    """Minimal HTTP/1.1 POST over asyncio streams, returns (status, content)
+    param::timeout seconds for the whole exchange - connecting, sending,
+        reading and following redirects (REDIRECT_STATUS)"""
+    return await asyncio.wait_for(
+        _follow_redirects(url, body, headers, max_redirects), timeout)
+
+
+class AsyncGlycomodClient:
+    """AsyncGlycomodClient is the asyncio counterpart of client.GlycomodClient.
+
+    Requests from all searches sharing a client go through one RateLimiter
+    (rate requests per second) and at most max_concurrency are in flight.
+    Both are created in the running loop on first use, a client used
+    by another loop (e.g. a later asyncio.run) gets its own.
+    Parsing runs in executor (None -> loop default executor) so the event loop
+    is never blocked by parsing large responses.
+    """
+
+    def __init__(self,
+                 cfg,
+                 rate=2.0,
+                 burst=4,
+                 max_concurrency=8,
+                 chunk_size=50,
+                 timeout=120,
+                 retries=3,
+                 backoff=1.0,
+                 executor=None,
+                 url=None):
+        self.logger = logging.getLogger(name="AsyncGlycomodClient")
+        self.cfg = cfg
+        self.url = url or cfg["gmod_post_link"]
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.executor = executor
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self.limiter = None
+        self.semaphore = None
+        self.registry = CompositionRegistry(cfg)
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self.limiter = RateLimiter(self.rate, self.burst)
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def fetch(self, form_fields, masses_text) -> bytes:
+        """Posts a single chunk of masses, retrying failed requests"""
+        fields = dict(form_fields)
+        fields["Masses"] = "\n".join(masses_text)
+        gmod_form = MultipartEncoder(fields=fields)
+        body = gmod_form.to_string()
+        head = {
+            "User-Agent": self.cfg["UA"],
+            "Content-Type": gmod_form.content_type
+        }
+        self._bind_loop()
+        for attempt in range(self.retries + 1):
+            await self.limiter.acquire()
+            try:
+                async with self.semaphore:
+                    status, content = await http_post(self.url, body, head,
+                                                      self.timeout)
+                if status < 400:
+                    return content
+                err = GlycomodHTTPError(status)
+                if status not in RETRY_STATUS:
+                    raise err
+            except (OSError, asyncio.TimeoutError) as e:
+                err = e
+            if attempt == self.retries:
+                raise err
+            await asyncio.sleep(self.backoff * 2**attempt)
+
+    async def parse(self, content, registry=None) -> list:
+        if registry is None:
+            registry = self.registry
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, parse_gm_stream,
+                                          content, registry)
+
+    async def _search_chunk(self, form_fields, masses_text, registry) -> list:
+        return await self.parse(
+            await self.fetch(form_fields, masses_text), registry)
+
+    async def search(self, form_fields, masses_text, registry=None) -> list:
+        """Returns GlycomodRecord for every mass in masses_text, in order"""
+        parsed_chunks = await asyncio.gather(*[
+            self._search_chunk(form_fields, i, registry)
+            for i in chunk_masses(list(masses_text), self.chunk_size)
+        ])
+        return [i for chunk in parsed_chunks for i in chunk]
+
+
+async def search(cfg, masses, client, save=False, **worker_kwargs) -> list:
+    """Runs a Glycomod search as a coroutine and returns SubmittedMass objects
+    param::masses [(peak_number, mass, charge),...] as read from curr_ephem
+    param::client AsyncGlycomodClient shared by concurrent searches
+    param::save store results using worker_kwargs["db"] when done
+    Every call uses its own GlycomodWorker, so searches do not share state.
+    Masses are served from worker_kwargs["cache"] and earlier runs
+    (reuse_results) like GlycomodWorker.run, only missing masses are sent
+    to client. Lookups and saving are blocking SQLite calls and run
+    in client.executor.
+    """
+    worker_kwargs.setdefault("db", None)
+    worker = GlycomodWorker(cfg, **worker_kwargs)
+    worker.masses_from_db = list(masses)
+    worker.masses_from_db_single = worker._get_masses_from_db_single()
+    masses_text = [str(i[1]) for i in worker._submitted_masses()]
+    worker._build_gm_form("\n".join(masses_text))
+    loop = asyncio.get_running_loop()
+    served, missing = await loop.run_in_executor(
+        client.executor, worker._lookup_records, masses_text)
+    records = []
+    if missing:
+        records = await client.search(
+            worker._search_fields(), [masses_text[i] for i in missing],
+            registry=worker.registry)
+    worker.records = await loop.run_in_executor(
+        client.executor, worker._merge_records, masses_text, served, missing,
+        records)
+    await loop.run_in_executor(client.executor,
+                               worker._create_glycan_objects)
+    if save:
+        await loop.run_in_executor(client.executor, worker._save_results)
+    return worker.compositions
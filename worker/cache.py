@@ -0,0 +1,200 @@
+# -*- coding: UTF-8 -*-
+import json
+import logging
+import datetime
+import sqlite3
+import threading
+
+from .data_types import GlycomodHit, GlycomodRecord
+from .utils import form_params_key
+
+
+def setup_cache_tables(db_conn):
+    c = db_conn.cursor()
+    c.execute("""CREATE TABLE IF NOT EXISTS gm_cache (
+            params_key TEXT,
+            mass REAL,
+            window REAL,
+            entry TEXT,
+            created TEXT,
+            last_used TEXT)
+            """)
+    # sorted mass index per parameter set - lookups are range scans
+    c.execute("""CREATE INDEX IF NOT EXISTS gm_cache_key_mass
+            ON gm_cache (params_key, mass)""")
+    c.execute("""CREATE INDEX IF NOT EXISTS gm_cache_last_used
+            ON gm_cache (last_used)""")
+    db_conn.commit()
+
+
+def _window(mass, tolerance, unit):
+    """Returns tolerance in Da around mass"""
+    if unit == "ppm":
+        return mass * tolerance / 1e6
+    return tolerance
+
+
+def _to_json(record):
+    return json.dumps({
+        "header": list(record.header),
+        "hits": [list(i) for i in record.hits]
+    })
+
+
+class GlycomodCache:
+    """GlycomodCache stores parsed Glycomod results per submitted mass in SQLite.
+
+    Entries are keyed by the normalized form parameters (everything except "Masses")
+    and indexed by mass, so a mass is served locally whenever a cached search
+    window fully covers its own tolerance window. Deltas of served compositions
+    are shifted to the new mass and compositions outside tolerance are dropped,
+    giving the same result Glycomod would return.
+
+    slack widens the tolerance of searches sent to Glycomod (same unit as Tolerance)
+    so that later masses within slack of a cached one become cache hits.
+    Higher slack -> higher hit rate, at the cost of larger responses.
+
+    Eviction: entries older than max_age_days are dropped and only the max_entries
+    most recently used entries are kept.
+
+    The cache may be used from any thread (iter_run prefetch, aio executor),
+    its single connection is serialized by a lock.
+    """
+
+    def __init__(self, path, slack=0.0, max_entries=100000, max_age_days=None):
+        self.logger = logging.getLogger(name="GlycomodCache")
+        # shared by threads, every use holds _lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.slack = float(slack)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        setup_cache_tables(self.conn)
+
+    @classmethod
+    def from_cfg(cls, cfg):
+        """Creates cache from config.json/"response_cache" """
+        cache_cfg = cfg["response_cache"]
+        return cls(
+            cache_cfg["path"],
+            slack=cache_cfg.get("slack", 0.0),
+            max_entries=cache_cfg.get("max_entries", 100000),
+            max_age_days=cache_cfg.get("max_age_days"))
+
+    def __del__(self):
+        self.conn.close()
+
+    def close(self):
+        self.__del__()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def _tolerance(form_fields):
+        return float(form_fields["Tolerance"]), form_fields["D_or_ppm"]
+
+    def fetch_fields(self, form_fields, masses_text):
+        """Returns form fields used for fetching uncached masses from Glycomod"""
+        tolerance, _ = self._tolerance(form_fields)
+        fields = dict(form_fields)
+        fields["Masses"] = masses_text
+        if self.slack:
+            fields["Tolerance"] = str(tolerance + self.slack)
+        return fields
+
+    def _serve(self, header, hits, cached_mass, mass, tolerance, unit):
+        """Rebuilds GlycomodRecord for mass from cached header and hits"""
+        shift = mass - cached_mass
+        if unit == "ppm":
+            shift = shift / mass * 1e6
+        served = []
+        for theor, delta, comp, counts in hits:
+            new_delta = delta + shift
+            # records may come from searches with widened tolerance
+            if abs(new_delta) > tolerance + 1e-9:
+                continue
+            if shift:
+                delta = round(new_delta, 3)
+            served.append(GlycomodHit(theor, delta, comp, tuple(counts)))
+        return GlycomodRecord(mass, tuple(header), tuple(served))
+
+    def lookup(self, form_fields, masses):
+        """Returns {index: GlycomodRecord} for masses covered by the cache
+        param::masses list of submitted masses as floats"""
+        key = form_params_key(form_fields)
+        tolerance, unit = self._tolerance(form_fields)
+        served = {}
+        used = []
+        now = datetime.datetime.now().isoformat()
+        with self._lock:
+            for index, mass in enumerate(masses):
+                need = _window(mass, tolerance, unit)
+                bound = _window(mass, tolerance + self.slack, unit)
+                rows = self.conn.execute(
+                    """SELECT rowid, mass, window, entry FROM gm_cache
+                    WHERE params_key = ? AND mass BETWEEN ? AND ?
+                    ORDER BY abs(mass - ?)""",
+                    (key, mass - bound, mass + bound, mass)).fetchall()
+                for rowid, cached_mass, window, entry in rows:
+                    if abs(mass - cached_mass) + need <= window + 1e-9:
+                        cached = json.loads(entry)
+                        served[index] = self._serve(cached["header"],
+                                                    cached["hits"], cached_mass,
+                                                    mass, tolerance, unit)
+                        used.append((now, rowid))
+                        break
+            with self.conn as conn:
+                conn.executemany(
+                    "UPDATE gm_cache SET last_used = ? WHERE rowid = ?", used)
+            self.hits += len(served)
+            self.misses += len(masses) - len(served)
+        self.logger.debug(
+            f"Served {len(served)}/{len(masses)} masses from cache")
+        return served
+
+    def store(self, form_fields, records):
+        """Stores GlycomodRecord list fetched with fetch_fields(form_fields, ...)
+        and returns it trimmed to the requested tolerance"""
+        key = form_params_key(form_fields)
+        tolerance, unit = self._tolerance(form_fields)
+        now = datetime.datetime.now().isoformat()
+        rows = []
+        served = []
+        for record in records:
+            mass = record.user_mass
+            window = _window(mass, tolerance + self.slack, unit)
+            rows.append((key, mass, window, _to_json(record), now, now))
+            served.append(
+                self._serve(record.header, record.hits, mass, mass, tolerance,
+                            unit))
+        with self._lock:
+            with self.conn as conn:
+                conn.executemany(
+                    "INSERT INTO gm_cache VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._evict()
+        return served
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        with self.conn as conn:
+            if self.max_age_days is not None:
+                cutoff = (datetime.datetime.now() - datetime.timedelta(
+                    days=self.max_age_days)).isoformat()
+                conn.execute("DELETE FROM gm_cache WHERE created < ?",
+                             (cutoff, ))
+            if self.max_entries is not None:
+                count = conn.execute(
+                    "SELECT COUNT(*) FROM gm_cache").fetchone()[0]
+                if count > self.max_entries:
+                    conn.execute(
+                        """DELETE FROM gm_cache WHERE rowid IN
+                        (SELECT rowid FROM gm_cache ORDER BY last_used LIMIT ?)""",
+                        (count - self.max_entries, ))
@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+from .parser import parse_gm_stream
+from .utils import CompositionRegistry
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def chunk_masses(masses_text, chunk_size) -> list:
+    """Splits list of masses into chunks of at most chunk_size masses"""
+    return [
+        masses_text[i:i + chunk_size]
+        for i in range(0, len(masses_text), chunk_size)
+    ]
+
+
+class GlycomodClient:
+    """GlycomodClient submits masses to Glycomod in chunks over a pooled session.
+
+    Chunks are sent concurrently (at most max_workers requests in flight)
+    and every request has a (connect, read) timeout. Connection errors,
+    timeouts and 429/5xx responses are retried up to retries times with
+    exponential backoff (backoff, 2*backoff, 4*backoff... seconds).
+
+    Parsed results are reassembled in the order the masses were submitted.
+    """
+
+    def __init__(self,
+                 cfg,
+                 chunk_size=50,
+                 max_workers=4,
+                 timeout=(10, 120),
+                 retries=3,
+                 backoff=1.0,
+                 url=None,
+                 session=None):
+        self.logger = logging.getLogger(name="GlycomodClient")
+        self.cfg = cfg
+        self.url = url or cfg["gmod_post_link"]
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.registry = CompositionRegistry(cfg)
+        # passed sessions keep their adapters (e.g. replay.ReplayAdapter)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=max_workers, pool_block=True)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def close(self):
+        self.session.close()
+
+    def _post(self, form_fields, masses_text) -> bytes:
+        """Posts a single chunk of masses, retrying failed requests"""
+        fields = dict(form_fields)
+        fields["Masses"] = "\n".join(masses_text)
+        for attempt in range(self.retries + 1):
+            # multipart body is a stream - it has to be rebuilt for every attempt
+            gmod_form = MultipartEncoder(fields=fields)
+            head = {
+                "User-Agent": self.cfg["UA"],
+                'Content-Type': gmod_form.content_type
+            }
+            try:
+                resp = self.session.post(
+                    self.url,
+                    headers=head,
+                    data=gmod_form,
+                    timeout=self.timeout)
+                if resp.status_code not in RETRY_STATUS:
+                    resp.raise_for_status()
+                    return resp.content
+                err = requests.HTTPError(
+                    f"Glycomod responded with {resp.status_code}",
+                    response=resp)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                err = e
+            if attempt == self.retries:
+                raise err
+            delay = self.backoff * 2**attempt
+            self.logger.debug(
+                f"Chunk of {len(masses_text)} masses failed ({err}), retrying in {delay}s"
+            )
+            time.sleep(delay)
+
+    def fetch(self, form_fields, masses_text) -> list:
+        """Returns raw Glycomod responses, one for each chunk of masses_text"""
+        chunks = chunk_masses(list(masses_text), self.chunk_size)
+        if len(chunks) <= 1:
+            return [self._post(form_fields, i) for i in chunks]
+        with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(chunks))) as executor:
+            # map keeps submission order
+            return list(
+                executor.map(lambda i: self._post(form_fields, i), chunks))
+
+    def search(self, form_fields, masses_text, registry=None) -> list:
+        """Returns GlycomodRecord for every mass in masses_text, in order
+        param::form_fields Glycomod form fields, "Masses" is replaced per chunk
+        param::masses_text list of masses as strings
+        param::registry utils.CompositionRegistry, defaults to client's own"""
+        if registry is None:
+            registry = self.registry
+        records = []
+        for content in self.fetch(form_fields, masses_text):
+            records.extend(parse_gm_stream(content, registry))
+        return records
@@ -1,9 +1,41 @@
-from typing import NamedTuple, List
+from typing import NamedTuple, List, Tuple, Mapping
 from pprint import pprint
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 import requests
 
 
+class GlycomodHit(NamedTuple):
+    theoretical_MH: float
+    delta: float
+    long_notation: str
+    counts: Tuple[int, ...]  # residue counts in config.json/"residues" order
+
+
+class InternedComposition(NamedTuple):
+    """Composition parsed once by utils.CompositionRegistry"""
+    long_notation: str
+    counts: Tuple[int, ...]  # residue counts in config.json/"residues" order
+    short_notation: str
+    adduct_ions: Mapping[str, float]  # read-only {adduct: theoretical m/z}
+
+
+class GlycomodRecord(NamedTuple):
+    """Glycomod results for a single submitted mass"""
+    user_mass: float
+    header: Tuple[str, ...]  # adduct and derivative mass lines
+    hits: Tuple[GlycomodHit, ...]
+
+
+class StoredSpectrum(NamedTuple):
+    """Spectrum a user opened, as stored by dbutil.DB.store_spectrum"""
+    ret_time: float
+    peak_num: int
+    scan_type: str
+    mz: "np.ndarray"  # read-only view of the stored BLOB
+    intensity: "np.ndarray"
+    picked: "np.ndarray"  # (n, 2) picked (mz, charge), empty if none saved
+
+
 class GlycomodComposition(NamedTuple):
     theoretical_MH: float
     delta: float
@@ -30,6 +62,8 @@ class SubmittedMass(NamedTuple):
     red_end_tag: str
     red_end_tag_mass: float
     glycomod_structures: List[GlycomodComposition]
+    # [M+H]+ searched for experimental_mass (multi adduct), None if the same
+    submitted_mass: float = None
 
     def __repr__(self):
         return f"Experimental mass: {self.experimental_mass}\n" + \
@@ -47,8 +81,8 @@ class SubmittedMass(NamedTuple):
                     self.experimental_mass,
                     self.red_end_tag,
                     self.red_end_tag_mass,
-                    # self.adduct,
-                    # self.adduct_mass,
+                    self.adduct,
+                    self.adduct_mass,
                     i.short_notation,
                     i.long_notation,
                     i.theoretical_MH,
@@ -72,7 +106,10 @@ class SubmittedMass(NamedTuple):
                     (self.peak_number, self.experimental_mass,
                      i.theoretical_MH, i.theoretical_MTagH, i.long_notation,
                      i.short_notation, self.red_end_tag,
-                     self.red_end_tag_mass))
+                     self.red_end_tag_mass, i.delta, self.adduct,
+                     self.adduct_mass, self.submitted_mass
+                     if self.submitted_mass is not None else
+                     self.experimental_mass))
         return structure_list
 
 
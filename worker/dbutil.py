@@ -1,9 +1,18 @@
 import os
+import csv
 import json
+import zlib
 import datetime
+import itertools
+import threading
 
 import sqlite3
 
+import numpy as np
+
+from .data_types import GlycomodHit, GlycomodRecord, StoredSpectrum
+from .utils import composition_counts, form_params_key
+
 
 def setup_db_tables(db_conn):
     c = db_conn.cursor()
@@ -36,6 +45,317 @@ def setup_db_tables(db_conn):
         mass FLOAT,
         charge INTEGER)
         """)
+    migrate(db_conn)
+
+
+def _migration_1(c):
+    """Indexes for run, peak and mass lookups and history by date"""
+    c.execute("CREATE INDEX IF NOT EXISTS results_run_id ON results (run_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS results_peak ON results (peak)")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS results_measured ON results (measured)")
+    c.execute("CREATE INDEX IF NOT EXISTS history_date ON history (date)")
+
+
+def _migration_2(c):
+    """Index for composition (short notation) lookups"""
+    c.execute("CREATE INDEX IF NOT EXISTS results_comp_s ON results (comp_s)")
+
+
+def _create_normalized_tables(c):
+    c.execute("""CREATE TABLE param_sets (
+            id INTEGER PRIMARY KEY,
+            key TEXT UNIQUE,
+            params TEXT)
+            """)
+    c.execute("""CREATE TABLE history (
+            id INTEGER PRIMARY KEY,
+            date TEXT,
+            data TEXT,
+            params_id INTEGER,
+            finished INTEGER,
+            FOREIGN KEY(params_id) REFERENCES param_sets(id))
+            """)
+    # one row per distinct hit - composition with its masses for a reducing end
+    c.execute("""CREATE TABLE compositions (
+            id INTEGER PRIMARY KEY,
+            comp_l TEXT,
+            comp_s TEXT,
+            counts BLOB,
+            tag TEXT,
+            tag_mass REAL,
+            theorMH REAL,
+            theorMHTag REAL,
+            UNIQUE(comp_l, tag, tag_mass, theorMH, theorMHTag))
+            """)
+    c.execute("""CREATE TABLE results (
+            id INTEGER PRIMARY KEY,
+            run_id INTEGER,
+            peak INTEGER,
+            measured REAL,
+            comp_id INTEGER,
+            FOREIGN KEY(run_id) REFERENCES history(id),
+            FOREIGN KEY(comp_id) REFERENCES compositions(id))
+            """)
+    c.execute("CREATE INDEX results_run_id ON results (run_id)")
+    c.execute("CREATE INDEX results_peak ON results (peak)")
+    c.execute("CREATE INDEX results_measured ON results (measured)")
+    c.execute("CREATE INDEX results_comp_id ON results (comp_id)")
+    c.execute("CREATE INDEX history_date ON history (date)")
+    c.execute("CREATE INDEX compositions_comp_s ON compositions (comp_s)")
+    # flat rows as stored before normalization
+    c.execute("""CREATE VIEW result_rows AS
+            SELECT r.id AS id, h.date AS date, r.run_id AS run_id,
+                r.peak AS peak, r.measured AS measured,
+                c.theorMH AS theorMH, c.theorMHTag AS theorMHTag,
+                c.comp_l AS comp_l, c.comp_s AS comp_s,
+                c.tag AS tag, c.tag_mass AS tag_mass
+            FROM results r
+            LEFT JOIN history h ON h.id = r.run_id
+            JOIN compositions c ON c.id = r.comp_id
+            """)
+    c.execute("""CREATE VIEW history_rows AS
+            SELECT h.id AS id, h.date AS date, h.data AS data,
+                p.params AS params, h.finished AS finished
+            FROM history h
+            LEFT JOIN param_sets p ON p.id = h.params_id
+            """)
+
+
+def _migration_3(c):
+    """Normalized layout - compositions and parameter sets are stored once,
+    results rows only keep run, peak, measured mass and composition id"""
+    for name in ("results_run_id", "results_peak", "results_measured",
+                 "results_comp_s", "history_date"):
+        c.execute(f"DROP INDEX IF EXISTS {name}")
+    c.execute("ALTER TABLE results RENAME TO results_v2")
+    c.execute("ALTER TABLE history RENAME TO history_v2")
+    _create_normalized_tables(c)
+    param_ids = {}
+    for run_id, date, data, params, finished in c.connection.execute(
+            "SELECT id, date, data, params, finished FROM history_v2"):
+        try:
+            params = json.loads(params)
+        except (TypeError, ValueError):
+            params = None
+        params_id = None
+        if isinstance(params, dict):
+            key = form_params_key(params)
+            if key not in param_ids:
+                param_ids[key] = c.execute(
+                    "INSERT INTO param_sets (key, params) VALUES (?, ?)",
+                    (key, json.dumps(_without_masses(params)))).lastrowid
+            params_id = param_ids[key]
+        c.execute("INSERT INTO history VALUES (?, ?, ?, ?, ?)",
+                  (run_id, date, data, params_id, finished))
+    c.execute("CREATE TEMP TABLE run_map (old_id INTEGER PRIMARY KEY, new_id INTEGER)")
+    c.executemany("INSERT INTO run_map VALUES (?, ?)", _map_legacy_runs(c))
+    c.execute("""INSERT INTO compositions
+            (comp_l, comp_s, tag, tag_mass, theorMH, theorMHTag)
+            SELECT comp_l, MIN(comp_s), tag, tag_mass, theorMH, theorMHTag
+            FROM results_v2
+            GROUP BY comp_l, tag, tag_mass, theorMH, theorMHTag""")
+    c.execute("""INSERT INTO results (run_id, peak, measured, comp_id)
+            SELECT m.new_id, r.peak, r.measured, c.id
+            FROM results_v2 r JOIN compositions c
+            ON c.comp_l IS r.comp_l AND c.tag IS r.tag
+                AND c.tag_mass IS r.tag_mass AND c.theorMH IS r.theorMH
+                AND c.theorMHTag IS r.theorMHTag
+            LEFT JOIN run_map m ON m.old_id = r.run_id
+            ORDER BY r.rowid""")
+    c.execute("DROP TABLE run_map")
+    c.execute("DROP TABLE results_v2")
+    c.execute("DROP TABLE history_v2")
+
+
+def _map_legacy_runs(c) -> list:
+    """Returns [(results.run_id, history.id),...] for results stored before
+    migration 3. Their run ids were numbered independently of history
+    (MAX(run_id) + 1), each written right after the history row of its run:
+    runs are matched in order to the latest history row dated before their
+    results, runs without one get a new history row."""
+    history = c.execute(
+        "SELECT id, date FROM history WHERE date IS NOT NULL ORDER BY id"
+    ).fetchall()
+    runs = c.execute("""SELECT run_id, MIN(date) FROM results_v2
+            WHERE run_id IS NOT NULL GROUP BY run_id ORDER BY run_id""")
+    run_map = []
+    pos = 0
+    for run_id, date in runs.fetchall():
+        match = None
+        while (date is not None and pos < len(history)
+               and history[pos][1] <= date):
+            match = history[pos][0]
+            pos += 1
+        if match is None:
+            match = c.execute(
+                """INSERT INTO history (date, data, params_id, finished)
+                VALUES (?, '{}', NULL, 1)""", (date, )).lastrowid
+        run_map.append((run_id, match))
+    return run_map
+
+
+def _migration_4(c):
+    """Spectra opened by the user with their m/z and intensity arrays
+    and picked peaks as raw little-endian float BLOBs"""
+    c.execute("""CREATE TABLE spectra (
+            id INTEGER PRIMARY KEY,
+            path TEXT,
+            ret_time REAL,
+            peak_num INTEGER,
+            scan_type TEXT,
+            opened TEXT,
+            compression TEXT,
+            mz_dtype TEXT,
+            mz BLOB,
+            int_dtype TEXT,
+            intensity BLOB,
+            picked BLOB,
+            UNIQUE(path, ret_time))
+            """)
+
+
+# days since 1970-01-01 - R*Tree stores 32-bit floats, julianday() values
+# would be rounded to 0.25 day, unix days to a few minutes
+_RTREE_DAY = "julianday({}) - 2440587.5"
+
+
+# results_rtree rows of results - boxes are padded by _RTREE_PAD (Da, days),
+# zero-volume boxes all tie in R*Tree's least-enlargement choice of node
+# and leaves end up spanning whole mass range. Boxes are also rounded
+# outwards to 32-bit floats, candidates are checked against results columns
+_RTREE_PAD = 0.005
+_RTREE_ROWS = f"""SELECT r.id,
+            r.measured - {_RTREE_PAD}, r.measured + {_RTREE_PAD},
+            IFNULL(c.theorMH, 0.0) - {_RTREE_PAD},
+            IFNULL(c.theorMH, 0.0) + {_RTREE_PAD},
+            IFNULL({_RTREE_DAY.format("h.date")}, 0.0) - {_RTREE_PAD},
+            IFNULL({_RTREE_DAY.format("h.date")}, 0.0) + {_RTREE_PAD}
+        FROM results r
+        LEFT JOIN compositions c ON c.id = r.comp_id
+        LEFT JOIN history h ON h.id = r.run_id"""
+
+
+def _migration_5(c):
+    """R*Tree over results (measured, theorMH, date of run) for cross-run
+    mass and date range searches, filled by DB._insert_results
+    (set-based, per-row insert trigger made inserts 4x slower)"""
+    c.execute("""CREATE VIRTUAL TABLE results_rtree USING rtree(
+            id,
+            min_measured, max_measured,
+            min_theor, max_theor,
+            min_day, max_day)
+            """)
+    c.execute(f"INSERT INTO results_rtree {_RTREE_ROWS}")
+    c.execute("""CREATE TRIGGER results_rtree_delete AFTER DELETE ON results
+            BEGIN
+                DELETE FROM results_rtree WHERE id = OLD.id;
+            END""")
+
+
+def _migration_6(c):
+    """Glycomod deltas of results and report header of parameter sets,
+    so results of earlier runs can be reused (DB.lookup_records)"""
+    c.execute("ALTER TABLE results ADD COLUMN delta REAL")
+    c.execute("ALTER TABLE param_sets ADD COLUMN header TEXT")
+
+
+def _migration_7(c):
+    """Adduct explaining each result - multi adduct runs store a row
+    for every adduct of a peak, shown in result_rows.
+    Adducts are stored once in adducts, results.adduct_mass is the [M+H]+
+    equivalent of the measured mass submitted to Glycomod for the adduct"""
+    c.execute("""CREATE TABLE adducts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            mass REAL NOT NULL,
+            UNIQUE(name, mass))
+            """)
+    c.execute("ALTER TABLE results ADD COLUMN adduct_id INTEGER "
+              "REFERENCES adducts(id)")
+    c.execute("ALTER TABLE results ADD COLUMN adduct_mass REAL")
+    c.execute("CREATE INDEX results_adduct_mass ON results (adduct_mass)")
+    c.execute("DROP VIEW result_rows")
+    c.execute("""CREATE VIEW result_rows AS
+            SELECT r.id AS id, h.date AS date, r.run_id AS run_id,
+                r.peak AS peak, r.measured AS measured,
+                c.theorMH AS theorMH, c.theorMHTag AS theorMHTag,
+                c.comp_l AS comp_l, c.comp_s AS comp_s,
+                c.tag AS tag, c.tag_mass AS tag_mass,
+                a.name AS adduct, r.adduct_mass AS adduct_mass
+            FROM results r
+            LEFT JOIN history h ON h.id = r.run_id
+            JOIN compositions c ON c.id = r.comp_id
+            LEFT JOIN adducts a ON a.id = r.adduct_id
+            """)
+
+
+# MIGRATIONS[n] upgrades schema from PRAGMA user_version n to n + 1
+MIGRATIONS = [
+    _migration_1, _migration_2, _migration_3, _migration_4, _migration_5,
+    _migration_6, _migration_7
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(db_conn) -> int:
+    return db_conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_conn):
+    """Applies pending MIGRATIONS, each in its own transaction,
+    databases created before versioning (user_version 0) are upgraded in place"""
+    version = schema_version(db_conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than supported {SCHEMA_VERSION}"
+        )
+    db_conn.commit()
+    for n in range(version, SCHEMA_VERSION):
+        with db_conn as conn:
+            # explicit BEGIN - sqlite3 would autocommit DDL statements
+            conn.execute("BEGIN")
+            MIGRATIONS[n](conn.cursor())
+            # PRAGMA does not take parameters
+            conn.execute(f"PRAGMA user_version = {n + 1}")
+
+
+def _without_masses(params) -> dict:
+    return {k: v for k, v in params.items() if k != "Masses"}
+
+
+def _default_residues() -> list:
+    """Returns config.json/"residues", order of compositions.counts"""
+    with open(
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "config.json"),
+            "r") as cc:
+        return json.load(cc)["residues"]
+
+
+def pack_array(arr, compress=False):
+    """Returns (BLOB, dtype string) of float array as raw little-endian values,
+    zlib compressed if compress"""
+    arr = np.ascontiguousarray(arr)
+    dtype = arr.dtype if arr.dtype.kind == "f" else np.dtype(np.float64)
+    arr = arr.astype(dtype.newbyteorder("<"), copy=False)
+    data = arr.tobytes()
+    if compress:
+        data = zlib.compress(data, 1)
+    return data, arr.dtype.str
+
+
+def unpack_array(blob, dtype, compression=None) -> np.ndarray:
+    """Returns array over BLOB made by pack_array
+    - uncompressed BLOBs are not copied, the array is read-only"""
+    dtype = np.dtype(dtype)
+    if dtype.kind != "f":
+        raise ValueError(f"Stored array has non-float dtype [{dtype}]")
+    if compression == "zlib":
+        blob = zlib.decompress(blob)
+    elif compression is not None:
+        raise ValueError(f"Unknown compression [{compression}]")
+    return np.frombuffer(blob, dtype=dtype)
 
 
 def setup_db(path):
@@ -43,64 +363,443 @@ def setup_db(path):
     return conn
 
 
+# bulk write mode - WAL lets readers work during long writes, synchronous=NORMAL
+# syncs on checkpoints instead of every commit (safe with WAL), 64 MB page cache
+BULK_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -65536),
+    ("temp_store", "MEMORY"),
+)
+
+
+def set_bulk_mode(db_conn):
+    for name, value in BULK_PRAGMAS:
+        db_conn.execute(f"PRAGMA {name} = {value}")
+
+
+_memory_dbs = itertools.count()
+
+RESULT_COLUMNS = ("id", "date", "run_id", "peak", "measured", "theorMH",
+                  "theorMHTag", "comp_l", "comp_s", "tag", "tag_mass",
+                  "adduct", "adduct_mass")
+HISTORY_COLUMNS = ("id", "date", "data", "params", "finished")
+SPECTRUM_COLUMNS = ("ret_time", "peak_num", "scan_type", "compression",
+                    "mz_dtype", "mz", "int_dtype", "intensity", "picked")
+
+
+def _date(value) -> str:
+    """Returns ISO date string as stored in history.date"""
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _result_filters(run_id=None,
+                    peak=None,
+                    start=None,
+                    end=None,
+                    composition=None,
+                    min_mass=None,
+                    max_mass=None):
+    """Returns (WHERE conditions, params) of results query filters"""
+    conditions, params = [], []
+    if run_id is not None:
+        conditions.append("run_id = ?")
+        params.append(run_id)
+    if peak is not None:
+        conditions.append("peak = ?")
+        params.append(peak)
+    if start is not None or end is not None:
+        # runs by date go through history(date) index, results through run_id
+        dates, date_params = _history_filters(start, end)
+        conditions.append(
+            f"run_id IN (SELECT id FROM history WHERE {' AND '.join(dates)})")
+        params.extend(date_params)
+    if composition is not None:
+        # long notation "(Hex)5 (HexNAc)4", short notation "H5N4"
+        column = "comp_l" if "(" in composition else "comp_s"
+        conditions.append(
+            f"comp_id IN (SELECT id FROM compositions WHERE {column} = ?)")
+        params.append(composition)
+    if min_mass is not None:
+        conditions.append("measured >= ?")
+        params.append(min_mass)
+    if max_mass is not None:
+        conditions.append("measured <= ?")
+        params.append(max_mass)
+    return conditions, params
+
+
+def _history_filters(start=None, end=None):
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("date >= ?")
+        params.append(_date(start))
+    if end is not None:
+        conditions.append("date <= ?")
+        params.append(_date(end))
+    return conditions, params
+
+
 # TODO: output results as csv
 class DB:
-    def __init__(self, path):
-        self.conn = sqlite3.connect(path)
+    """DB wraps the app's SQLite store.
 
-    def __del__(self):
-        self.conn.close()
+    Every thread gets its own connection, opened on first use of DB.conn,
+    so the GUI can keep reading while a background search writes results.
+    File databases are switched to journal_mode=WAL: readers do not block
+    the writer and the writer does not block readers, concurrent writers
+    wait up to timeout seconds for each other.
+    ":memory:" databases are shared by all threads' connections through
+    SQLite shared cache (meant for tests, concurrent access may raise
+    "database table is locked").
+
+    Results are stored normalized (schema migration 3): every distinct hit
+    is stored once in compositions, form parameters once per parameter set
+    in param_sets and results rows only reference them. Views result_rows
+    and history_rows give the flat columns, RESULT_COLUMNS/HISTORY_COLUMNS.
+    R*Tree results_rtree (schema migration 5) indexes results by measured
+    mass, theoretical mass and date of run for DB.find_results.
+
+    param::bulk use BULK_PRAGMAS for high-throughput writes
+    param::timeout seconds a write waits for another thread's transaction
+    param::residues order of compositions.counts (uint8 per residue),
+        defaults to config.json/"residues"
+    """
+
+    def __init__(self, path, bulk=False, timeout=30.0, residues=None):
+        self.path = path
+        self.bulk = bulk
+        self.timeout = timeout
+        self.residues = residues if residues is not None else _default_residues(
+        )
+        self._uri = path == ":memory:"
+        if self._uri:
+            self.path = f"file:db{next(_memory_dbs)}?mode=memory&cache=shared"
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+        # connection of the creating thread also keeps in-memory database alive
+        conn = self.conn
+        if not self._uri:
+            conn.execute("PRAGMA journal_mode = WAL")
+        setup_db_tables(conn)
+        self._fill_counts()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Returns connection of the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections are never shared between threads,
+        # check_same_thread=False only lets close() close all of them
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            uri=self._uri,
+            check_same_thread=False)
+        if self.bulk:
+            set_bulk_mode(conn)
+        with self._lock:
+            self._conns.append(conn)
+        return conn
+
+    def close_thread(self):
+        """Closes connection of the calling thread,
+        background threads should call it before they finish"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                self._conns.remove(conn)
+            conn.close()
+
+    def optimize(self):
+        """Refreshes query planner statistics (sampled ANALYZE),
+        lets planner pick the most selective index for combined filters"""
+        with self.conn as conn:
+            conn.execute("PRAGMA analysis_limit = 1000")
+            conn.execute("ANALYZE")
 
     def close(self):
-        self.__del__()
+        """Closes connections of all threads"""
+        with self._lock:
+            conns, self._conns = self._conns, []
+        self._local = threading.local()
+        for conn in conns:
+            conn.close()
+
+    def __del__(self):
+        if hasattr(self, "_conns"):
+            self.close()
 
     def _get_last_result_id(self) -> int:
         with self.conn as conn:
-            # if table is empty fetchone() returns (None, )
+            # if table is empty fetchone() returns (None, ), indexed - no scan
             res_id = conn.execute("SELECT MAX(run_id) FROM results").fetchone()
         if res_id[0] is not None:
             return res_id[0]
         return 0
 
+    @property
+    def _comp_ids(self) -> dict:
+        """{(comp_l, tag, tag_mass, theorMH, theorMHTag): compositions.id}
+        per thread - ids are valid only once their transaction commits"""
+        comp_ids = getattr(self._local, "comp_ids", None)
+        if comp_ids is None:
+            comp_ids = self._local.comp_ids = {}
+        return comp_ids
+
+    def _counts(self, comp_l):
+        """Returns composition counts as uint8 BLOB, None if not a composition"""
+        try:
+            return bytes(composition_counts(comp_l, self.residues))
+        except ValueError:
+            # NOT FOUND, unknown residues, more than 255 residues
+            return None
+
+    def _fill_counts(self):
+        """Fills missing counts, e.g. of compositions migrated from flat results"""
+        with self.conn as conn:
+            missing = conn.execute(
+                "SELECT id, comp_l FROM compositions WHERE counts IS NULL"
+            ).fetchall()
+            conn.executemany(
+                "UPDATE compositions SET counts = ? WHERE id = ?",
+                [(counts, comp_id) for comp_id, counts in (
+                    (comp_id, self._counts(comp_l))
+                    for comp_id, comp_l in missing) if counts is not None])
+
+    @staticmethod
+    def _param_set_id(conn, params):
+        if not isinstance(params, dict):
+            return None
+        key = form_params_key(params)
+        # select after insert - another thread's connection may have
+        # inserted the same parameter set since
+        conn.execute(
+            "INSERT OR IGNORE INTO param_sets (key, params) VALUES (?, ?)",
+            (key, json.dumps(_without_masses(params))))
+        return conn.execute("SELECT id FROM param_sets WHERE key = ?",
+                            (key, )).fetchone()[0]
+
+    @staticmethod
+    def _insert_hist(conn, time, data, params, is_finished) -> int:
+        # None needs to be passed for sqlite autoincrement to work
+        values_tuple = (None, time, json.dumps(data),
+                        DB._param_set_id(conn, params), is_finished)
+        return conn.execute("INSERT INTO history values (?, ?, ?, ?, ?)",
+                            values_tuple).lastrowid
+
+    def _composition_id(self, conn, theor_mh, theor_mh_tag, comp_l, comp_s,
+                        tag, tag_mass) -> int:
+        key = (comp_l, tag, tag_mass, theor_mh, theor_mh_tag)
+        comp_id = self._comp_ids.get(key)
+        if comp_id is None:
+            select = """SELECT id FROM compositions WHERE comp_l IS ? AND tag IS ?
+                AND tag_mass IS ? AND theorMH IS ? AND theorMHTag IS ?"""
+            row = conn.execute(select, key).fetchone()
+            if row is None:
+                # ignored if another thread's connection inserted it since,
+                # UNIQUE does not cover rows with NULLs - those are inserted
+                conn.execute(
+                    """INSERT OR IGNORE INTO compositions (comp_l, comp_s,
+                    counts, tag, tag_mass, theorMH, theorMHTag)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (comp_l, comp_s, self._counts(comp_l), tag, tag_mass,
+                     theor_mh, theor_mh_tag))
+                row = conn.execute(select, key).fetchone()
+            comp_id = row[0]
+            self._comp_ids[key] = comp_id
+        return comp_id
+
+    @staticmethod
+    def _adduct_id(conn, name, mass):
+        if name is None:
+            return None
+        conn.execute("INSERT OR IGNORE INTO adducts (name, mass) VALUES (?, ?)",
+                     (name, mass))
+        return conn.execute(
+            "SELECT id FROM adducts WHERE name = ? AND mass = ?",
+            (name, mass)).fetchone()[0]
+
+    def _insert_results(self, conn, run_id, results):
+        """param::results rows as GlycomodWorker._prepare_results:
+        (peak, measured, theorMH, theorMHTag, comp_l, comp_s, tag, tag_mass)
+        optionally followed by Glycomod delta, adduct, adduct mass
+        and the [M+H]+ submitted for measured"""
+        last_id = conn.execute("SELECT MAX(id) FROM results").fetchone()[0]
+        adduct_ids = {}
+
+        def values(row):
+            delta, adduct, adduct_mass, submitted = (
+                tuple(row[8:]) + (None, ) * 4)[:4]
+            if (adduct, adduct_mass) not in adduct_ids:
+                adduct_ids[adduct, adduct_mass] = self._adduct_id(
+                    conn, adduct, adduct_mass)
+            return (run_id, row[0], row[1],
+                    self._composition_id(conn, *row[2:8]), delta,
+                    adduct_ids[adduct, adduct_mass], submitted)
+
+        conn.executemany(
+            """INSERT INTO results (run_id, peak, measured, comp_id, delta,
+            adduct_id, adduct_mass) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (values(row) for row in results))
+        conn.execute(f"INSERT INTO results_rtree {_RTREE_ROWS} WHERE r.id > ?",
+                     (last_id or 0, ))
+
+    def _rollback_comp_ids(self):
+        # compositions inserted by the failed transaction are gone
+        self._comp_ids.clear()
+
     def insert_hist(self, data, params, is_finished):
+        """Inserts history row, returns its id (None on failure)"""
         # TODO LOGGING
         time = datetime.datetime.now().isoformat()
-        data_json = json.dumps(data)
-        params_json = json.dumps(params)
-        # None needs to be passed for sqlite autoincrement to work
-        values_tuple = (None, time, data_json, params_json, is_finished)
         try:
             with self.conn as conn:
-                conn.execute("INSERT INTO history values (?, ?, ?, ?, ?)",
-                             values_tuple)
+                return self._insert_hist(conn, time, data, params,
+                                         is_finished)
         except Exception as e:
             print(f"FAILED INSERTING HIST WITH ERR: {e}")
 
-    @staticmethod
-    def _prepare_result_entry(time, id, result):
-        return (time, id, *result)
+    def insert_result(self, results, run_id=None) -> bool:
+        """Inserts results of run_id, defaults to the latest history row
+        returns False on failure (nothing is inserted)"""
+        try:
+            with self.conn as conn:
+                if run_id is None:
+                    # primary key lookup
+                    run_id = conn.execute(
+                        "SELECT MAX(id) FROM history").fetchone()[0]
+                self._insert_results(conn, run_id, results)
+            return True
+        except Exception as e:
+            self._rollback_comp_ids()
+            print("FAILED INSERTING RESULTS", e)
+            return False
 
-    def insert_result(self, results):
+    def insert_run(self, data, params, results, is_finished=1, header=None):
+        """Inserts history row and its results in one transaction
+        results rows get run_id = history.id of the run
+        param::header Glycomod report header lines of params
+            (GlycomodRecord.header), stored once per parameter set
+        returns run_id (None on failure, nothing is inserted)"""
         time = datetime.datetime.now().isoformat()
-        last_res_id = self._get_last_result_id()
-        current_res_id = last_res_id + 1
-        prepared_results = [
-            self._prepare_result_entry(time, current_res_id, i)
-            for i in results
-        ]
         try:
             with self.conn as conn:
-                conn.executemany(
-                    "INSERT INTO results values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    prepared_results)
+                run_id = self._insert_hist(conn, time, data, params,
+                                           is_finished)
+                self._insert_results(conn, run_id, results)
+                if header is not None and isinstance(params, dict):
+                    conn.execute(
+                        "UPDATE param_sets SET header = ? WHERE key = ?",
+                        (json.dumps(list(header)), form_params_key(params)))
+            return run_id
         except Exception as e:
-            print("FAILED INSERTING RESULTS", e)
+            self._rollback_comp_ids()
+            print("FAILED INSERTING RUN", e)
 
-    def insert_single_mass_into_curr(self, peak, mass):
+    def finish_run(self, run_id, header=None):
+        """Marks run inserted with is_finished=0 (insert_hist, results added
+        chunk by chunk with insert_result) as finished
+        param::header as in insert_run, stored for the run's parameter set"""
         try:
             with self.conn as conn:
-                c = conn.cursor()
-                c.execute("INSERT INTO curr_ephem values (?, ?)", peak, mass)
+                conn.execute("UPDATE history SET finished = 1 WHERE id = ?",
+                             (run_id, ))
+                if header is not None:
+                    conn.execute(
+                        """UPDATE param_sets SET header = ? WHERE id =
+                        (SELECT params_id FROM history WHERE id = ?)""",
+                        (json.dumps(list(header)), run_id))
+        except Exception as e:
+            print("FAILED FINISHING RUN", e)
+
+    def insert_runs(self, runs) -> list:
+        """Bulk loader, inserts many runs in one transaction
+        param::runs iterable of (data, params, results), results may be generators
+        returns run_ids (empty on failure, nothing is inserted)"""
+        time = datetime.datetime.now().isoformat()
+        run_ids = []
+        try:
+            with self.conn as conn:
+                for data, params, results in runs:
+                    run_id = self._insert_hist(conn, time, data, params, 1)
+                    self._insert_results(conn, run_id, results)
+                    run_ids.append(run_id)
+            self.optimize()
+            return run_ids
+        except Exception as e:
+            self._rollback_comp_ids()
+            print("FAILED INSERTING RUNS", e)
+            return []
+
+    def lookup_records(self, params, masses) -> dict:
+        """Returns {index: GlycomodRecord} of masses already searched
+        with the same form parameters (masses excluded) in a finished run,
+        rebuilt from results of the latest such run.
+        Results stored without Glycomod deltas (before schema migration 6)
+        are not reused.
+        param::params Glycomod form fields
+        param::masses submitted masses as floats
+            ### EXAMPLE ###
+            >>>db.lookup_records(gw.form_fields, [911.3, 1454.0])
+            >>>{0: GlycomodRecord(user_mass=911.3, header=(...),
+            >>>     hits=(GlycomodHit(892.317, -0.034, '(Hex)3 (HexNAc)2', (3, 2, ...)),))}
+        """
+        row = self.conn.execute(
+            "SELECT id, header FROM param_sets WHERE key = ?",
+            (form_params_key(params), )).fetchone()
+        if row is None:
+            return {}
+        params_id, header = row[0], tuple(json.loads(row[1] or "[]"))
+        served, stored = {}, {}
+        for index, mass in enumerate(masses):
+            if mass not in stored:
+                stored[mass] = self._stored_record(params_id, header, mass)
+            if stored[mass] is not None:
+                served[index] = stored[mass]
+        return served
+
+    def _stored_record(self, params_id, header, mass):
+        """Returns GlycomodRecord of mass from the latest finished run
+        with params_id, None if not stored"""
+        window = (mass - 1e-6, mass + 1e-6)
+        # searched as adduct_mass (measured if stored before migration 7)
+        submitted = """(r.adduct_mass BETWEEN ? AND ?
+            OR r.adduct_mass IS NULL AND r.measured BETWEEN ? AND ?)"""
+        peak = self.conn.execute(
+            f"""SELECT r.run_id, r.peak FROM results r
+            JOIN history h ON h.id = r.run_id
+            WHERE {submitted} AND h.params_id = ? AND h.finished = 1
+            ORDER BY r.run_id DESC, r.peak LIMIT 1""",
+            (*window, *window, params_id)).fetchone()
+        if peak is None:
+            return None
+        rows = self.conn.execute(
+            f"""SELECT r.delta, c.theorMH, c.comp_l, c.counts FROM results r
+            JOIN compositions c ON c.id = r.comp_id
+            WHERE r.run_id = ? AND r.peak = ? AND {submitted}
+            ORDER BY r.id""", (*peak, *window, *window)).fetchall()
+        if any(i[0] is None for i in rows):
+            return None
+        return GlycomodRecord(
+            mass, header,
+            tuple(
+                GlycomodHit(theor, delta, comp_l, tuple(counts or ()))
+                for delta, theor, comp_l, counts in rows
+                if comp_l != "NOT FOUND"))
+
+    def insert_single_mass_into_curr(self, peak, mass, charge=1):
+        try:
+            with self.conn as conn:
+                conn.execute("INSERT INTO curr_ephem values (?, ?, ?)",
+                             (peak, mass, charge))
         except Exception as err:
             print("Error inserting single mass into db:", err)
 
@@ -114,6 +813,27 @@ class DB:
         except Exception as err:
             print("Error inserting multiple masses into db:", err)
 
+    def write_current_masses(self, inserts=(), deletes=(), clear=False):
+        """Applies batch of curr_ephem changes in one transaction:
+        clear, then deletes (one matching row each), then inserts
+        param::inserts, deletes [(peak, mass, charge)...]
+        returns False on failure (nothing is written)"""
+        try:
+            with self.conn as conn:
+                if clear:
+                    conn.execute("DELETE FROM curr_ephem")
+                conn.executemany(
+                    """DELETE FROM curr_ephem WHERE rowid = (
+                    SELECT rowid FROM curr_ephem
+                    WHERE peak = ? AND mass = ? AND charge = ? LIMIT 1)""",
+                    deletes)
+                conn.executemany("INSERT INTO curr_ephem values (?, ?, ?)",
+                                 inserts)
+            return True
+        except Exception as err:
+            print("Error writing masses into db:", err)
+            return False
+
     def read_current_masses(self):
         current_masses = []
         try:
@@ -126,6 +846,15 @@ class DB:
             return current_masses
         return current_masses
 
+    def iter_current_masses(self, batch_size=1000):
+        """Yields (peak, mass, charge) rows of curr_ephem without fetching all"""
+        cursor = self.conn.execute("SELECT * FROM curr_ephem")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+
     def clear_current_masses(self):
         try:
             with self.conn as conn:
@@ -133,18 +862,329 @@ class DB:
         except Exception as e:
             print("FAILED CLEANING CURRENT MASSES", e)
 
-    def read_result(self):
-        # read in results:
-        # all, clicked run, select multiple runs
-        pass
+    def store_spectrum(self,
+                       path,
+                       ret_time,
+                       mz,
+                       intensity,
+                       scan_type="",
+                       peak_num=None,
+                       compress=False):
+        """Stores spectrum opened from path at ret_time,
+        reopening it later does not need the original file
+        returns spectrum id (None on failure)"""
+        time = datetime.datetime.now().isoformat()
+        compression = "zlib" if compress else None
+        mz_blob, mz_dtype = pack_array(mz, compress)
+        int_blob, int_dtype = pack_array(intensity, compress)
+        try:
+            with self.conn as conn:
+                conn.execute(
+                    """INSERT INTO spectra (path, ret_time, peak_num, scan_type,
+                    opened, compression, mz_dtype, mz, int_dtype, intensity)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(path, ret_time) DO UPDATE SET
+                    peak_num = excluded.peak_num, scan_type = excluded.scan_type,
+                    opened = excluded.opened, compression = excluded.compression,
+                    mz_dtype = excluded.mz_dtype, mz = excluded.mz,
+                    int_dtype = excluded.int_dtype, intensity = excluded.intensity""",
+                    (path, ret_time, peak_num, scan_type, time, compression,
+                     mz_dtype, mz_blob, int_dtype, int_blob))
+                return conn.execute(
+                    "SELECT id FROM spectra WHERE path = ? AND ret_time = ?",
+                    (path, ret_time)).fetchone()[0]
+        except Exception as e:
+            print("FAILED STORING SPECTRUM", e)
+
+    def store_picked_peaks(self, path, ret_time, peak_num, peaks):
+        """Stores peaks picked in stored spectrum
+        param::peaks [(peak_num, mz, charge),...] as ScanWindow.selectedPeaks"""
+        picked = np.array([(i[1], i[2]) for i in peaks],
+                          dtype="<f8").reshape(-1, 2)
+        try:
+            with self.conn as conn:
+                conn.execute(
+                    """UPDATE spectra SET picked = ?, peak_num = ?
+                    WHERE path = ? AND ret_time = ?""",
+                    (picked.tobytes(), peak_num, path, ret_time))
+        except Exception as e:
+            print("FAILED STORING PICKED PEAKS", e)
 
-    def read_history(self):
-        pass
-        # read in all history - make clickable
+    @staticmethod
+    def _stored_spectrum(row) -> StoredSpectrum:
+        (ret_time, peak_num, scan_type, compression, mz_dtype, mz, int_dtype,
+         intensity, picked) = row
+        return StoredSpectrum(
+            ret_time=ret_time,
+            peak_num=peak_num,
+            scan_type=scan_type,
+            mz=unpack_array(mz, mz_dtype, compression),
+            intensity=unpack_array(intensity, int_dtype, compression),
+            picked=unpack_array(picked or b"", "<f8").reshape(-1, 2))
 
-    def output_csv(self, table, id=None, start=None, end=None):
-        # output to csv from table, id=col_name, start, end = row_id start, row_id end
-        pass
+    def load_spectrum(self, path, ret_time):
+        """Returns StoredSpectrum of path at ret_time, None if not stored"""
+        row = self.conn.execute(
+            f"SELECT {', '.join(SPECTRUM_COLUMNS)} FROM spectra "
+            "WHERE path = ? AND ret_time = ?", (path, ret_time)).fetchone()
+        return self._stored_spectrum(row) if row is not None else None
 
-    def output_text(self, table, id=None, start=None, end=None):
-        pass
+    def iter_session(self, path):
+        """Yields StoredSpectrum of every spectrum opened from path,
+        in the order they were opened"""
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(SPECTRUM_COLUMNS)} FROM spectra "
+            "WHERE path = ? ORDER BY opened, id", (path, ))
+        for row in cursor:
+            yield self._stored_spectrum(row)
+
+    def read_sessions(self) -> list:
+        """Returns [(path, number of spectra, last opened),...] newest first"""
+        return self.conn.execute(
+            """SELECT path, COUNT(*), MAX(opened) FROM spectra
+            GROUP BY path ORDER BY MAX(opened) DESC""").fetchall()
+
+    def _page(self,
+              table,
+              view,
+              columns,
+              conditions,
+              params,
+              after,
+              limit,
+              key_index=True):
+        """Keyset pagination - rows with id > after in id order,
+        every page is an index range scan no matter how deep it is.
+        Page ids are selected from table, rows are read from its view.
+        param::key_index False keeps planner from walking id index
+            (unary +) when a range condition is more selective"""
+        key_condition = "id > ?" if key_index else "+id > ?"
+        where = " AND ".join(conditions + [key_condition])
+        return self.conn.execute(
+            f"SELECT {', '.join(columns)} FROM {view} WHERE id IN "
+            f"(SELECT id FROM {table} WHERE {where} ORDER BY id LIMIT ?) "
+            f"ORDER BY id", (*params, after, limit)).fetchall()
+
+    def read_result(self, after=0, limit=100, **filters) -> list:
+        """Returns page of at most limit results rows (RESULT_COLUMNS tuples)
+        param::after id of the last row of the previous page, 0 for first page
+        param::filters run_id, peak, start, end (dates of runs), composition
+            (short or long notation), min_mass, max_mass (measured)
+            ### EXAMPLE ###
+            >>>page = db.read_result(run_id=3, limit=2)
+            >>>[(41, '2019-...', 3, 1, 911.3, 892.317, 893.324, '(Hex)3 (HexNAc)2', 'H3N2', '', 0.0, 'H+', 1.00727),
+            >>> (42, '2019-...', 3, 2, 1057.33, 1038.375, 1039.382, ...)]
+            >>>next_page = db.read_result(after=page[-1][0], run_id=3, limit=2)
+        """
+        conditions, params = _result_filters(**filters)
+        # narrow mass windows are cheaper through results(measured) index
+        by_mass = filters.get("min_mass") is not None or filters.get(
+            "max_mass") is not None
+        return self._page("results", "result_rows", RESULT_COLUMNS,
+                          conditions, params, after, limit, not by_mass)
+
+    def iter_results(self, batch_size=1000, **filters):
+        """Yields all results rows matching filters (see read_result)
+        page by page, memory use is bounded by batch_size"""
+        after = 0
+        while True:
+            page = self.read_result(after, batch_size, **filters)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after = page[-1][0]
+
+    def find_results(self,
+                     min_mass=None,
+                     max_mass=None,
+                     min_theor=None,
+                     max_theor=None,
+                     start=None,
+                     end=None,
+                     composition=None,
+                     after=0,
+                     limit=None) -> list:
+        """Cross-run search through results_rtree, every given range narrows
+        the R*Tree lookup instead of scanning results.
+        Returns results rows (RESULT_COLUMNS tuples) in id order
+        param::min_mass, max_mass measured mass range
+        param::min_theor, max_theor theoretical [M+H] range
+        param::start, end date range of runs (datetime or ISO string)
+        param::composition short or long notation
+        param::after, limit keyset page as in read_result, all rows by default
+            ### EXAMPLE ###
+            >>>db.find_results(1438.3, 1438.7)
+            >>>[(812, '2019-...', 14, 3, 1438.52, 1438.518, ...), ...]
+            >>>db.find_results(composition="H5N4F1", start=month_ago)
+        """
+        boxes, box_params = [], []
+        for column, low, high, placeholder in (
+                ("measured", min_mass, max_mass, "?"),
+                ("theor", min_theor, max_theor, "?"),
+                ("day", _date(start), _date(end), _RTREE_DAY.format("?"))):
+            if low is not None:
+                boxes.append(f"t.max_{column} >= {placeholder}")
+                box_params.append(low)
+            if high is not None:
+                boxes.append(f"t.min_{column} <= {placeholder}")
+                box_params.append(high)
+        # exact checks of R*Tree candidates
+        conditions, params = _history_filters(start, end)
+        for column, low, high in (("measured", min_mass, max_mass),
+                                  ("theorMH", min_theor, max_theor)):
+            if low is not None:
+                conditions.append(f"{column} >= ?")
+                params.append(low)
+            if high is not None:
+                conditions.append(f"{column} <= ?")
+                params.append(high)
+        conditions = [f"r.{i}" for i in conditions]
+        if composition is not None:
+            column = "comp_l" if "(" in composition else "comp_s"
+            conditions.append(f"r.{column} = ?")
+            params.append(composition)
+        where = " AND ".join(boxes + conditions + ["t.id > ?"])
+        query = (f"SELECT {', '.join('r.' + i for i in RESULT_COLUMNS)} "
+                 f"FROM results_rtree t CROSS JOIN result_rows r ON r.id = t.id "
+                 f"WHERE {where} ORDER BY t.id")
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return self.conn.execute(query,
+                                 (*box_params, *params, after)).fetchall()
+
+    def runs_matching(self,
+                      mass,
+                      tolerance=0.2,
+                      theoretical=False,
+                      start=None,
+                      end=None) -> list:
+        """Returns [(run_id, date, number of hits),...] of runs with a hit
+        within mass ± tolerance, NOT FOUND rows are not hits
+        param::theoretical match theoretical [M+H] instead of measured mass
+            ### EXAMPLE ###
+            >>>db.runs_matching(1438.5, 0.2)
+            >>>[(14, '2019-...', 1), (52, '2019-...', 2)]
+        """
+        if theoretical:
+            masses = dict(min_theor=mass - tolerance,
+                          max_theor=mass + tolerance)
+        else:
+            # found compositions have theoretical mass
+            masses = dict(min_mass=mass - tolerance,
+                          max_mass=mass + tolerance,
+                          min_theor=1.0)
+        runs = {}
+        for row in self.find_results(start=start, end=end, **masses):
+            run = runs.setdefault(row[2], [row[2], row[1], 0])
+            run[2] += 1
+        return [tuple(i) for i in sorted(runs.values())]
+
+    def read_history(self, after=0, limit=100, start=None, end=None) -> list:
+        """Returns page of at most limit history rows (HISTORY_COLUMNS tuples)
+        param::after id of the last row of the previous page, 0 for first page
+        param::start, end date range (datetime or ISO string)"""
+        conditions, params = _history_filters(start, end)
+        return self._page("history", "history_rows", HISTORY_COLUMNS,
+                          conditions, params, after, limit)
+
+    def iter_history(self, batch_size=1000, start=None, end=None):
+        after = 0
+        while True:
+            page = self.read_history(after, batch_size, start, end)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after = page[-1][0]
+
+    @staticmethod
+    def _export_columns(table):
+        """Returns (exported view, columns, run id column) of table"""
+        if table == "results":
+            return "result_rows", RESULT_COLUMNS[1:], "run_id"
+        if table == "history":
+            return "history_rows", HISTORY_COLUMNS, "id"
+        raise ValueError(f"Unknown table [{table}]")
+
+    def _export_chunks(self, table, id=None, start=None, end=None,
+                       chunk_size=1000):
+        """Yields chunks of rows of "results" or "history" table
+        param::id run id - results.run_id or history.id
+        param::start, end id range (inclusive)"""
+        view, columns, id_column = self._export_columns(table)
+        conditions, params = [], []
+        if id is not None:
+            conditions.append(f"{id_column} = ?")
+            params.append(id)
+        if start is not None:
+            conditions.append("id >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("id <= ?")
+            params.append(end)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.conn.execute(
+            f"SELECT {', '.join(columns)} FROM {view}{where} ORDER BY id",
+            params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+
+    @staticmethod
+    def _open_output(path_or_file, **kwargs):
+        if hasattr(path_or_file, "write"):
+            return path_or_file, False
+        return open(path_or_file, "w", **kwargs), True
+
+    def output_csv(self, table, path_or_file, id=None, start=None, end=None,
+                   chunk_size=1000) -> int:
+        """Streams table rows (see _export_chunks) into csv file,
+        chunk_size rows are held in memory at a time
+        returns number of rows written"""
+        _, columns, _ = self._export_columns(table)
+        f, owned = self._open_output(path_or_file, newline="")
+        written = 0
+        try:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for rows in self._export_chunks(table, id, start, end,
+                                               chunk_size):
+                writer.writerows(rows)
+                written += len(rows)
+        finally:
+            if owned:
+                f.close()
+        return written
+
+    @staticmethod
+    def _text_lines(table, rows):
+        if table == "history":
+            for run_id, date, data, params, finished in rows:
+                yield f"Run {run_id}, {date}, finished: {finished}\n"
+                yield f"\tMasses: {data}\n"
+            return
+        for (date, run_id, peak, measured, theor_mh, theor_mh_tag, comp_l,
+             comp_s, tag, tag_mass, adduct, adduct_mass) in rows:
+            explained = f" as {adduct}" if adduct else ""
+            yield (f"Run {run_id}, peak {peak}, mass {measured}{explained}: "
+                   f"{comp_s} [{comp_l}], [MH]+: {theor_mh}, "
+                   f"[M+{tag or 'free'}+H]+: {theor_mh_tag}\n")
+
+    def output_text(self, table, path_or_file, id=None, start=None, end=None,
+                    chunk_size=1000) -> int:
+        """Streams table rows (see _export_chunks) into readable text file,
+        one line per result, two per history entry
+        returns number of rows written"""
+        self._export_columns(table)
+        f, owned = self._open_output(path_or_file)
+        written = 0
+        try:
+            for rows in self._export_chunks(table, id, start, end,
+                                               chunk_size):
+                f.writelines(self._text_lines(table, rows))
+                written += len(rows)
+        finally:
+            if owned:
+                f.close()
+        return written
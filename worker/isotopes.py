@@ -0,0 +1,202 @@
+# -*- coding: UTF-8 -*-
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .utils import CompositionRegistry
+from .utils import MassModel
+
+ELECTRON_MASS = 0.00054858
+
+# (isotope mass, natural abundance) - IUPAC representative values,
+# isotopes are placed at their nominal mass offset from the lightest one
+ISOTOPES = {
+    "H": ((1.00782503, 0.999885), (2.01410178, 0.000115)),
+    "C": ((12.0, 0.9893), (13.00335484, 0.0107)),
+    "N": ((14.00307401, 0.99636), (15.00010890, 0.00364)),
+    "O": ((15.99491462, 0.99757), (16.99913176, 0.00038),
+          (17.99915961, 0.00205)),
+    "Na": ((22.98976928, 1.0), ),
+    "P": ((30.97376163, 1.0), ),
+    "S": ((31.97207100, 0.9499), (32.97145876, 0.0075),
+          (33.96786690, 0.0425), (35.96708076, 0.0001)),
+    "K": ((38.96370649, 0.932581), (39.96399817, 0.000117),
+          (40.96182526, 0.067302)),
+}
+
+
+def _element_peaks(element, n_peaks):
+    """Returns (abundance, abundance * mass) arrays of a single atom
+    aggregated to nominal mass offsets 0..n_peaks-1"""
+    abundance = np.zeros(n_peaks)
+    moment = np.zeros(n_peaks)
+    lightest = ISOTOPES[element][0][0]
+    for mass, ab in ISOTOPES[element]:
+        offset = int(round(mass - lightest))
+        if offset < n_peaks:
+            abundance[offset] = ab
+            moment[offset] = ab * mass
+    return abundance, moment
+
+
+def _convolve(first, second, n_peaks):
+    """Convolves two aggregated distributions, keeping mass moments"""
+    ab = np.convolve(first[0], second[0])[:n_peaks]
+    moment = (np.convolve(first[1], second[0]) +
+              np.convolve(first[0], second[1]))[:n_peaks]
+    return ab, moment
+
+
+class IsotopeCalculator:
+    """IsotopeCalculator predicts aggregated isotope envelopes of glycan compositions
+    and ranks Glycomod candidates by how well their envelope fits an observed spectrum.
+
+    Element content of residues, reducing end tags and adducts is read from
+    config.json/"residue_elements", "reducing_end_tag_elements" and "adduct_elements".
+
+    Peaks of the same nominal mass are aggregated (fine isotopic structure is
+    summed into a single peak at its abundance weighted mass) which matches
+    the resolution of the spectra the tool works with.
+
+    Compositions may be given as dictionaries or count vectors in
+    config.json/"residues" order. Envelopes are memoized per count vector,
+    reducing end tag and adduct, element formula and element count, at most
+    maxsize entries each (least recently used are dropped), so repeated
+    candidates cost a cache lookup.
+    ### EXAMPLE ###
+        >>>calc = IsotopeCalculator(cfg)
+        >>>calc.distribution({"(Hex)": 3, "(HexNAc)": 2})
+        >>>(array([911.3356, 912.3387, ...]), array([0.6518, 0.2559, ...]))
+    """
+
+    def __init__(self, cfg, n_peaks=6, model=None, registry=None,
+                 maxsize=4096):
+        self.cfg = cfg
+        self.model = model if model is not None else MassModel(cfg)
+        # interns candidates of rank_compositions as count vectors
+        self.registry = registry if registry is not None else CompositionRegistry(
+            cfg, model=self.model)
+        self.n_peaks = n_peaks
+        # per instance LRU caches, (element, count): (abundance, moment),
+        # formula: (masses, abundances), (counts, tag, adduct): (masses, abundances)
+        self._element_power = lru_cache(maxsize=maxsize)(self._element_power)
+        self._formula = lru_cache(maxsize=maxsize)(self._formula)
+        self._distribution = lru_cache(maxsize=maxsize)(self._distribution)
+
+    def _element_power(self, element, count):
+        """Distribution of count atoms of element, built by repeated squaring"""
+        if count == 1:
+            return _element_peaks(element, self.n_peaks)
+        half = self._element_power(element, count // 2)
+        dist = _convolve(half, half, self.n_peaks)
+        if count % 2:
+            dist = _convolve(dist, self._element_power(element, 1),
+                             self.n_peaks)
+        return dist
+
+    def _counts(self, composition) -> Tuple[int, ...]:
+        """Returns count vector of composition (dictionary or count vector)"""
+        return tuple(int(i) for i in self.model.vector(composition))
+
+    def elements(self, composition, reducing_end=None,
+                 adduct="H+") -> Dict[str, int]:
+        """Returns element counts of the glycan (dictionary or count vector)
+        with free or tagged reducing end and the adduct ion"""
+        elements_count = dict(self.cfg["residue_elements"]["H2O"])
+        counts = list(self._counts(composition))
+        parts = [self.cfg["residue_elements"][key] for key in self.model.residues]
+        if reducing_end:
+            parts.append(self.cfg["reducing_end_tag_elements"][reducing_end])
+            counts.append(1)
+        if adduct:
+            parts.append(self.cfg["adduct_elements"][adduct])
+            counts.append(1)
+        for part, count in zip(parts, counts):
+            for element, n in part.items():
+                elements_count[element] = elements_count.get(element,
+                                                             0) + n * count
+        return elements_count
+
+    def formula_distribution(self, elements_count) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (masses, abundances) of the aggregated envelope of an element formula
+        - abundances are normalized to sum to 1 over the first n_peaks peaks"""
+        return self._formula(
+            tuple(sorted((k, v) for k, v in elements_count.items() if v)))
+
+    def _formula(self, formula):
+        dist = None
+        for element, count in formula:
+            power = self._element_power(element, count)
+            dist = power if dist is None else _convolve(
+                dist, power, self.n_peaks)
+        ab, moment = dist
+        masses = np.divide(moment, ab, out=np.zeros_like(moment), where=ab > 0)
+        return masses, ab / ab.sum()
+
+    def distribution(self, composition, reducing_end=None,
+                     adduct="H+") -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (masses, abundances) of the ion [M+adduct] of the glycan
+        (dictionary or count vector)"""
+        return self._distribution(self._counts(composition), reducing_end,
+                                  adduct)
+
+    def _distribution(self, counts, reducing_end, adduct):
+        masses, ab = self.formula_distribution(
+            self.elements(counts, reducing_end, adduct))
+        if adduct:
+            charge = self.model.charge(adduct)
+            masses = np.where(masses > 0, masses - charge * ELECTRON_MASS, 0.0)
+        return masses, ab
+
+    def envelopes(self, compositions, reducing_end=None,
+                  adduct="H+") -> Tuple[np.ndarray, np.ndarray]:
+        """Returns m/z and abundance matrices (candidates x n_peaks) of [M+adduct] ions"""
+        charge = self.model.charge(adduct) if adduct else 1
+        mz = np.zeros((len(compositions), self.n_peaks))
+        ab = np.zeros((len(compositions), self.n_peaks))
+        for row, composition in enumerate(compositions):
+            mz[row], ab[row] = self.distribution(composition, reducing_end,
+                                                 adduct)
+        return mz / charge, ab
+
+    def score(self, mz_arr, int_arr, compositions, reducing_end=None,
+              adduct="H+", tolerance=0.05) -> np.ndarray:
+        """Returns cosine similarity between predicted envelopes and the observed spectrum
+        - observed intensity of each isotope peak is summed within +/- tolerance (Th)
+          so both centroid and continuous spectra can be used
+        - candidates without any observed signal score 0.0"""
+        if not compositions:
+            return np.zeros(0)
+        mz_arr = np.asarray(mz_arr, dtype=float)
+        int_arr = np.asarray(int_arr, dtype=float)
+        order = np.argsort(mz_arr, kind="mergesort")
+        mz_sorted = mz_arr[order]
+        cumulative = np.concatenate(([0.0], np.cumsum(int_arr[order])))
+        pred_mz, pred_ab = self.envelopes(compositions, reducing_end, adduct)
+        lo = np.searchsorted(mz_sorted, pred_mz - tolerance, side="left")
+        hi = np.searchsorted(mz_sorted, pred_mz + tolerance, side="right")
+        observed = np.where(pred_ab > 0, cumulative[hi] - cumulative[lo], 0.0)
+        norms = np.linalg.norm(observed, axis=1) * np.linalg.norm(
+            pred_ab, axis=1)
+        dot = np.einsum("ij,ij->i", observed, pred_ab)
+        return np.divide(dot, norms, out=np.zeros_like(dot), where=norms > 0)
+
+    def rank_compositions(self, mz_arr, int_arr, compositions,
+                          reducing_end=None, adduct="H+",
+                          tolerance=0.05) -> List[Tuple[float, object]]:
+        """Ranks GlycomodComposition candidates by isotope pattern fit
+        - returns [(score, composition),...] best first, ties broken by |delta|
+        - NOT FOUND entries are ranked last with score 0.0"""
+        found = [i for i in compositions if i.long_notation != "NOT FOUND"]
+        not_found = [i for i in compositions if i.long_notation == "NOT FOUND"]
+        scores = self.score(
+            mz_arr,
+            int_arr, [self.registry.get(i.long_notation).counts for i in found],
+            reducing_end=reducing_end,
+            adduct=adduct,
+            tolerance=tolerance)
+        ranked = sorted(
+            zip(scores.tolist(), found),
+            key=lambda i: (-i[0], abs(i[1].delta)))
+        return ranked + [(0.0, i) for i in not_found]
@@ -0,0 +1,140 @@
+# -*- coding: UTF-8 -*-
+import re
+import codecs
+from html import unescape
+
+from bs4 import BeautifulSoup
+
+from .data_types import GlycomodHit, GlycomodRecord
+from .utils import split_result_line
+
+# single pass tokenizer for Glycomod results pages:
+#   mass - per mass header: user mass, adduct and derivative mass lines
+#   hit - result table row: glycoform mass, delta, structure
+#   count - "N structures found." closing each mass
+_GM_TOKENS = re.compile(
+    r"<h3>User mass: (?P<mass>[^<]*?)\s*<br>(?P<adduct>.*?)<br>\s*(?P<derivative>.*?)<br>"
+    r"|<tr><td[^>]*>(?P<theor>[^<]*)</td><td[^>]*>(?P<delta>[^<]*)</td><td>(?P<comp>.*?)</td>"
+    r"|(?P<count>\d+ structures? found\.)", re.S)
+_TAGS = re.compile(r"<[^>]+>")
+_SECTION_END = " found."
+
+
+def parse_gm_soup(soup) -> list:
+    """Parses Glycomod results page for relevant data about glycan compositions
+    Returns a list of string lists, one for each submitted mass
+        ### EXAMPLE ###
+        >>>[['User mass: 911.30', 'Adduct ([M+H]+): 1.00727',
+        >>>  'Derivative mass (Free reducing end): 18.0105546',
+        >>>  '892.317-0.034(Hex)3 (HexNAc)2  ', '1 structure'], ...]
+    """
+    items = []
+    glycans_list = []
+    for hr in soup.find_all("hr"):
+        for item in hr.find_next_siblings():
+            if item.name == 'hr':
+                break
+            items.append(item.text)
+    # this is silly
+    clean_text = ''.join(items).replace(u'\nglycoform mass\nΔmass (Dalton)\nstructure\ntype\nLinks', "")\
+        .replace("high_manUniCarbKB", "").replace("hybrid/complexUniCarbKB", "").\
+        replace(" -UniCarbKB", "").replace("high_man", "").replace("hybrid/complex", "").\
+        replace("paucimannose", "").\
+        replace(" -", "").\
+        replace("\n\n\n\nSIB Swiss Institute of Bioinformatics | Disclaimer", "").\
+        replace("Back to the Top\n\n", "")
+    unprocessed_strings = clean_text.split(
+        ' found.',
+        clean_text.count('found.') - 1)
+    for i in unprocessed_strings:
+        ll = i.split("\n")
+        ll2 = []
+        for j in range(len(ll)):
+            if len(ll[j]) > 1:
+                ll2.append(ll[j])
+        glycans_list.append(ll2)
+    return glycans_list
+
+
+def parse_gm_html(content) -> list:
+    """Parses raw Glycomod response (bytes or str), see parse_gm_soup"""
+    return parse_gm_soup(BeautifulSoup(content, 'html5lib'))
+
+
+def _hit(theor, delta, long_notation, registry):
+    comp = registry.get(long_notation)
+    return GlycomodHit(float(theor), float(delta), comp.long_notation,
+                       comp.counts)
+
+
+def records_from_lines(parsed_data, registry) -> list:
+    """Converts parse_gm_soup output into GlycomodRecord objects"""
+    records = []
+    for entry in parsed_data:
+        user_mass = float("".join(entry[0][len("User mass: "):].split()))
+        header, hits = [], []
+        for element in entry[1:]:
+            element = element.strip()
+            if not element[0].isdigit():
+                header.append(element)
+            elif "structure" not in element:
+                hits.append(_hit(*split_result_line(element), registry))
+        records.append(GlycomodRecord(user_mass, tuple(header), tuple(hits)))
+    return records
+
+
+def _clean(fragment) -> str:
+    return unescape(_TAGS.sub("", fragment)).strip()
+
+
+def _tokenize(text, registry):
+    """Yields GlycomodRecord of every complete mass section in text"""
+    user_mass = None
+    for token in _GM_TOKENS.finditer(text):
+        if token.group("mass") is not None:
+            user_mass = float("".join(token.group("mass").split()))
+            header = (_clean(token.group("adduct")),
+                      _clean(token.group("derivative")))
+            hits = []
+        elif user_mass is None:
+            continue
+        elif token.group("count") is not None:
+            yield GlycomodRecord(user_mass, header, tuple(hits))
+            user_mass = None
+        else:
+            hits.append(
+                _hit(token.group("theor"), token.group("delta"),
+                     _clean(token.group("comp")), registry))
+
+
+def iter_gm_records(chunks, registry):
+    """Streams Glycomod results page and yields GlycomodRecord for each mass
+    as soon as its section is complete
+    param::chunks iterable of bytes or str, e.g. resp.iter_content(65536)
+    param::registry utils.CompositionRegistry interning hit compositions
+        ### EXAMPLE ###
+        >>>next(iter_gm_records([html], CompositionRegistry(cfg)))
+        >>>GlycomodRecord(user_mass=911.3,
+        >>>    header=('Adduct ([M+H]+): 1.00727', 'Derivative mass (Free reducing end): 18.0105546'),
+        >>>    hits=(GlycomodHit(theoretical_MH=892.317, delta=-0.034,
+        >>>          long_notation='(Hex)3 (HexNAc)2', counts=(3, 2, 0, ...)),))
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    for chunk in chunks:
+        buffer += decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        # everything up to the last " found." consists of complete sections
+        end = buffer.rfind(_SECTION_END)
+        if end < 0:
+            continue
+        end += len(_SECTION_END)
+        yield from _tokenize(buffer[:end], registry)
+        buffer = buffer[end:]
+    buffer += decoder.decode(b"", final=True)
+    yield from _tokenize(buffer, registry)
+
+
+def parse_gm_stream(content, registry) -> list:
+    """Parses raw Glycomod response (bytes or str) in a single pass
+    into a list of GlycomodRecord, one for each submitted mass"""
+    return list(iter_gm_records([content], registry))
@@ -0,0 +1,144 @@
+# -*- coding: UTF-8 -*-
+import os
+import io
+import json
+import time
+import hashlib
+import logging
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests_toolbelt.multipart.decoder import MultipartDecoder
+
+from .utils import normalize_form_params
+
+
+def _request_body(request) -> bytes:
+    """Returns request body as bytes, consuming streamed (MultipartEncoder) bodies"""
+    body = request.body
+    if body is None:
+        return b""
+    if hasattr(body, "read"):
+        body = body.read()
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return body
+
+
+def request_fields(request) -> dict:
+    """Returns {field name: value} of a multipart form request"""
+    body = _request_body(request)
+    request.body = body  # streamed body has been consumed
+    fields = {}
+    if body:
+        for part in MultipartDecoder(body,
+                                     request.headers["Content-Type"]).parts:
+            disposition = part.headers[b"Content-Disposition"].decode()
+            name = disposition.split('name="', 1)[1].split('"', 1)[0]
+            fields[name] = part.text
+    return fields
+
+
+def request_key(fields) -> str:
+    """Returns recording key of form fields, submitted masses included"""
+    key_fields = normalize_form_params(fields)
+    key_fields["Masses"] = " ".join(str(fields.get("Masses", "")).split())
+    return hashlib.sha1(
+        json.dumps(key_fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class RecordingAdapter(BaseAdapter):
+    """RecordingAdapter sends requests through base adapter (live HTTP by default)
+    and saves form fields and responses into path as <key>.json and <key>.html"""
+
+    def __init__(self, path, base=None):
+        super().__init__()
+        self.logger = logging.getLogger(name="RecordingAdapter")
+        self.path = path
+        self.base = base if base is not None else HTTPAdapter()
+        os.makedirs(path, exist_ok=True)
+
+    def send(self, request, **kwargs):
+        fields = request_fields(request)
+        request.headers["Content-Length"] = str(len(request.body))
+        kwargs["stream"] = False
+        resp = self.base.send(request, **kwargs)
+        key = request_key(fields)
+        with open(os.path.join(self.path, key + ".html"), "wb") as f:
+            f.write(resp.content)
+        with open(os.path.join(self.path, key + ".json"), "w") as f:
+            json.dump(
+                {
+                    "url": request.url,
+                    "fields": fields,
+                    "status": resp.status_code,
+                    "headers": dict(resp.headers),
+                    "encoding": resp.encoding
+                },
+                f,
+                indent=2)
+        self.logger.debug(f"Recorded {request.url} as {key}")
+        return resp
+
+    def close(self):
+        self.base.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """ReplayAdapter answers requests from files saved by RecordingAdapter,
+    without any network access.
+    param::latency seconds added to every response, simulating Glycomod
+    Unrecorded requests raise requests.ConnectionError."""
+
+    def __init__(self, path, latency=0.0):
+        super().__init__()
+        self.path = path
+        self.latency = latency
+        self.replayed = 0
+
+    def send(self, request, **kwargs):
+        key = request_key(request_fields(request))
+        meta_path = os.path.join(self.path, key + ".json")
+        if not os.path.exists(meta_path):
+            raise requests.ConnectionError(
+                f"No recorded response for request {key} in {self.path}",
+                request=request)
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        with open(os.path.join(self.path, key + ".html"), "rb") as f:
+            content = f.read()
+        if self.latency:
+            time.sleep(self.latency)
+        resp = requests.Response()
+        resp.status_code = meta["status"]
+        resp.headers = CaseInsensitiveDict(meta["headers"])
+        resp.headers.pop("Transfer-Encoding", None)
+        resp.headers.pop("Content-Encoding", None)
+        resp.encoding = meta["encoding"]
+        resp.raw = io.BytesIO(content)
+        resp.url = request.url
+        resp.request = request
+        resp.reason = "Replayed"
+        self.replayed += 1
+        return resp
+
+    def close(self):
+        pass
+
+
+def _session(adapter) -> requests.Session:
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def recording_session(path, base=None) -> requests.Session:
+    """Returns session recording every Glycomod exchange into path"""
+    return _session(RecordingAdapter(path, base))
+
+
+def replay_session(path, latency=0.0) -> requests.Session:
+    """Returns session replaying exchanges recorded into path"""
+    return _session(ReplayAdapter(path, latency))
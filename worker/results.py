@@ -0,0 +1,311 @@
+# -*- coding: UTF-8 -*-
+import csv
+from array import array
+from itertools import islice, repeat
+
+import numpy as np
+
+from .data_types import GlycomodComposition, SubmittedMass
+
+# (GlycomodComposition field, adduct) of theoretical adduct ion columns,
+# in config.json/"col_names" order
+ION_FIELDS = (
+    ("theoretical_MTagH", "H+"),
+    ("theoretical_MTagNa", "Na+"),
+    ("theoretical_MTagK", "K+"),
+    ("theoretical_MTagNH4", "NH4+"),
+    ("theoretical_MTagH2", "2H2+"),
+    ("theoretical_MTagHNa", "HNa2+"),
+    ("theoretical_MTagHK", "HK2+"),
+    ("theoretical_MTagNa2", "2Na2+"),
+)
+NOT_FOUND = 0  # composition table row used by masses without any hit
+NOT_FOUND_MH = 0.0
+NOT_FOUND_DELTA = 1000.0
+
+
+def write_text(f, lines, chunk_size=10000):
+    """Writes lines into open text file f separated by newlines,
+    as f.write("\n".join(lines)) joining only chunk_size lines at a time"""
+    lines = iter(lines)
+    separator = ""
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        f.write(separator + "\n".join(chunk))
+        separator = "\n"
+
+
+class ResultStore:
+    """ResultStore keeps search results as columns (struct of arrays) instead of
+    SubmittedMass/GlycomodComposition objects.
+
+    Mass columns, one row per submitted mass:
+        peak_number, experimental_mass, adduct (index into adducts), adduct_mass,
+        submitted_mh ([M+H]+ sent to Glycomod), header (index into headers),
+        hit_start (first row of its hits)
+    Hit columns, one row per Glycomod hit (NOT FOUND included):
+        mass_index, theoretical_MH, delta, comp (row of the composition table)
+    Composition table, one row per distinct composition:
+        long_notations, short_notations, ions (compositions x ION_FIELDS matrix)
+
+    Columns grow in typed buffers and are exposed as NumPy arrays.
+    Indexing and iterating yield SubmittedMass objects built on demand,
+    so code written for a list of SubmittedMass keeps working.
+    """
+
+    def __init__(self, red_end_tag="", red_end_tag_mass=0.0):
+        self.red_end_tag = red_end_tag
+        self.red_end_tag_mass = red_end_tag_mass
+        self._peak_number = array("q")
+        self._experimental_mass = array("d")
+        self._adduct = array("i")
+        self._adduct_mass = array("d")
+        self._submitted_mh = array("d")
+        self._header = array("i")
+        self._hit_start = array("q")
+        self._mass_index = array("q")
+        self._theoretical_MH = array("d")
+        self._delta = array("d")
+        self._comp = array("i")
+        self.adducts = []
+        self._adduct_index = {}
+        self.headers = []
+        self._header_index = {}
+        self.long_notations = ["NOT FOUND"]
+        self.short_notations = ["NOT FOUND"]
+        self._ions = array("d", [0.0] * len(ION_FIELDS))
+        self._comp_index = {}
+
+    def __len__(self):
+        return len(self._peak_number)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ResultStore index out of range")
+        return self._submitted_mass(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._submitted_mass(index)
+
+    @staticmethod
+    def _intern(value, values, index):
+        if value not in index:
+            index[value] = len(values)
+            values.append(value)
+        return index[value]
+
+    def add_mass(self, peak_number, experimental_mass, adduct, adduct_mass,
+                 header=(), submitted_mass=None) -> int:
+        """Appends submitted mass, returns its row
+        param::submitted_mass [M+H]+ searched for experimental_mass
+            (multi adduct searches), experimental_mass if None"""
+        self._peak_number.append(int(peak_number))
+        self._experimental_mass.append(experimental_mass)
+        self._adduct.append(
+            self._intern(adduct, self.adducts, self._adduct_index))
+        self._adduct_mass.append(adduct_mass)
+        self._submitted_mh.append(experimental_mass if submitted_mass is None
+                                    else submitted_mass)
+        self._header.append(
+            self._intern(tuple(header), self.headers, self._header_index))
+        self._hit_start.append(len(self._mass_index))
+        return len(self._peak_number) - 1
+
+    def add_hit(self, mass_index, theoretical_MH, delta, composition):
+        """Appends hit of mass_index, composition is utils.InternedComposition"""
+        comp = self._comp_index.get(composition.long_notation)
+        if comp is None:
+            comp = len(self.long_notations)
+            self._comp_index[composition.long_notation] = comp
+            self.long_notations.append(composition.long_notation)
+            self.short_notations.append(composition.short_notation)
+            self._ions.extend(composition.adduct_ions[adduct]
+                              for _, adduct in ION_FIELDS)
+        self._mass_index.append(mass_index)
+        self._theoretical_MH.append(theoretical_MH)
+        self._delta.append(delta)
+        self._comp.append(comp)
+
+    def add_not_found(self, mass_index):
+        self._mass_index.append(mass_index)
+        self._theoretical_MH.append(NOT_FOUND_MH)
+        self._delta.append(NOT_FOUND_DELTA)
+        self._comp.append(NOT_FOUND)
+
+    def column(self, name) -> np.ndarray:
+        """Returns mass or hit column as a NumPy array
+        - a copy, views would lock the buffers against further appends"""
+        buffer = getattr(self, f"_{name}")
+        return np.array(buffer, dtype=buffer.typecode)
+
+    @property
+    def ions(self) -> np.ndarray:
+        return self.column("ions").reshape(-1, len(ION_FIELDS))
+
+    def _hit_rows(self, index) -> range:
+        end = self._hit_start[index + 1] if index + 1 < len(self) else len(
+            self._mass_index)
+        return range(self._hit_start[index], end)
+
+    def _composition(self, row) -> GlycomodComposition:
+        comp = self._comp[row]
+        offset = comp * len(ION_FIELDS)
+        ions = {
+            field: self._ions[offset + n]
+            for n, (field, _) in enumerate(ION_FIELDS)
+        }
+        return GlycomodComposition(
+            theoretical_MH=self._theoretical_MH[row],
+            delta=self._delta[row],
+            long_notation=self.long_notations[comp],
+            short_notation=self.short_notations[comp],
+            **ions)
+
+    def _submitted_mass(self, index) -> SubmittedMass:
+        return SubmittedMass(
+            peak_number=self._peak_number[index],
+            experimental_mass=self._experimental_mass[index],
+            adduct=self.adducts[self._adduct[index]],
+            adduct_mass=self._adduct_mass[index],
+            red_end_tag=self.red_end_tag,
+            red_end_tag_mass=self.red_end_tag_mass,
+            glycomod_structures=[
+                self._composition(i) for i in self._hit_rows(index)
+            ],
+            submitted_mass=self._submitted_mh[index])
+
+    def _columns(self) -> list:
+        """Returns hit columns as arrays in config.json/"col_names" order"""
+        mass = self.column("mass_index")
+        comp = self.column("comp")
+        ions = self.ions[comp]
+        columns = [
+            self.column("peak_number")[mass],
+            self.column("experimental_mass")[mass],
+            np.full(len(mass), self.red_end_tag, dtype=object),
+            np.full(len(mass), self.red_end_tag_mass),
+            np.array(self.adducts, dtype=object)[self.column("adduct")[mass]],
+            self.column("adduct_mass")[mass],
+            np.array(self.short_notations, dtype=object)[comp],
+            np.array(self.long_notations, dtype=object)[comp],
+            self.column("theoretical_MH"),
+            self.column("delta"),
+        ] + [ions[:, n] for n in range(len(ION_FIELDS))]
+        return columns
+
+    def to_frame(self, col_names) -> "pd.DataFrame":
+        """Returns hits as DataFrame with config.json/"col_names" columns,
+        same rows as SubmittedMass.prep_out"""
+        import pandas as pd
+        return pd.DataFrame(dict(zip(col_names, self._columns())),
+                            columns=col_names)
+
+    def iter_rows(self, chunk_size=10000):
+        """Yields hits as SubmittedMass.prep_out tuples,
+        converting chunk_size hits from the buffers at a time"""
+        n_ions = len(ION_FIELDS)
+        for start in range(0, len(self._mass_index), chunk_size):
+            end = start + chunk_size
+            mass = self._mass_index[start:end]
+            comp = self._comp[start:end]
+            adducts = [self._adduct[i] for i in mass]
+            yield from zip(
+                [self._peak_number[i] for i in mass],
+                [self._experimental_mass[i] for i in mass],
+                repeat(self.red_end_tag),
+                repeat(self.red_end_tag_mass),
+                [self.adducts[i] for i in adducts],
+                [self._adduct_mass[i] for i in mass],
+                [self.short_notations[i] for i in comp],
+                [self.long_notations[i] for i in comp],
+                self._theoretical_MH[start:end],
+                self._delta[start:end],
+                *([self._ions[i * n_ions + n] for i in comp]
+                  for n in range(n_ions)))
+
+    def write_csv(self, f, col_names, chunk_size=10000, header=True) -> int:
+        """Streams hits into open text file f as csv with config.json/"col_names"
+        header, same rows as to_frame(col_names).to_csv(f, index=False)
+        param::header False appends rows only (e.g. next chunk of a run)
+        returns number of rows written"""
+        writer = csv.writer(f, lineterminator="\n")
+        if header:
+            writer.writerow(col_names)
+        writer.writerows(self.iter_rows(chunk_size))
+        return len(self._mass_index)
+
+    def to_arrow(self, col_names) -> "pyarrow.Table":
+        """Returns hits as pyarrow.Table with config.json/"col_names" columns,
+        numeric columns are handed over without per-row conversion"""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError(
+                "Arrow and Parquet export needs pyarrow: pip install pyarrow")
+        return pa.Table.from_arrays(
+            [pa.array(i) for i in self._columns()],
+            names=list(col_names))
+
+    def write_parquet(self, path, col_names, compression="snappy"):
+        """Writes hits (see to_arrow) as Parquet file"""
+        table = self.to_arrow(col_names)
+        import pyarrow.parquet as pq
+        pq.write_table(table, path, compression=compression)
+
+    def db_rows(self, chunk_size=10000):
+        """Yields hits as SubmittedMass.prep_db_out tuples,
+        converting chunk_size hits from the buffers at a time"""
+        n_ions = len(ION_FIELDS)
+        for start in range(0, len(self._mass_index), chunk_size):
+            end = start + chunk_size
+            mass = self._mass_index[start:end]
+            comp = self._comp[start:end]
+            adducts = [self._adduct[i] for i in mass]
+            yield from zip(
+                [self._peak_number[i] for i in mass],
+                [self._experimental_mass[i] for i in mass],
+                self._theoretical_MH[start:end],
+                # theoretical_MTagH, first of ION_FIELDS
+                [self._ions[i * n_ions] for i in comp],
+                [self.long_notations[i] for i in comp],
+                [self.short_notations[i] for i in comp],
+                repeat(self.red_end_tag),
+                repeat(self.red_end_tag_mass),
+                self._delta[start:end],
+                [self.adducts[i] for i in adducts],
+                [self._adduct_mass[i] for i in mass],
+                [self._submitted_mh[i] for i in mass])
+
+    def text_lines(self):
+        """Yields text report lines straight from the columns,
+        blocks of masses are separated by an empty line"""
+        for index in range(len(self)):
+            if index:
+                yield ""
+            yield f"User mass: {self._experimental_mass[index]}"
+            yield from self.headers[self._header[index]]
+            counter = 0
+            for row in self._hit_rows(index):
+                comp = self._comp[row]
+                if comp == NOT_FOUND:
+                    continue
+                counter += 1
+                comp_str = "".join(self.long_notations[comp].split())
+                yield f"\t{counter}. [MH]+: {self._theoretical_MH[row]:>9},  Error: {self._delta[row]:>6}, Comp: {comp_str}"
+            yield f"{counter} structure{'' if counter == 1 else 's'} found."
+
+    def write_text(self, f, chunk_size=10000):
+        """Streams text report (see GlycomodWorker._write_text)
+        into open text file f"""
+        write_text(f, self.text_lines(), chunk_size)
+
+    def to_text(self) -> str:
+        """Returns text report as one string, write_text for large reports"""
+        return "\n".join(self.text_lines())
@@ -1,7 +1,17 @@
 # -*- coding: UTF-8 -*-
 import re
+import sys
+import json
+import hashlib
+import threading
+from collections import OrderedDict
 from http.client import HTTPConnection
-from typing import Dict
+from types import MappingProxyType
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .data_types import InternedComposition
 
 # Cytonize all util functions??
 
@@ -75,9 +85,194 @@ def truncated_str_from_dict(dictionary):
         f"{'HexA' + str(dictionary['(HexA)']) if dictionary.get('(HexA)') else ''}"
 
 
-def calc_theor_mono_mass(dictionary, cfg, prec=6, reducing_end=None) -> float:
+def split_result_line(line) -> Tuple[str, str, str]:
+    """Splits Glycomod result line into theoretical mass, delta and long notation strings
+        ### EXAMPLE ###
+        >>>split_result_line("1435.32-0.337(Hex)1 (HexNAc)3 (Sulph)3")
+        >>>("1435.32", "-0.337", "(Hex)1 (HexNAc)3 (Sulph)3")
+    """
+    split_index = line.index("(")
+    num_str, comp_str = line[:split_index], line[split_index:].strip()
+    # find returns -1 if not found
+    if num_str.find("-") > 0:
+        return num_str[:num_str.index("-")], num_str[num_str.index("-"):], comp_str
+    # if positive, python handles .17 as 0.17
+    return num_str[:num_str.rindex(".")], num_str[num_str.rindex("."):], comp_str
+
+
+def composition_counts(string, residues) -> Tuple[int, ...]:
+    """Returns residue counts of long form composition in residues order
+        ### EXAMPLE ###
+        >>>composition_counts("(Hex)3 (HexNAc)2", cfg["residues"])
+        >>>(3, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    """
+    str_dict = string_to_dict(string)
+    unknown = set(str_dict) - set(residues)
+    if unknown:
+        raise ValueError(
+            f"Unknown residues {sorted(unknown)} in composition {string}")
+    return tuple(str_dict.get(i, 0) for i in residues)
+
+
+def counts_to_dict(counts, residues) -> Dict[str, int]:
+    """Returns glycan in dictionary form from residue counts"""
+    return {i: n for i, n in zip(residues, counts) if n}
+
+
+def residue_masses(cfg, masses="mono_masses_underivatized") -> np.ndarray:
+    """Returns masses of config.json/"residues" in that order
+    - the fixed residue order of count vectors and count matrices"""
+    missing = [i for i in cfg["residues"] if i not in cfg[masses]]
+    if missing:
+        raise ValueError(f"Residues {missing} have no mass in {masses}")
+    return np.array([cfg[masses][i] for i in cfg["residues"]])
+
+
+def counts_matrix(compositions, residues) -> np.ndarray:
+    """Stacks compositions (count vectors or dictionaries) into a uint8 matrix
+    with one row per composition and one column per residue
+        ### EXAMPLE ###
+        >>>counts_matrix([(3, 2), {"(HexNAc)": 2, "(Hex)": 4}], ["(Hex)", "(HexNAc)"])
+        >>>array([[3, 2], [4, 2]], dtype=uint8)
+    """
+    columns = {j: i for i, j in enumerate(residues)}
+    matrix = np.zeros((len(compositions), len(residues)), dtype=np.int64)
+    for row, composition in enumerate(compositions):
+        if isinstance(composition, dict):
+            for key, count in composition.items():
+                matrix[row, columns[key]] = count
+        else:
+            matrix[row] = composition
+    if matrix.size and (matrix.min() < 0 or matrix.max() > 255):
+        raise ValueError("Residue counts must be within 0-255")
+    return matrix.astype(np.uint8)
+
+
+class MassModel:
+    """MassModel is the mass table of config.json, validated and compiled once:
+    residue mass vectors in config.json/"residues" order, reducing end tag masses
+    and the adduct table as arrays.
+
+    Utils mass functions accept it in place of cfg, which takes dictionary
+    lookups and tag validation out of per hit code. Share a single instance
+    between workers, registries and search engines.
+        ### EXAMPLE ###
+        >>>model = MassModel(cfg)
+        >>>calc_theor_mono_mass({"(Hex)": 3, "(HexNAc)": 2}, model)
+        >>>911.335
+        >>>model.adduct_ions(counts_matrix(comps, model.residues), "ProA")
+        >>>array([[...], ...])  # compositions x adducts
+    """
+
+    def __init__(self, cfg):
+        mono = cfg["mono_masses_underivatized"]
+        avg = cfg["avg_masses_underivatized"]
+        self.residues = tuple(cfg["residues"])
+        self.residue_index = {j: i for i, j in enumerate(self.residues)}
+        self.residue_mono = residue_masses(cfg, "mono_masses_underivatized")
+        self.residue_avg = residue_masses(cfg, "avg_masses_underivatized")
+        self.proton = mono["H+"]
+        self.water = mono["H2O"]
+        self.h3o_mono = mono["H3O+"]
+        self.h3o_avg = avg["H3O+"]
+        self.tag_mono = dict(cfg["reducing_end_tag_mono"])
+        self.tag_avg = dict(cfg["reducing_end_tag_avg"])
+        self.adducts = tuple(cfg["adducts"].keys())
+        self.adduct_index = {j: i for i, j in enumerate(self.adducts)}
+        table = np.array(
+            list(cfg["adducts"].values()), dtype=float).reshape(-1, 2)
+        self.adduct_mass = table[:, 0]
+        self.adduct_charge = table[:, 1]
+        for arr in (self.residue_mono, self.residue_avg, self.adduct_mass,
+                    self.adduct_charge):
+            arr.flags.writeable = False
+
+    def tag_mass(self, reducing_end, avg=False) -> float:
+        """Returns reducing end tag mass, 0.0 for free reducing end"""
+        if not reducing_end:
+            return 0.0
+        tags = self.tag_avg if avg else self.tag_mono
+        if reducing_end not in tags:
+            raise ValueError(
+                f"Invalid reducing end tag [{reducing_end}]. Available tags: {list(tags.keys())}"
+            )
+        return tags[reducing_end]
+
+    def charge(self, adduct) -> int:
+        return int(self.adduct_charge[self.adduct_index[adduct]])
+
+    def vector(self, composition) -> np.ndarray:
+        """Returns count vector (or matrix) of composition in any supported form"""
+        if isinstance(composition, dict):
+            counts = np.zeros(len(self.residues))
+            try:
+                for key, count in composition.items():
+                    counts[self.residue_index[key]] = count
+            except KeyError as e:
+                raise ValueError(f"Unknown residue {e} in {composition}")
+            return counts
+        return np.asarray(composition)
+
+    def residue_sum(self, composition, avg=False):
+        summed = self.vector(composition) @ (self.residue_avg
+                                             if avg else self.residue_mono)
+        return summed if summed.ndim else float(summed)
+
+    def mono_mass(self, composition, reducing_end=None, prec=6):
+        """Same as calc_theor_mono_mass"""
+        return _round(
+            self.residue_sum(composition) + self.h3o_mono +
+            self.tag_mass(reducing_end), prec)
+
+    def avg_mass(self, composition, reducing_end=None, prec=6):
+        """Same as calc_theor_avg_mass"""
+        return _round(
+            self.residue_sum(composition, avg=True) + self.h3o_avg +
+            self.tag_mass(reducing_end, avg=True), prec)
+
+    def adduct_ions(self, composition, reducing_end=None,
+                    prec=4) -> np.ndarray:
+        """Returns theoretical m/z of every adduct (in adducts order),
+        count matrices return one row per composition"""
+        neutral = np.asarray(
+            self.residue_sum(composition) + self.water +
+            self.tag_mass(reducing_end))
+        return np.round((neutral[..., np.newaxis] + self.adduct_mass) /
+                        self.adduct_charge, prec)
+
+    def mh_masses(self, mz_values, prec=4) -> np.ndarray:
+        """Same as calc_adduct_mh_masses, without adduct names"""
+        mz = np.asarray(mz_values, dtype=float).reshape(-1, 1)
+        return np.round(mz * self.adduct_charge - self.adduct_mass +
+                        self.proton, prec)
+
+
+def _residue_sum(composition, cfg, masses="mono_masses_underivatized"):
+    """Returns summed residue mass of a composition given as dictionary,
+    count vector (float) or count matrix (array, one mass per row),
+    the residue vector is built from cfg on every call - repeated vector
+    calls should pass a MassModel to the public mass functions"""
+    if isinstance(composition, dict):
+        return sum([
+            composition[key] * cfg[masses][key] for key in composition.keys()
+        ])
+    summed = np.asarray(composition) @ residue_masses(cfg, masses)
+    return summed if summed.ndim else float(summed)
+
+
+def _round(mass, prec):
+    return np.round(mass, prec) if isinstance(mass, np.ndarray) else round(
+        mass, prec)
+
+
+def calc_theor_mono_mass(composition, cfg, prec=6, reducing_end=None):
     """Returns theoretical monoisotopic mass for glycan in dictionary form
-        - reducing end type specified by reducing_end parameter ("2-AB" or "ProA") ELSE treated as unlabeled nonreduced"""
+        - composition may also be a count vector or a count matrix in config.json/"residues"
+          order, matrices return an array of masses
+        - reducing end type specified by reducing_end parameter ("2-AB" or "ProA") ELSE treated as unlabeled nonreduced
+        - cfg may be a MassModel"""
+    if isinstance(cfg, MassModel):
+        return cfg.mono_mass(composition, reducing_end, prec)
     reducing_end_tag_mass = 0.0
     if reducing_end is not None:
         if reducing_end in cfg["reducing_end_tag_mono"].keys():
@@ -87,28 +282,31 @@ def calc_theor_mono_mass(dictionary, cfg, prec=6, reducing_end=None) -> float:
                 f"Invalid reducing end tag. Available tags:  {list(cfg['reducing_end_tag'].keys())}"
             )
     # I don't know why there is H3O+, but it is in accordance with what Glycomod and Glycoworkbench show as mono masses
-    return round(
-        sum([
-            dictionary[key] * cfg["mono_masses_underivatized"][key]
-            for key in dictionary.keys()
-        ]) + cfg["mono_masses_underivatized"]["H3O+"] + reducing_end_tag_mass,
+    return _round(
+        _residue_sum(composition, cfg) +
+        cfg["mono_masses_underivatized"]["H3O+"] + reducing_end_tag_mass,
         prec)
 
 
-def _calc_theor_mono_mass_adducts(dictionary,
+def _calc_theor_mono_mass_adducts(residue_sum,
                                   cfg,
                                   charge,
                                   reducing_end_mass,
                                   adduct_mass,
                                   prec=6):
-    return round((sum([
-        dictionary[key] * cfg["mono_masses_underivatized"][key]
-        for key in dictionary.keys()
-    ]) + cfg["mono_masses_underivatized"]["H2O"] + reducing_end_mass +
-                  adduct_mass) / charge, prec)
+    return _round((residue_sum + cfg["mono_masses_underivatized"]["H2O"] +
+                   reducing_end_mass + adduct_mass) / charge, prec)
 
 
-def calc_default_adducts_mono(dictionary, cfg, reducing_end, prec=4):
+def calc_default_adducts_mono(composition, cfg, reducing_end, prec=4):
+    """Returns {adduct: theoretical m/z} for every adduct in cfg["adducts"]
+        - composition in dictionary, count vector or count matrix form
+        - cfg may be a MassModel"""
+    if isinstance(cfg, MassModel):
+        ions = cfg.adduct_ions(composition, reducing_end, prec)
+        if ions.ndim == 1:
+            return dict(zip(cfg.adducts, ions.tolist()))
+        return {j: ions[:, i] for i, j in enumerate(cfg.adducts)}
     reducing_end_tag_mass = 0.0
     if reducing_end:
         if reducing_end in cfg["reducing_end_tag_mono"].keys():
@@ -116,26 +314,124 @@ def calc_default_adducts_mono(dictionary, cfg, reducing_end, prec=4):
         else:
             err = f"Invalid reducing end tag [{reducing_end}]. Available tags: {list(cfg['reducing_end_tag_mono'].keys())}"
             raise ValueError(err)
+    # summed once, shared by all adducts
+    residue_sum = _residue_sum(composition, cfg)
     adduct_ions = {
         i: _calc_theor_mono_mass_adducts(
-            dictionary, cfg, j[1], reducing_end_tag_mass, j[0], prec=prec)
+            residue_sum, cfg, j[1], reducing_end_tag_mass, j[0], prec=prec)
         for i, j in cfg["adducts"].items()
     }
     return adduct_ions
 
 
-def calc_theor_avg_mass(dictionary, cfg, prec=6, reducing_end=None) -> float:
-    """Returns theoretical average mass for glycan in dictionary form"""
+class CompositionRegistry:
+    """CompositionRegistry parses every distinct long notation once and interns it
+    as InternedComposition - residue count vector, short notation and adduct ion
+    masses (for reducing_end) are computed on first lookup only.
+
+    Repeated lookups are O(1) and return the same object, so records of a run
+    share strings and count vectors. At most maxsize compositions are kept,
+    least recently used ones are dropped first. Lookups are thread safe.
+        ### EXAMPLE ###
+        >>>registry = CompositionRegistry(cfg, reducing_end="ProA")
+        >>>registry.get("(Hex)3 (HexNAc)2").short_notation
+        >>>"H3N2"
+    """
+
+    def __init__(self, cfg, reducing_end=None, maxsize=4096, model=None):
+        self.model = model if model is not None else MassModel(cfg)
+        self.residues = self.model.residues
+        self.reducing_end = reducing_end
+        self.model.tag_mass(reducing_end)  # fail early on unknown tags
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # long notation: InternedComposition
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, long_notation) -> InternedComposition:
+        with self._lock:
+            entry = self._entries.get(long_notation)
+            if entry is not None:
+                self._entries.move_to_end(long_notation)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return self._intern(long_notation)
+
+    def _intern(self, long_notation) -> InternedComposition:
+        long_notation = sys.intern(long_notation)
+        counts = composition_counts(long_notation, self.residues)
+        entry = InternedComposition(
+            long_notation=long_notation,
+            counts=counts,
+            short_notation=truncated_str_from_dict(
+                counts_to_dict(counts, self.residues)),
+            adduct_ions=MappingProxyType(
+                calc_default_adducts_mono(counts, self.model,
+                                          self.reducing_end)))
+        self._entries[long_notation] = entry
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+
+def calc_adduct_mh_masses(mz_values, cfg, prec=4) -> Tuple[List[str], np.ndarray]:
+    """Returns [M+H]+ equivalents of observed m/z values for every adduct in cfg["adducts"]
+        - one row per m/z value, one column per adduct (order of returned adduct names)
+        - all adduct/charge combinations are computed in a single pass
+        ### EXAMPLE ###
+        >>>calc_adduct_mh_masses([933.32], cfg)
+        >>>(["H+", "Na+", ...], array([[933.32, 911.3375, ...]]))
+    """
+    if isinstance(cfg, MassModel):
+        return list(cfg.adducts), cfg.mh_masses(mz_values, prec)
+    names = list(cfg["adducts"].keys())
+    table = np.array(list(cfg["adducts"].values()), dtype=float).reshape(-1, 2)
+    adduct_mass, charge = table[:, 0], table[:, 1]
+    mz = np.asarray(mz_values, dtype=float).reshape(-1, 1)
+    # neutral (tagged) glycan mass for each adduct hypothesis
+    neutral = mz * charge - adduct_mass
+    return names, np.round(
+        neutral + cfg["mono_masses_underivatized"]["H+"], prec)
+
+
+def calc_theor_avg_mass(composition, cfg, prec=6, reducing_end=None):
+    """Returns theoretical average mass for glycan in dictionary, count vector
+    or count matrix form, cfg may be a MassModel"""
+    if isinstance(cfg, MassModel):
+        return cfg.avg_mass(composition, reducing_end, prec)
     reducing_end_tag_mass = 0.0
     if reducing_end is not None:
         if reducing_end in cfg["reducing_end_tag_avg"].keys():
             reducing_end_tag_mass = cfg["reducing_end_tag_avg"][reducing_end]
-    return round(
-        sum([
-            dictionary[key] * cfg["avg_masses_underivatized"][key]
-            for key in dictionary.keys()
-        ]) + cfg["avg_masses_underivatized"]["H3O+"] + reducing_end_tag_mass,
-        prec)
+    return _round(
+        _residue_sum(composition, cfg, "avg_masses_underivatized") +
+        cfg["avg_masses_underivatized"]["H3O+"] + reducing_end_tag_mass, prec)
+
+
+def normalize_form_params(form_fields) -> Dict[str, str]:
+    """Returns Glycomod form fields without "Masses" with all values as stripped strings
+        - searches with the same parameters on different masses normalize equally"""
+    normalized = {}
+    for key, value in form_fields.items():
+        if key == "Masses":
+            continue
+        if value is None:
+            value = ""
+        elif isinstance(value, (tuple, list)):
+            value = "|".join(str(i) for i in value)
+        normalized[key] = str(value).strip()
+    return normalized
+
+
+def form_params_key(form_fields) -> str:
+    """Returns hash of normalized Glycomod form fields (masses excluded)"""
+    normalized = json.dumps(normalize_form_params(form_fields), sort_keys=True)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
 
 
 def check_internet_conn():
@@ -1,20 +1,22 @@
 # -*- coding: UTF-8 -*-
 import os
+import sys
 import logging
-from collections import OrderedDict
-from pprint import pprint
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import arrow
-import pandas as pd
-from bs4 import BeautifulSoup
-from toolz.itertoolz import concat
 import requests
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 
-from .data_types import GlycomodComposition, SubmittedMass, GMForm
-from .utils import string_to_dict
-from .utils import calc_default_adducts_mono
-from .utils import truncated_str_from_dict
+from .data_types import GMForm
+from .results import ResultStore
+from .utils import calc_adduct_mh_masses
+from .utils import CompositionRegistry
+from .utils import MassModel
+from .parser import parse_gm_soup
+from .parser import iter_gm_records
+from .parser import records_from_lines
 
 
 # TODO PRIMARY: MAKE USE OF CHARGES IN DB, FOR SIMPLE ADDUCTS DO TRANSFORMS TO [MH]+
@@ -27,6 +29,24 @@ class GlycomodWorker:
     ### So far only MASSES FROM POSITIVE MODE MS CAN BE USED. ###
     ### So far only H+ is USED AS ADDUCT. ###
 
+    With multi_adduct=True every picked peak is matched at its observed m/z against
+    all adduct and charge combinations in config.json/"adducts" in a single search.
+    Each combination is submitted as its [M+H]+ equivalent and every resulting
+    SubmittedMass is tagged with the adduct that explains it.
+
+    If a GlycomodClient is passed as client, masses are submitted in concurrent chunks
+    over its pooled session instead of a single request.
+
+    If a requests.Session is passed as session, single requests are posted through it,
+    e.g. replay.replay_session answers them from recorded responses without network.
+
+    If a GlycomodCache is passed as cache, masses already covered by cached searches
+    with the same parameters are served locally and only the rest is sent to Glycomod.
+
+    With reuse_results=True masses already searched with the same parameters
+    (masses excluded) in an earlier run are rebuilt from results stored in db
+    (dbutil.DB.lookup_records) and only new masses are searched.
+
     Results can be reported as .csv or .txt.
     Masses without matches on Glycomod are reported as NOT FOUND.
 
@@ -61,7 +81,14 @@ class GlycomodWorker:
                  adduct_extra_mass="",
                  save_txt=False,
                  filename="",
-                 params=None):
+                 params=None,
+                 multi_adduct=False,
+                 cache=None,
+                 client=None,
+                 registry=None,
+                 mass_model=None,
+                 session=None,
+                 reuse_results=False):
         self.logger = logging.getLogger(name="Worker")
         self.cfg = cfg
         self.Nglycan_form = "Free / PNGase released oligosaccharides"
@@ -76,14 +103,38 @@ class GlycomodWorker:
         self.form_fields = None
         self.soup = None
         self.params = params
-        self.parsed_data = []
-        self.compositions = []
+        self.records = []  # [GlycomodRecord,...] one for each submitted mass
         self.masses_from_db = []
         self.masses_from_db_single = []
+        self.multi_adduct = multi_adduct
+        self.submitted_adducts = []  # [(adduct, adduct_mass, observed m/z),...] if multi_adduct
         self.db = db  # dbutil::DB
+        self.cache = cache  # cache::GlycomodCache
+        self.client = client  # client::GlycomodClient
+        self.session = session  # requests.Session, module level requests if None
+        self.reuse_results = reuse_results
+        self.reused = 0  # masses served from earlier runs in db
 
         self._validate_reducing_end_tag(reducing_end)
-        self._validate_adduct(adduct, adduct_extra_mass)
+        # utils::MassModel, built once from cfg and shared with the registry
+        self.mass_model = mass_model if mass_model is not None else MassModel(
+            cfg)
+        # utils::CompositionRegistry, may be shared by workers with the same reducing end
+        if registry is None:
+            registry = CompositionRegistry(
+                cfg, reducing_end=self.reducing_end_tag, model=self.mass_model)
+        self.registry = registry
+        # results::ResultStore, behaves as list of SubmittedMass
+        self.compositions = ResultStore(self.reducing_end_tag,
+                                        self.reducing_end_mass)
+        self.chunked = False  # compositions hold only the last chunk of iter_run
+        if (self.registry.reducing_end or "") != self.reducing_end_tag:
+            raise ValueError(
+                f"Composition registry computes masses for reducing end [{self.registry.reducing_end}], worker uses [{self.reducing_end_tag}]"
+            )
+        # multi adduct searches are submitted to Glycomod as [M+H]+
+        self._validate_adduct("H+" if multi_adduct else adduct,
+                              adduct_extra_mass)
 
     def _validate_reducing_end_tag(self, reducing_end):
         try:
@@ -118,80 +169,58 @@ class GlycomodWorker:
                 f"Adduct [{adduct}] not supported. Supported adducts: {list(self.cfg['gm_adduct_form'].keys())}"
             )
 
-    def output_csv(self):
-        out = list(concat([i.prep_out() for i in self.compositions]))
-        df = pd.DataFrame.from_records(out, columns=self.cfg["col_names"])
-        if self.filename:
-            df.to_csv(str(self.filename) + ".csv", index=False)
-        else:
+    def _output_path(self, extension):
+        if not self.filename:
             # set filename in case self.save_txt == True, both files should have the same name
             self.filename = f"results_{arrow.now().format('YYYYMMDD_HH:mm:ss')}"
-            df.to_csv(self.filename + ".csv", index=False)
+        return str(self.filename) + extension
+
+    def _check_complete(self):
+        if self.chunked:
+            raise RuntimeError(
+                "compositions hold only the last chunk of a chunked run, "
+                "pass csv_file/text_file to iter_run to export all results")
+
+    def output_csv(self):
+        """Streams results into <filename>.csv, rows are converted
+        from the result store in chunks, no DataFrame is built"""
+        self._check_complete()
+        with open(self._output_path(".csv"), "w", newline="") as outfile:
+            self.compositions.write_csv(outfile, self.cfg["col_names"])
         self.logger.debug(f"Finished saving results as .csv")
 
+    def output_parquet(self):
+        """Saves results as <filename>.parquet for columnar analysis,
+        needs pyarrow"""
+        self._check_complete()
+        self.compositions.write_parquet(
+            self._output_path(".parquet"), self.cfg["col_names"])
+        self.logger.debug(f"Finished saving results as .parquet")
+
     def output_text(self, to_std_out=False):
-        pretty_txt = self._prettify_text()
+        """Streams text report into <filename>.txt or stdout"""
+        self._check_complete()
         if to_std_out:
             print(f"SEARCH RETURNED {len(self.compositions)} RESULTS")
-            print(pretty_txt)
+            self._write_text(sys.stdout)
+            print()
         else:
-            if self.filename:
-                with open(str(self.filename) + ".txt", "w") as outfile:
-                    outfile.write(pretty_txt)
-            else:
-                with open(
-                        f"results_{arrow.now().format('YYYYMMDD_HH:mm:ss')}.txt",
-                        "w") as outfile:
-                    outfile.write(pretty_txt)
+            with open(self._output_path(".txt"), "w") as outfile:
+                self._write_text(outfile)
             self.logger.debug("Finished saving results as .txt")
 
-    def _prettify_text(self):
-        """ Transforms raw text to more readable form.
-        EXAMPLE RAW:
-            'User mass: 1454.0',
-            'Adduct ([M+H]+): 1.00727',
-            'Derivative mass (Free reducing end): 18.0105546',
-            '1434.5020.48(Hex)3 (HexNAc)2 (Deoxyhexose)1 (Pent)3',
-            '1435.32-0.337(Hex)1 (HexNAc)3 (Deoxyhexose)2 (Pent)1 (Sulph)3',
-            '1435.362-0.379(Hex)4 (HexNAc)1 (Deoxyhexose)2 (Pent)1 (Sulph)2',
-            '3 structures'
-        EXAMPLE PROCESSED:
+    def _write_text(self, f):
+        """ Writes results in readable form into open text file f,
+        lines are rendered from the result store one by one.
+        EXAMPLE:
             User mass: 1454.0
             Adduct ([M+H]+): 1.00727
             Derivative mass (Free reducing end): 18.0105546
-	            1. [MH]+: 1434.502,  Error: 0.48, Comp: (Hex)3(HexNAc)2(Deoxyhexose)1(Pent)3
-	            2. [MH]+: 1435.32,  Error: -0.337, Comp: (Hex)1(HexNAc)3(Deoxyhexose)2(Pent)1(Sulph)3
-	            3. [MH]+: 1435.362,  Error: -0.379, Comp: (Hex)4(HexNAc)1(Deoxyhexose)2(Pent)1(Sulph)2
-            3 structures"""
-        prep_text = self.parsed_data.copy()
-        for i in prep_text:
-            # if unmatched len == 4
-            if len(i) > 4:
-                res_string = i[3:len(i) - 1]
-                prepped = []
-                counter = 1
-                for res in res_string:
-                    split_index = res.index("(")
-                    num_str, comp_str = res[:split_index:], res[split_index:]
-                    comp_str = "".join(comp_str.split())
-                    if num_str.find("-") > 0:  # -1 if not found
-                        # [mass, error]
-                        numbers = [
-                            num_str[:num_str.index("-")],
-                            num_str[num_str.index("-"):]
-                        ]
-                    else:
-                        numbers = [
-                            num_str[:num_str.rindex(".") - 1],
-                            num_str[num_str.rindex(".") - 1:]
-                        ]
-                    prepped.append(
-                        f"\t{counter}. [MH]+: {numbers[0]:>9},  Error: {numbers[1]:>6}, Comp: {comp_str}"
-                    )
-                    counter += 1
-                # replace with processed strings
-                i[3:len(i) - 1] = prepped
-        return "\n\n".join(["\n".join(i) for i in prep_text])
+	            1. [MH]+:  1434.502,  Error:   0.48, Comp: (Hex)3(HexNAc)2(Deoxyhexose)1(Pent)3
+	            2. [MH]+:   1435.32,  Error: -0.337, Comp: (Hex)1(HexNAc)3(Deoxyhexose)2(Pent)1(Sulph)3
+	            3. [MH]+:  1435.362,  Error: -0.379, Comp: (Hex)4(HexNAc)1(Deoxyhexose)2(Pent)1(Sulph)2
+            3 structures found."""
+        self.compositions.write_text(f)
 
     def _form_helper(self, masses_text, red_end_mass):
         if self.params:
@@ -327,7 +356,26 @@ class GlycomodWorker:
     def _calc_single_charged(self, mass, charge):
         return round(((mass * charge) - (charge - 1) * self.adduct_info[1]), 4)
 
+    def _expand_adducts(self):
+        """Returns [M+H]+ equivalents of each peak for every adduct in cfg["adducts"],
+        fills submitted_adducts [(adduct, adduct_mass, observed m/z),...]"""
+        names, mh_masses = calc_adduct_mh_masses(
+            [i[1] for i in self.masses_from_db], self.mass_model)
+        self.submitted_adducts = []
+        expanded = []
+        for row, peak in enumerate(self.masses_from_db):
+            for col, name in enumerate(names):
+                if mh_masses[row, col] <= 0:
+                    continue
+                expanded.append((peak[0], float(mh_masses[row, col])))
+                self.submitted_adducts.append(
+                    (name, float(self.mass_model.adduct_mass[col]),
+                     float(peak[1])))
+        return expanded
+
     def _get_masses_from_db_single(self):
+        if self.multi_adduct:
+            return self._expand_adducts()
         single_ch_masses = []
         for i in self.masses_from_db:
             single_ch_masses.append((i[0], self._calc_single_charged(
@@ -339,139 +387,141 @@ class GlycomodWorker:
         # transform to singly charged
         self.masses_from_db_single = self._get_masses_from_db_single()
 
+    def _submitted_masses(self):
+        """Returns [(peak_number, submitted_mass),...] in the order sent to Glycomod"""
+        if self.multi_adduct and not self.masses_from_db_single:
+            # every adduct of masses set directly on masses_from_db,
+            # fills submitted_adducts
+            self.masses_from_db_single = self._expand_adducts()
+        # otherwise masses set directly on masses_from_db are treated as [MH]+
+        return self.masses_from_db_single or self.masses_from_db
+
     def _db_masses_to_text(self):
-        return "\n".join([str(i[1]) for i in self.masses_from_db_single])
+        return "\n".join([str(i[1]) for i in self._submitted_masses()])
 
-    def _fetch_gmod_data(self):
-        masses_as_text = self._db_masses_to_text()
-        gmod_form = self._build_gm_form(masses_as_text)
+    def _post_form(self, gmod_form) -> requests.Response:
         head = {
             "User-Agent": self.cfg["UA"],
             'Content-Type': gmod_form.content_type
         }
-        resp = requests.post(
-            self.cfg["gmod_post_link"], headers=head, data=gmod_form)
-        self.soup = BeautifulSoup(resp.content, 'html5lib')
+        resp = (self.session or requests).post(
+            self.cfg["gmod_post_link"],
+            headers=head,
+            data=gmod_form,
+            stream=True)
+        resp.raise_for_status()
+        return resp
+
+    def _search_masses(self, form_fields, masses_text):
+        """Returns GlycomodRecord list for masses_text searched with form_fields,
+        safe to call from other threads (no worker state is changed)"""
+        if self.client:
+            return self.client.search(
+                form_fields, masses_text, registry=self.registry)
+        fields = dict(form_fields)
+        fields["Masses"] = "\n".join(masses_text)
+        with self._post_form(MultipartEncoder(fields=fields)) as resp:
+            # parsed while it is being downloaded
+            return list(
+                iter_gm_records(
+                    resp.iter_content(chunk_size=65536), self.registry))
+
+    def _lookup_records(self, masses_text):
+        """Returns ({index: GlycomodRecord}, indices of missing masses) for
+        masses_text served from earlier runs in db (reuse_results)
+        and from cache, masses missing in both have to be searched"""
+        served = {}
+        if self.reuse_results:
+            served = self.db.lookup_records(self.form_fields,
+                                            [float(i) for i in masses_text])
+            self.reused += len(served)
+        missing = [i for i in range(len(masses_text)) if i not in served]
+        if self.cache and missing:
+            cached = self.cache.lookup(self.form_fields,
+                                       [float(masses_text[i]) for i in missing])
+            served.update((missing[i], j) for i, j in cached.items())
+            missing = [i for i in missing if i not in served]
+        return served, missing
+
+    def _search_fields(self):
+        """Returns form fields missing masses are searched with"""
+        if self.cache:
+            return self.cache.fetch_fields(self.form_fields, "")
+        return self.form_fields
+
+    def _merge_records(self, masses_text, served, missing, records) -> list:
+        """Returns GlycomodRecord list for masses_text from served records
+        and records searched for missing masses (cached if cache is set)"""
+        if self.cache and missing:
+            records = self.cache.store(self.form_fields, records)
+        served.update(zip(missing, records))
+        self.logger.debug(
+            f"Served {len(masses_text) - len(missing)} masses from db/cache, searched {len(missing)}"
+        )
+        return [served[i] for i in range(len(masses_text))]
+
+    def _fetch_records(self, masses_text) -> list:
+        """Returns GlycomodRecord list for masses_text,
+        reused from db, served from cache or searched"""
+        served, missing = self._lookup_records(masses_text)
+        records = []
+        if missing:
+            records = self._search_masses(self._search_fields(),
+                                          [masses_text[i] for i in missing])
+        return self._merge_records(masses_text, served, missing, records)
+
+    def _fetch_gmod_data(self):
+        """Fills records for all submitted masses (see _fetch_records)"""
+        self._build_gm_form(self._db_masses_to_text())
+        self.reused = 0
+        self.records = self._fetch_records(
+            [str(i[1]) for i in self._submitted_masses()])
 
     def _parse_gm_html(self) -> list:
-        """Parses HTML for relevant data about glycan compositions"""
+        """Parses HTML soup into GlycomodRecord objects,
+        fetched responses are parsed by _search_masses"""
         if self.soup:
-            items = []
-            glycans_list = []
-            for hr in self.soup.find_all("hr"):
-                for item in hr.find_next_siblings():
-                    if item.name == 'hr':
-                        break
-                    items.append(item.text)
-            # this is silly
-            clean_text = ''.join(items).replace(u'\nglycoform mass\nΔmass (Dalton)\nstructure\ntype\nLinks', "")\
-                .replace("high_manUniCarbKB", "").replace("hybrid/complexUniCarbKB", "").\
-                replace(" -UniCarbKB", "").replace("high_man", "").replace("hybrid/complex", "").\
-                replace("paucimannose", "").\
-                replace(" -", "").\
-                replace("\n\n\n\nSIB Swiss Institute of Bioinformatics | Disclaimer", "").\
-                replace("Back to the Top\n\n", "")
-            unprocessed_strings = clean_text.split(
-                ' found.',
-                clean_text.count('found.') - 1)
-            for i in unprocessed_strings:
-                ll = i.split("\n")
-                ll2 = []
-                for j in range(len(ll)):
-                    if len(ll[j]) > 1:
-                        ll2.append(ll[j])
-                glycans_list.append(ll2)
-            self.parsed_data = glycans_list
+            self.records = records_from_lines(
+                parse_gm_soup(self.soup), self.registry)
         else:
             raise ValueError("NO GLYCOMOD DATA WAS FETCHED.")
 
     def _create_glycan_objects(self):
-        """Creates SubmittedMass objects from parsed html data"""
-        for i in range(len(self.parsed_data)):
-            # masses_from_db: [(peak_number, user_mass),...]
-            peak_num = self.masses_from_db[i][0]
-            submitted = 0.0
-            compositions = []
-            for element in self.parsed_data[i]:
-                if element.startswith('User mass: '):
-                    submitted = element[len('User mass: '):]
-                    if " " in submitted:
-                        submitted = "".join(submitted.split())
-                    if submitted != self.masses_from_db[i][1]:
-                        self.logger.error(f"## Mismatched peak number and submitted mass\n" \
-                            f"## Mass from peak data: {self.masses_from_db[i][1]}, " \
-                            f"type: {type(self.masses_from_db[i][1])}\n" \
-                            f"## User mass from html: {submitted}, " \
-                            f"type: {type(submitted)}\n"
-                            f"## peaknumber: {peak_num}\n##\n## SETTING PEAKNUM TO 0")
-                        peak_num = 0
-                if element[0].isdigit():
-                    if "0 structures" in element:
-                        compositions.append(
-                            GlycomodComposition(
-                                theoretical_MH=0.0,
-                                delta=1000.0,
-                                long_notation="NOT FOUND",
-                                short_notation="NOT FOUND",
-                                theoretical_MTagH=0.0,
-                                theoretical_MTagNa=0.0,
-                                theoretical_MTagK=0.0,
-                                theoretical_MTagH2=0.0,
-                                theoretical_MTagHNa=0.0,
-                                theoretical_MTagHK=0.0,
-                                theoretical_MTagNa2=0.0,
-                                theoretical_MTagNH4=0.0,
-                            ))
-                    elif "structure" not in element:
-                        split_index = element.index("(")
-                        num_str, comp_str = element[:split_index:], element[
-                            split_index:]
-                        # find returns -1 if not found
-                        if num_str.find("-") > 0:
-                            numbers = [
-                                num_str[:num_str.index("-")],
-                                num_str[num_str.index("-"):]
-                            ]
-                        else:
-                            # if positive, python handles .17 as 0.17
-                            numbers = [
-                                num_str[:num_str.rindex(".")],
-                                num_str[num_str.rindex("."):]
-                            ]
-                        comp_dict = string_to_dict(comp_str)
-                        # if self.use_avg_vals: # TODO
-                        #    raise NotImplementedError
-                        adduct_ions = calc_default_adducts_mono(
-                            comp_dict,
-                            self.cfg,
-                            reducing_end=self.reducing_end_tag)
-                        compositions.append(
-                            GlycomodComposition(
-                                theoretical_MH=float(numbers[0]),
-                                theoretical_MTagH=adduct_ions["H+"],
-                                theoretical_MTagNa=adduct_ions["Na+"],
-                                theoretical_MTagK=adduct_ions["K+"],
-                                theoretical_MTagH2=adduct_ions["2H2+"],
-                                theoretical_MTagHNa=adduct_ions["HNa2+"],
-                                theoretical_MTagHK=adduct_ions["HK2+"],
-                                theoretical_MTagNa2=adduct_ions["2Na2+"],
-                                theoretical_MTagNH4=adduct_ions["NH4+"],
-                                delta=float(numbers[1]),
-                                long_notation=comp_str,
-                                short_notation=truncated_str_from_dict(
-                                    comp_dict)))
-            self.compositions.append(
-                SubmittedMass(
-                    experimental_mass=float(submitted),
-                    peak_number=int(peak_num),
-                    adduct=self.adduct_info[0],
-                    adduct_mass=self.adduct_info[1],
-                    red_end_tag=self.reducing_end_tag,
-                    red_end_tag_mass=self.reducing_end_mass,
-                    glycomod_structures=compositions))
+        """Fills result store from records"""
+        self._add_records(self.compositions, self._submitted_masses(),
+                          self.records, self.submitted_adducts)
+
+    def _add_records(self, store, submitted_masses, records, adducts):
+        """Adds records of submitted_masses [(peak_number, user_mass),...]
+        to store, adducts [(adduct, adduct_mass, observed m/z),...] are used
+        if multi_adduct - the observed m/z is stored as experimental mass,
+        user_mass (its [M+H]+ equivalent) as submitted mass"""
+        for i, record in enumerate(records):
+            peak_num = submitted_masses[i][0]
+            adduct, adduct_mass = self.adduct_info
+            measured = record.user_mass
+            if self.multi_adduct:
+                adduct, adduct_mass, measured = adducts[i]
+            if record.user_mass != float(submitted_masses[i][1]):
+                self.logger.error(f"## Mismatched peak number and submitted mass\n" \
+                    f"## Mass from peak data: {submitted_masses[i][1]}, " \
+                    f"type: {type(submitted_masses[i][1])}\n" \
+                    f"## User mass from html: {record.user_mass}\n"
+                    f"## peaknumber: {peak_num}\n##\n## SETTING PEAKNUM TO 0")
+                peak_num = 0
+            mass_index = store.add_mass(
+                peak_num, measured, adduct, adduct_mass, record.header,
+                submitted_mass=record.user_mass)
+            # if self.use_avg_vals: # TODO
+            #    raise NotImplementedError
+            for hit in record.hits:
+                store.add_hit(mass_index, hit.theoretical_MH, hit.delta,
+                              self.registry.get(hit.long_notation))
+            if not record.hits:
+                store.add_not_found(mass_index)
 
     def _prepare_results(self):
-        return list(concat([i.prep_db_out() for i in self.compositions]))
+        return self.compositions.db_rows()
 
     def _db_masses_to_dict(self):
         masses_dict = OrderedDict()
@@ -482,29 +532,119 @@ class GlycomodWorker:
                 masses_dict[i[0]] = [i[1]]
         return masses_dict
 
-    # TODO
     def _save_results(self):
-        if self.compositions:
-            results = self._prepare_results()
-            inputted_masses_dict = self._db_masses_to_dict()
-            try:
-                self.db.insert_hist(inputted_masses_dict, self.form_fields, 1)
-                self.db.insert_result(results)
-            except Exception as e:
-                print("STH WENT WRONG WHILE INSERTING", e)
-
-    def run(self):
-        """Run GlycomodWorker search and report results"""
-        self._fetch_gmod_data()
-        self._parse_gm_html()
-        self._create_glycan_objects()
-        comps_dc = [i._asdict() for i in self.compositions]
-        pprint(comps_dc)
+        """Saves the run and all compositions in one transaction,
+        returns run_id, raises RuntimeError if nothing could be saved"""
+        if not self.compositions:
+            return None
+        # same for all masses searched with form_fields
+        header = next((i for i in self.compositions.headers if i), None)
+        run_id = self.db.insert_run(self._db_masses_to_dict(),
+                                    self.form_fields,
+                                    self._prepare_results(),
+                                    header=header)
+        if run_id is None:
+            raise RuntimeError(
+                f"FAILED SAVING RESULTS of {len(self.compositions)} masses")
+        return run_id
+
+    def iter_run(self, chunk_size=500, csv_file=None, text_file=None,
+                 prefetch=4):
+        """Runs Glycomod search chunk by chunk and yields results of every
+        chunk (ResultStore, behaves as list of SubmittedMass) as soon as
+        it is searched. Up to prefetch chunks are searched at once, ahead
+        of the chunk being yielded. compositions holds the latest chunk,
+        memory does not grow with the number of masses - output_csv and
+        output_text raise RuntimeError after a run of several chunks,
+        pass csv_file/text_file to export all of them.
+        A single chunk is saved with its run in one transaction (insert_run),
+        chunks of a longer run are saved one by one and history.finished is
+        set once the last chunk is saved, so an interrupted run is never
+        reused (reuse_results). Searching stops with RuntimeError
+        if a chunk can not be saved.
+        param::chunk_size submitted masses per chunk, None searches all at once
+        param::csv_file open text file, chunks are appended as csv rows
+            (header written with the first chunk)
+        param::text_file open text file, chunks are appended as text report
+            ### EXAMPLE ###
+            >>>with open("results.csv", "w", newline="") as f:
+            >>>    for chunk in gw.iter_run(chunk_size=100, csv_file=f):
+            >>>        print(f"{len(chunk)} masses searched")
+        """
+        submitted = self._submitted_masses()
+        chunk_size = chunk_size or max(len(submitted), 1)
+        starts = range(0, len(submitted), chunk_size)
+        self._build_gm_form(self._db_masses_to_text())
+        self.reused = 0
+        fields = self._search_fields()
+        self.chunked = len(starts) > 1
+        executor = ThreadPoolExecutor(max_workers=max(prefetch, 1))
+
+        def submit(start):
+            # db and cache are read here, only searches run in executor
+            masses_text = [str(i[1]) for i in submitted[start:start + chunk_size]]
+            served, missing = self._lookup_records(masses_text)
+            search = None
+            if missing:
+                search = executor.submit(self._search_masses, fields,
+                                         [masses_text[i] for i in missing])
+            return start, masses_text, served, missing, search
+
+        pending = deque(submit(i) for i in starts[:max(prefetch, 1)])
+        queued = len(pending)
+        run_id = None
+        header = None
         try:
-            self._save_results()
-        except EnvironmentError as e:
-            print("DIS VENT RONG SEVING RIZALTS", e)
+            while pending:
+                start, masses_text, served, missing, search = pending.popleft()
+                if queued < len(starts):
+                    pending.append(submit(starts[queued]))
+                    queued += 1
+                self.records = self._merge_records(
+                    masses_text, served, missing,
+                    search.result() if search else [])
+                end = start + len(masses_text)
+                self.compositions = ResultStore(self.reducing_end_tag,
+                                                self.reducing_end_mass)
+                self._add_records(self.compositions, submitted[start:end],
+                                  self.records, self.submitted_adducts[start:end])
+                header = header or next(
+                    (i for i in self.compositions.headers if i), None)
+                if self.db is not None and len(starts) == 1:
+                    self._save_results()
+                elif self.db is not None:
+                    if run_id is None:
+                        run_id = self.db.insert_hist(self._db_masses_to_dict(),
+                                                     self.form_fields, 0)
+                    if run_id is None or not self.db.insert_result(
+                            self._prepare_results(), run_id):
+                        raise RuntimeError(
+                            f"FAILED SAVING RESULTS, search stopped after {start} of {len(submitted)} masses"
+                        )
+                if csv_file is not None:
+                    self.compositions.write_csv(
+                        csv_file, self.cfg["col_names"], header=start == 0)
+                if text_file is not None:
+                    if start:
+                        text_file.write("\n\n")
+                    self._write_text(text_file)
+                self.logger.debug(
+                    f"Searched masses {start + 1}-{end} of {len(submitted)}")
+                yield self.compositions
+        finally:
+            # searches prefetched for chunks that will not be yielded
+            for *_, search in pending:
+                if search is not None:
+                    search.cancel()
+            executor.shutdown(wait=True)
+        if run_id is not None:
+            self.db.finish_run(run_id, header)
 
+    def run(self):
+        """Run GlycomodWorker search and save results in one transaction,
+        compositions holds all results (see iter_run for chunked runs)"""
+        for _ in self.iter_run(chunk_size=None):
+            pass
 
 if __name__ == "__main__":
     # remove "." in data_types and utils imports
@@ -0,0 +1,184 @@
+# -*- coding: UTF-8 -*-
+import queue
+import logging
+import threading
+
+_STOP = object()
+
+
+class PeakBatch:
+    """PeakBatch coalesces queued peak changes into one write:
+    removing a peak that is still waiting to be inserted cancels the insert,
+    clear drops everything queued before it, stored spectra and picked peaks
+    of a spectrum are replaced by later ones"""
+
+    def __init__(self):
+        self.clear = False
+        self.inserts = []
+        self.deletes = []
+        self.spectra = {}  # {(path, ret_time): store_spectrum kwargs}
+        self.picked = {}  # {(path, ret_time): (peak_num, peaks)}
+
+    def __len__(self):
+        return (int(self.clear) + len(self.inserts) + len(self.deletes) +
+                len(self.spectra) + len(self.picked))
+
+    def add(self, op, args):
+        if op == "insert":
+            self.inserts.extend(args)
+        elif op == "delete":
+            for row in args:
+                try:
+                    self.inserts.remove(row)
+                except ValueError:
+                    self.deletes.append(row)
+        elif op == "clear":
+            self.clear = True
+            self.inserts = []
+            self.deletes = []
+        elif op == "spectrum":
+            self.spectra[(args["path"], args["ret_time"])] = args
+        elif op == "picked":
+            path, ret_time, peak_num, peaks = args
+            self.picked[(path, ret_time)] = (peak_num, peaks)
+        else:
+            raise ValueError(f"Unknown peak queue operation [{op}]")
+
+
+class PeakWriteQueue:
+    """PeakWriteQueue persists picked peaks write-behind.
+
+    Changes from any thread (all open ScanWindows) and spectra opened
+    by the App are queued and return immediately, a background thread collects what is queued within linger
+    seconds, coalesces it (PeakBatch) and writes curr_ephem changes
+    in one transaction (DB.write_current_masses).
+    flush() waits until everything queued so far is written,
+    close() flushes and stops the thread - call it on exit,
+    changes made after close() are written directly on the calling thread.
+
+    param::db dbutil.DB, the thread writes through its own connection
+    param::linger seconds to wait for more changes before writing
+    param::max_batch changes written at most in one transaction
+        ### EXAMPLE ###
+        >>>peaks = PeakWriteQueue(db)
+        >>>peaks.insert([(1, 911.3, 1), (1, 1057.33, 1)])
+        >>>peaks.delete([(1, 911.3, 1)])
+        >>>peaks.close()
+        >>>db.read_current_masses()
+        >>>[(1, 1057.33, 1)]
+    """
+
+    def __init__(self, db, linger=0.05, max_batch=10000):
+        self.logger = logging.getLogger(name="PeakWriteQueue")
+        self.db = db
+        self.linger = linger
+        self.max_batch = max_batch
+        self.transactions = 0
+        self._ops = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                                        name="PeakWriteQueue",
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _put(self, item):
+        if self._closed:
+            # ScanWindows may outlive the App that closed the queue
+            batch = PeakBatch()
+            batch.add(*item)
+            self._write(batch)
+            return
+        self._ops.put(item)
+
+    def insert(self, peaks):
+        """param::peaks [(peak, mass, charge)...]"""
+        self._put(("insert", [tuple(i) for i in peaks]))
+
+    def delete(self, peaks):
+        """Deletes one stored row per (peak, mass, charge)"""
+        self._put(("delete", [tuple(i) for i in peaks]))
+
+    def clear(self):
+        self._put(("clear", None))
+
+    def store_spectrum(self, path, ret_time, mz, intensity, scan_type="",
+                       peak_num=None, compress=False):
+        """Queues DB.store_spectrum, spectra are written before picked peaks
+        of the same batch"""
+        self._put(("spectrum", dict(path=path, ret_time=ret_time, mz=mz,
+                                    intensity=intensity, scan_type=scan_type,
+                                    peak_num=peak_num, compress=compress)))
+
+    def store_picked_peaks(self, path, ret_time, peak_num, peaks):
+        """Queues DB.store_picked_peaks, only the last peaks of a spectrum
+        within a batch are written"""
+        self._put(("picked", (path, ret_time, peak_num, list(peaks))))
+
+    def flush(self, timeout=None) -> bool:
+        """Blocks until changes queued so far are written,
+        returns False on timeout"""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._put(("flush", done))
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Writes queued changes and stops the writer thread"""
+        if self._closed:
+            return
+        self._put(("stop", None))
+        self._closed = True
+        self._thread.join(timeout)
+
+    def _collect(self):
+        """Returns (PeakBatch, flush events, stop) of queued changes"""
+        batch, events, stop = PeakBatch(), [], False
+        op, args = self._ops.get()
+        while True:
+            if op == "flush":
+                events.append(args)
+            elif op == "stop":
+                stop = True
+            else:
+                batch.add(op, args)
+            if stop or len(batch) >= self.max_batch:
+                break
+            try:
+                op, args = self._ops.get(timeout=self.linger)
+            except queue.Empty:
+                break
+        return batch, events, stop
+
+    def _write(self, batch):
+        if batch.clear or batch.inserts or batch.deletes:
+            self.db.write_current_masses(batch.inserts, batch.deletes,
+                                         batch.clear)
+            self.transactions += 1
+        # picked peaks update rows of stored spectra
+        for spectrum in batch.spectra.values():
+            self.db.store_spectrum(**spectrum)
+        for (path, ret_time), (peak_num, peaks) in batch.picked.items():
+            self.db.store_picked_peaks(path, ret_time, peak_num, peaks)
+        self.logger.debug(
+            f"Wrote {len(batch.inserts)} inserts, {len(batch.deletes)} deletes, "
+            f"{len(batch.spectra)} spectra, {len(batch.picked)} picked peak lists")
+
+    def _run(self):
+        try:
+            while True:
+                batch, events, stop = self._collect()
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    self.logger.error(f"FAILED WRITING PEAKS: {e}")
+                for done in events:
+                    done.set()
+                if stop:
+                    return
+        finally:
+            self.db.close_thread()